@@ -0,0 +1,122 @@
+import os
+import pandas as pd
+
+# 保存形式ごとの拡張子
+ARTIFACT_EXTENSIONS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'csv': '.csv',
+}
+
+# ダウンロードボタン用の MIME タイプ
+ARTIFACT_MIME_TYPES = {
+    'parquet': 'application/octet-stream',
+    'feather': 'application/octet-stream',
+    'csv': 'text/csv',
+}
+
+def artifact_format_from_name(name):
+    """
+    ファイル名の拡張子から保存形式を判定する関数。未知の拡張子は csv とみなす。
+    """
+    ext = os.path.splitext(name)[1].lower()
+    for artifact_format, artifact_ext in ARTIFACT_EXTENSIONS.items():
+        if ext == artifact_ext:
+            return artifact_format
+    return 'csv'
+
+def save_artifact(df, save_dir, name, artifact_format='parquet', compression=None):
+    """
+    データフレームを指定した形式で保存する関数。
+
+    Parameters:
+    - df (pd.DataFrame): 保存するデータフレーム。
+    - save_dir (str): 保存先ディレクトリ。
+    - name (str): 拡張子を除いたファイル名。
+    - artifact_format (str, optional): 'parquet', 'feather', 'csv' のいずれか。デフォルトは 'parquet'。
+    - compression (str, optional): 圧縮方式（parquet: 'snappy', 'zstd', 'gzip' など / feather: 'lz4', 'zstd', 'uncompressed'）。
+      None の場合は各形式のデフォルト。csv では無視される。
+
+    Returns:
+    - str: 保存したファイルのパス。
+    """
+    if artifact_format not in ARTIFACT_EXTENSIONS:
+        raise ValueError(f"未対応の保存形式です: {artifact_format}")
+
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    path = os.path.join(save_dir, name + ARTIFACT_EXTENSIONS[artifact_format])
+
+    if artifact_format == 'parquet':
+        if compression is None:
+            df.to_parquet(path, index=False)
+        else:
+            df.to_parquet(path, index=False, compression=compression)
+    elif artifact_format == 'feather':
+        # feather はデフォルトのインデックスしか保存できない
+        df.reset_index(drop=True).to_feather(path, compression=compression)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+def load_artifact(source, columns=None, artifact_format=None):
+    """
+    保存した成果物（またはアップロードされたファイル）をデータフレームとして読み込む関数。
+
+    Parameters:
+    - source (str or file-like): ファイルパス、または name 属性を持つファイルオブジェクト。
+    - columns (list, optional): 読み込むカラムのリスト。None の場合は全カラム。
+    - artifact_format (str, optional): 保存形式。None の場合はファイル名の拡張子から判定する。
+
+    Returns:
+    - pd.DataFrame: 読み込んだデータフレーム。
+    """
+    if artifact_format is None:
+        name = source if isinstance(source, str) else getattr(source, 'name', '')
+        artifact_format = artifact_format_from_name(name)
+
+    if artifact_format == 'parquet':
+        return pd.read_parquet(source, columns=columns)
+    if artifact_format == 'feather':
+        return pd.read_feather(source, columns=columns)
+    return pd.read_csv(source, usecols=columns)
+
+def iter_artifact_chunks(source, columns=None, chunk_size=100_000, artifact_format=None):
+    """
+    成果物（またはデータフレーム）を行方向のチャンクに分けて読み込むジェネレータ。
+    parquet / feather はレコードバッチ単位、csv は chunksize で読み込むため、ファイル全体をメモリに載せない。
+
+    Parameters:
+    - source (pd.DataFrame, str or file-like): データフレーム、ファイルパス、またはファイルオブジェクト。
+    - columns (list, optional): 読み込むカラムのリスト。None の場合は全カラム。
+    - chunk_size (int, optional): 1チャンクの行数。デフォルトは 100,000。
+    - artifact_format (str, optional): 保存形式。None の場合はファイル名の拡張子から判定する。
+
+    Yields:
+    - pd.DataFrame: チャンクのデータフレーム。
+    """
+    if isinstance(source, pd.DataFrame):
+        df = source if columns is None else source[columns]
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+        return
+
+    if artifact_format is None:
+        name = source if isinstance(source, str) else getattr(source, 'name', '')
+        artifact_format = artifact_format_from_name(name)
+
+    if artifact_format == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    elif artifact_format == 'feather':
+        import pyarrow as pa
+        reader = pa.ipc.open_file(pa.memory_map(source) if isinstance(source, str) else source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for start in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(start, chunk_size).to_pandas()
+    else:
+        yield from pd.read_csv(source, usecols=columns, chunksize=chunk_size)
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import platform
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+import streamlit as st
+from .utils import load_data
+from .artifacts import load_artifact
+from .profiling import profile_session
+from .execute import execute_preprocessing, execute_training, execute_prediction
+
+# 規模ごとの合成データの設定
+# n_rows は売上データの行数、n_stores × n_products がカタログ（店舗 × 商品）の行数になる
+BENCHMARK_TIERS = {
+    'small': {'n_rows': 1_000, 'n_stores': 10, 'n_products': 50, 'n_categories': 5,
+              'num_iterations': 50, 'sales_chunksize': None},
+    'medium': {'n_rows': 100_000, 'n_stores': 50, 'n_products': 500, 'n_categories': 20,
+               'num_iterations': 200, 'sales_chunksize': None},
+    'large': {'n_rows': 10_000_000, 'n_stores': 500, 'n_products': 2_000, 'n_categories': 50,
+              'num_iterations': 500, 'sales_chunksize': 1_000_000},
+}
+
+# 合成データの売上期間（execute_preprocessing のデフォルトの n_months = 22 に合わせる）
+SALES_START_DATE = '2018-01-01'
+SALES_END_DATE = '2019-10-31'
+
+def generate_synthetic_data(data_dir, n_rows, n_stores, n_products, n_categories=5, seed=0,
+                            chunk_size=1_000_000):
+    """
+    preprocess_data が想定するスキーマで、sales_history.csv, item_categories.csv, category_names.csv,
+    test.csv を生成する関数。売上データは chunk_size 行ずつ追記するため、行数が多くてもメモリを抑えられる。
+
+    商品ごとに基準価格と人気度、店舗ごとに規模を決め、売上個数は人気度 × 規模のポアソン分布から生成する
+    （一部は返品として負の値にする）。
+
+    Parameters:
+    - data_dir (str): 出力先ディレクトリ（末尾に '/' を付けて load_data に渡せる形式）。
+    - n_rows (int): 売上データの行数。
+    - n_stores (int): 店舗数。
+    - n_products (int): 商品数。
+    - n_categories (int, optional): 商品カテゴリ数。デフォルトは5。
+    - seed (int, optional): 乱数のシード。デフォルトは0。
+    - chunk_size (int, optional): 一度に生成する売上データの行数。デフォルトは 1,000,000。
+
+    Returns:
+    - dict: 各ファイルのパス。
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = {name: os.path.join(data_dir, f'{name}.csv')
+             for name in ['sales_history', 'item_categories', 'category_names', 'test']}
+
+    product_ids = np.arange(1, n_products + 1) * 10
+    store_ids = np.arange(n_stores)
+    category_ids = np.arange(n_categories)
+
+    pd.DataFrame({
+        '商品ID': product_ids,
+        '商品カテゴリID': rng.choice(category_ids, n_products),
+    }).to_csv(paths['item_categories'], index=False)
+    pd.DataFrame({
+        '商品カテゴリID': category_ids,
+        '商品カテゴリ名': [f'カテゴリ{category_id:03d}' for category_id in category_ids],
+    }).to_csv(paths['category_names'], index=False)
+
+    base_price = rng.integers(1, 100, n_products) * 50
+    product_weight = rng.pareto(1.5, n_products) + 0.1
+    product_weight /= product_weight.sum()
+    store_scale = rng.uniform(0.5, 2.0, n_stores)
+    dates = pd.date_range(SALES_START_DATE, SALES_END_DATE, freq='D').strftime('%Y-%m-%d').to_numpy()
+
+    # 売上データは chunk_size 行ずつ追記する
+    for chunk_index, start in enumerate(range(0, n_rows, chunk_size)):
+        size = min(chunk_size, n_rows - start)
+        products = rng.choice(n_products, size, p=product_weight)
+        stores = rng.integers(0, n_stores, size)
+        num = rng.poisson(store_scale[stores]) + 1
+        num[rng.random(size) < 0.01] = -1
+        price = base_price[products] + rng.integers(-2, 3, size) * 10
+        pd.DataFrame({
+            '日付': dates[rng.integers(0, len(dates), size)],
+            '店舗ID': store_ids[stores],
+            '商品ID': product_ids[products],
+            '商品価格': price,
+            '売上個数': num,
+        }).to_csv(paths['sales_history'], mode='w' if chunk_index == 0 else 'a', header=chunk_index == 0, index=False)
+
+    # テストデータは全店舗 × 全商品（load_data は先頭列をインデックスとして読み込む）
+    pd.DataFrame({
+        '商品ID': np.repeat(product_ids, n_stores),
+        '店舗ID': np.tile(store_ids, n_products),
+    }).to_csv(paths['test'])
+    return paths
+
+def benchmark_environment():
+    # 実行環境（ベースラインと比較する際の参考情報）
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'lightgbm': lgb.__version__,
+    }
+
+def _stage_times(records):
+    # 同じステージが複数回呼ばれた場合は合計する（入れ子の関数も別のステージとして扱う）
+    times = {}
+    for record in records:
+        times[record['stage']] = times.get(record['stage'], 0.0) + record['wall_time_sec']
+    return times
+
+def _run_once(data_dir, work_dir, tier_config, num_threads):
+    sales_chunksize = tier_config['sales_chunksize']
+    times = {}
+    output_dir = os.path.join(work_dir, 'output')
+    with profile_session() as records:
+        if sales_chunksize is None:
+            sales_df, item_df, category_df, test_df = load_data(data_dir)
+        else:
+            # 売上データはファイルのまま渡し、execute_preprocessing の中で分割して読み込む
+            sales_df = data_dir + 'sales_history.csv'
+            item_df = pd.read_csv(data_dir + 'item_categories.csv')
+            category_df = pd.read_csv(data_dir + 'category_names.csv')
+            test_df = pd.read_csv(data_dir + 'test.csv', index_col=0)
+        start = time.perf_counter()
+        execute_preprocessing(sales_df, item_df, category_df, test_df, output_dir, sales_chunksize=sales_chunksize)
+        preprocessing_time = time.perf_counter() - start
+    times.update(_stage_times(records))
+    times['execute_preprocessing'] = preprocessing_time
+
+    train_df = load_artifact(st.session_state['train_path'])
+    valid_df = load_artifact(st.session_state['validation_path'])
+    model_dir = os.path.join(work_dir, 'model')
+    start = time.perf_counter()
+    execute_training(train_df, valid_df, model_dir, tier_config['num_iterations'],
+                     profile='balanced', num_threads=num_threads)
+    times['execute_training'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(os.path.join(model_dir, 'lgbm_model.txt'), 'rb') as model_file:
+        execute_prediction(model_file, st.session_state['test_path'], os.path.join(work_dir, 'prediction'),
+                           num_threads=num_threads or 0)
+    times['execute_prediction'] = time.perf_counter() - start
+    return times
+
+def run_benchmark(tier, work_dir, repeat=1, seed=0, num_threads=None, tier_config=None):
+    """
+    合成データで execute_preprocessing の各ステージと execute_training, execute_prediction の実行時間を計測する関数。
+    合成データは規模とシードごとに work_dir/data に一度だけ生成し、以降は再利用する。
+
+    Parameters:
+    - tier (str): BENCHMARK_TIERS のキー。
+    - work_dir (str): 合成データと出力の保存先。
+    - repeat (int, optional): 繰り返し回数。ステージごとに最短の時間を結果とする。デフォルトは1。
+    - seed (int, optional): 合成データの乱数のシード。デフォルトは0。
+    - num_threads (int, optional): 学習・予測のスレッド数。None の場合は LightGBM のデフォルト。
+    - tier_config (dict, optional): BENCHMARK_TIERS の設定を上書きする値。
+
+    Returns:
+    - dict: tier, created_at, environment, config, stages（ステージ名と秒数の辞書）を持つ結果。
+    """
+    config = dict(BENCHMARK_TIERS[tier], **(tier_config or {}))
+    data_name = f"{tier}_{config['n_rows']}_{config['n_stores']}_{config['n_products']}_{config['n_categories']}_{seed}"
+    data_dir = os.path.join(work_dir, 'data', data_name) + '/'
+    if not os.path.exists(os.path.join(data_dir, 'test.csv')):
+        print(f"合成データを生成しています: {data_dir}")
+        generate_synthetic_data(data_dir, config['n_rows'], config['n_stores'], config['n_products'],
+                                config['n_categories'], seed=seed)
+
+    stages = {}
+    for _ in range(repeat):
+        for stage, seconds in _run_once(data_dir, os.path.join(work_dir, 'runs', tier), config, num_threads).items():
+            stages[stage] = min(stages.get(stage, seconds), seconds)
+
+    return {
+        'tier': tier,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': benchmark_environment(),
+        'config': dict(config, seed=seed, repeat=repeat, num_threads=num_threads),
+        'stages': stages,
+    }
+
+def save_benchmark_result(result, path):
+    result_dir = os.path.dirname(path)
+    if result_dir and not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+def load_benchmark_result(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compare_benchmark_results(result, baseline, threshold=0.2, min_seconds=0.05):
+    """
+    ベースラインと比べてステージごとの実行時間を比較する関数。
+    ratio が 1 + threshold を超え、かつ差が min_seconds 以上のステージを遅くなったものとする
+    （短いステージの誤差で判定しないため）。
+
+    Returns:
+    - pd.DataFrame: stage, baseline_sec, current_sec, ratio, slowdown を持つデータフレーム。
+    """
+    rows = []
+    for stage in list(baseline['stages']) + [stage for stage in result['stages'] if stage not in baseline['stages']]:
+        baseline_sec = baseline['stages'].get(stage)
+        current_sec = result['stages'].get(stage)
+        ratio = current_sec / baseline_sec if baseline_sec and current_sec is not None else None
+        rows.append({
+            'stage': stage,
+            'baseline_sec': baseline_sec,
+            'current_sec': current_sec,
+            'ratio': ratio,
+            'slowdown': bool(ratio is not None and ratio > 1 + threshold and current_sec - baseline_sec >= min_seconds),
+        })
+    return pd.DataFrame(rows)
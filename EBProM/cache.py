@@ -0,0 +1,146 @@
+import os
+import hashlib
+import pickle
+import tempfile
+import pandas as pd
+
+# ステージの実装を変更した場合はこの値を上げて既存のキャッシュを無効化する
+CACHE_VERSION = 2
+
+def frame_fingerprint(*frames):
+    """
+    データフレームの内容（値・インデックス・カラム名・型）からハッシュ値を計算する関数。
+
+    Parameters:
+    - frames (pd.DataFrame): ハッシュ化するデータフレーム（複数可）。
+
+    Returns:
+    - str: 16進数のハッシュ値。
+    """
+    hasher = hashlib.sha256()
+    for df in frames:
+        hasher.update(repr(list(df.columns)).encode())
+        hasher.update(repr([str(dtype) for dtype in df.dtypes]).encode())
+        hasher.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return hasher.hexdigest()
+
+def source_fingerprint(source, block_size=1 << 20):
+    """
+    ファイル（パスまたはファイルオブジェクト）の内容からハッシュ値を計算する関数。
+    ブロック単位で読み込むため、ファイル全体をメモリに載せない。
+    """
+    hasher = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                hasher.update(block)
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(block_size), b''):
+            hasher.update(block)
+        source.seek(0)
+    return hasher.hexdigest()
+
+def stage_key(stage_name, parent_key=None, params=None, frames=()):
+    """
+    ステージのキャッシュキーを計算する関数。
+    前段のキー、ステージのパラメータ、ステージが直接受け取るデータフレームの内容から決まる。
+
+    Parameters:
+    - stage_name (str): ステージ名。
+    - parent_key (str, optional): 前段ステージのキャッシュキー。
+    - params (dict, optional): ステージのパラメータ。
+    - frames (list, optional): ステージが直接受け取るデータフレームのリスト。
+
+    Returns:
+    - str: 16進数のキャッシュキー。
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{CACHE_VERSION}:{stage_name}:{parent_key}".encode())
+    hasher.update(repr(sorted((params or {}).items())).encode())
+    if frames:
+        hasher.update(frame_fingerprint(*frames).encode())
+    return hasher.hexdigest()
+
+def _stage_path(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.pkl")
+
+def has_stage(cache_dir, key):
+    # 存在確認だけに使う（読み込むまでに他のセッションに削除される場合があるため、読み込みは try_load_stage で行う）
+    return os.path.exists(_stage_path(cache_dir, key))
+
+def try_load_stage(cache_dir, key):
+    """
+    キャッシュ済みのステージ出力を読み込む関数。読み込んだエントリは最近使用したものとして扱う。
+    他のセッションの削除と競合しないよう、存在確認をせずに読み込み、ファイルがない・読み込めない場合はミスとする。
+
+    Returns:
+    - found (bool): 読み込めた場合は True。
+    - value: 読み込んだ値（ミスの場合は None）。
+    """
+    path = _stage_path(cache_dir, key)
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return False, None
+    touch_cache_file(path)
+    return True, value
+
+def touch_cache_file(path):
+    # 最近使用したものとして更新日時を更新する（既に削除されていた場合は何もしない）
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+def save_stage(cache_dir, key, value, max_cache_bytes=None):
+    """
+    ステージ出力をキャッシュに保存し、必要に応じて古いエントリを削除する関数。
+    一時ファイルに書き込んでから置き換えるため、複数のセッションから同時に保存しても壊れない。
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _stage_path(cache_dir, key))
+    if max_cache_bytes is not None:
+        evict_cache_files(cache_dir, max_cache_bytes)
+
+def evict_cache_files(cache_dir, max_cache_bytes, keep=()):
+    """
+    cache_dir 以下の全てのファイル（ステージ出力の .pkl、datasets/ のバイナリ Dataset、calendar.parquet など）の
+    合計サイズが max_cache_bytes 以下になるまで、最も長く使われていないファイルから削除する関数。
+    書き込み中の一時ファイル（名前に .tmp を含むもの）と keep に指定したパス（これから読み込むファイル）は対象にしない。
+
+    Returns:
+    - list: 削除したファイルの cache_dir からの相対パスのリスト。
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    entries = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            if '.tmp' in name:
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, path in sorted(entries):
+        if total <= max_cache_bytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted.append(os.path.relpath(path, cache_dir))
+    return evicted
@@ -0,0 +1,219 @@
+import time
+import numpy as np
+import pandas as pd
+from lightgbm import Booster
+
+# 欠損値の扱い（LightGBM の missing_type に対応）
+MISSING_TYPES = {'None': 0, 'Zero': 1, 'NaN': 2}
+# LightGBM がゼロとみなす値の範囲
+ZERO_THRESHOLD = 1e-35
+# 出力に指数関数をかける目的関数
+EXP_OBJECTIVES = ('poisson', 'gamma', 'tweedie')
+
+def _flatten_tree(node, arrays):
+    # 木を深さ優先でたどり、ノードを配列に追加する。追加したノードの位置を返す
+    index = len(arrays['feature'])
+    for key in arrays:
+        arrays[key].append(0)
+    if 'leaf_value' in node:
+        # 葉ノードはどちらに分岐しても自分自身に戻る
+        arrays['feature'][index] = 0
+        arrays['threshold'][index] = np.inf
+        arrays['value'][index] = node['leaf_value']
+        arrays['left'][index] = index
+        arrays['right'][index] = index
+        return index
+    arrays['feature'][index] = node['split_feature']
+    arrays['threshold'][index] = node['threshold']
+    arrays['default_left'][index] = node['default_left']
+    arrays['missing_type'][index] = MISSING_TYPES[node['missing_type']]
+    arrays['left'][index] = _flatten_tree(node['left_child'], arrays)
+    arrays['right'][index] = _flatten_tree(node['right_child'], arrays)
+    return index
+
+def _iter_nodes(node):
+    yield node
+    if 'leaf_value' not in node:
+        yield from _iter_nodes(node['left_child'])
+        yield from _iter_nodes(node['right_child'])
+
+def unsupported_model_features(dump):
+    """
+    Booster.dump_model の出力から、predict_compiled で Booster.predict と同じ予測ができない機能を列挙する関数。
+
+    Returns:
+    - list: 未対応の機能の説明のリスト。空の場合は変換できる。
+    """
+    reasons = []
+    if dump['num_tree_per_iteration'] != 1:
+        reasons.append(f"多クラス分類 (num_class={dump['num_class']})")
+    objective, *objective_options = dump['objective'].split()
+    if not (objective.startswith('regression') or objective in ('huber', 'fair', 'quantile', 'mape')
+            or objective in EXP_OBJECTIVES):
+        reasons.append(f"目的関数 {objective}")
+    if 'sqrt' in objective_options:
+        reasons.append("目的変数の平方根での学習 (reg_sqrt)")
+    if dump.get('average_output'):
+        reasons.append("木の出力の平均 (boosting=rf)")
+    nodes = [node for tree in dump['tree_info'] for node in _iter_nodes(tree['tree_structure'])]
+    if any(tree.get('num_cat', 0) > 0 for tree in dump['tree_info']) or \
+            any('decision_type' in node and node['decision_type'] != '<=' for node in nodes):
+        reasons.append("カテゴリ変数の分岐")
+    if any('leaf_coeff' in node for node in nodes):
+        reasons.append("線形木 (linear_tree)")
+    return reasons
+
+def _tree_depth(node):
+    if 'leaf_value' in node:
+        return 0
+    return 1 + max(_tree_depth(node['left_child']), _tree_depth(node['right_child']))
+
+def compile_booster(model, num_iteration=None):
+    """
+    LightGBM のモデルを、全ての木のノードを並べた NumPy 配列に変換する関数。
+
+    葉ノードは left / right に自分自身の位置を持たせる。
+    そのため、全ての木を最大の深さの回数だけ同時にたどれば、全ての行が葉に到達する。
+
+    予測値が Booster.predict と一致しないモデル（多クラス分類、カテゴリ変数の分岐、線形木、
+    未対応の目的関数など）は変換せずに ValueError を送出する。
+    変換したモデルは compile_model.py での比較用で、学習・予測・予測 API では Booster.predict を使う
+    （計測した環境では NumPy での評価のほうが遅いため）。
+
+    Parameters:
+    - model (Booster or str): 学習済みモデル、または execute_training で保存した lgbm_model.txt のパス。
+    - num_iteration (int, optional): 使う木の数。None の場合は Booster.predict と同じく best_iteration まで。
+
+    Returns:
+    - dict: feature, threshold, left, right, value, default_left, missing_type（ノードごと）、
+      roots（木ごとの根の位置）、max_depth、has_missing_split、feature_names、objective を持つ辞書。
+    """
+    booster = Booster(model_file=model) if isinstance(model, str) else model
+    dump = booster.dump_model(num_iteration=num_iteration)
+    reasons = unsupported_model_features(dump)
+    if reasons:
+        raise ValueError(f"変換に対応していないモデルです: {', '.join(reasons)}")
+    objective = dump['objective'].split()[0]
+
+    arrays = {key: [] for key in ['feature', 'threshold', 'left', 'right', 'value', 'default_left', 'missing_type']}
+    roots = [_flatten_tree(tree['tree_structure'], arrays) for tree in dump['tree_info']]
+    max_depth = max((_tree_depth(tree['tree_structure']) for tree in dump['tree_info']), default=0)
+
+    return {
+        'feature': np.array(arrays['feature'], dtype=np.int32),
+        'threshold': np.array(arrays['threshold'], dtype=np.float64),
+        'left': np.array(arrays['left'], dtype=np.int32),
+        'right': np.array(arrays['right'], dtype=np.int32),
+        'value': np.array(arrays['value'], dtype=np.float64),
+        'default_left': np.array(arrays['default_left'], dtype=bool),
+        'missing_type': np.array(arrays['missing_type'], dtype=np.int8),
+        'has_missing_split': any(arrays['missing_type']),
+        'roots': np.array(roots, dtype=np.int32),
+        'max_depth': max_depth,
+        'feature_names': list(dump['feature_names']),
+        'objective': objective,
+    }
+
+def save_compiled_model(compiled, path):
+    # 変換したモデルを npz 形式で保存する
+    np.savez(path, **{key: np.asarray(value) for key, value in compiled.items()})
+
+def load_compiled_model(path):
+    with np.load(path) as data:
+        compiled = {key: data[key] for key in data.files}
+    compiled['max_depth'] = int(compiled['max_depth'])
+    compiled['has_missing_split'] = bool(compiled['has_missing_split'])
+    compiled['feature_names'] = compiled['feature_names'].tolist()
+    compiled['objective'] = str(compiled['objective'])
+    return compiled
+
+def _predict_block(compiled, x):
+    threshold = compiled['threshold']
+    left, right = compiled['left'], compiled['right']
+    n_features = x.shape[1]
+    flat_x = x.ravel()
+    # 行ごとの先頭位置を足して、1次元のインデックスで特徴量の値を取り出す
+    row_offsets = (np.arange(len(x)) * n_features)[:, None]
+    nodes = np.broadcast_to(compiled['roots'], (len(x), len(compiled['roots']))).copy()
+
+    if not compiled['has_missing_split']:
+        # 全ての分岐が missing_type = None の場合、NaN は 0 とみなして比較するだけでよい
+        node_offsets = compiled['feature']
+        for _ in range(compiled['max_depth']):
+            go_left = flat_x[row_offsets + node_offsets[nodes]] <= threshold[nodes]
+            nodes = np.where(go_left, left[nodes], right[nodes])
+        return compiled['value'][nodes].sum(axis=1)
+
+    missing_type = compiled['missing_type']
+    default_left = compiled['default_left']
+    for _ in range(compiled['max_depth']):
+        values = flat_x[row_offsets + compiled['feature'][nodes]]
+        node_missing = missing_type[nodes]
+        # LightGBM と同じく、NaN は missing_type が NaN 以外なら 0 として扱う
+        is_nan = np.isnan(values)
+        values = np.where(is_nan & (node_missing != MISSING_TYPES['NaN']), 0.0, values)
+        is_missing = (((node_missing == MISSING_TYPES['NaN']) & is_nan) |
+                      ((node_missing == MISSING_TYPES['Zero']) & (np.abs(values) <= ZERO_THRESHOLD)))
+        go_left = np.where(is_missing, default_left[nodes], values <= threshold[nodes])
+        nodes = np.where(go_left, left[nodes], right[nodes])
+    return compiled['value'][nodes].sum(axis=1)
+
+def predict_compiled(compiled, data, chunk_size=65_536):
+    """
+    変換したモデルで予測する関数。全ての木を NumPy のインデックス操作でまとめてたどる。
+
+    Parameters:
+    - compiled (dict): compile_booster の出力。
+    - data (pd.DataFrame or np.ndarray): 特徴量。データフレームの場合は feature_names のカラムを学習時の順番で使う。
+    - chunk_size (int, optional): 一度に処理する行数（行数 × 木の数の配列を確保するため）。デフォルトは 65,536。
+
+    Returns:
+    - np.ndarray: 予測値。
+    """
+    if isinstance(data, pd.DataFrame):
+        data = data[compiled['feature_names']]
+    x = np.asarray(data, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[None, :]
+    if not compiled['has_missing_split']:
+        x = np.nan_to_num(x, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    predictions = np.empty(len(x), dtype=np.float64)
+    for start in range(0, len(x), chunk_size):
+        predictions[start:start + chunk_size] = _predict_block(compiled, x[start:start + chunk_size])
+    if compiled['objective'] in EXP_OBJECTIVES:
+        predictions = np.exp(predictions)
+    return predictions
+
+def benchmark_compiled_model(model_path, data, batch_sizes=(1, 10, 100, 1_000, 10_000, 100_000, 1_000_000),
+                             repeat=5, num_threads=0):
+    """
+    Booster.predict と predict_compiled の実行時間と最大誤差をバッチサイズごとに比較する関数。
+    data の行数がバッチサイズより少ない場合は行を繰り返して使う。
+
+    Returns:
+    - pd.DataFrame: バッチサイズごとの native_ms, compiled_ms, speedup, max_abs_diff。
+    """
+    booster = Booster(model_file=model_path)
+    compiled = compile_booster(booster)
+    x = np.asarray(data[compiled['feature_names']] if isinstance(data, pd.DataFrame) else data, dtype=np.float64)
+
+    rows = []
+    for batch_size in batch_sizes:
+        batch = x[np.arange(batch_size) % len(x)]
+        timings = {}
+        for name, predict in [('native', lambda: booster.predict(batch, num_threads=num_threads)),
+                              ('compiled', lambda: predict_compiled(compiled, batch))]:
+            n_repeat = repeat if batch_size < 100_000 else 1
+            start = time.perf_counter()
+            for _ in range(n_repeat):
+                result = predict()
+            timings[name] = (time.perf_counter() - start) / n_repeat * 1000
+            timings[f'{name}_result'] = result
+        rows.append({
+            'batch_size': batch_size,
+            'native_ms': timings['native'],
+            'compiled_ms': timings['compiled'],
+            'speedup': timings['native'] / timings['compiled'],
+            'max_abs_diff': float(np.max(np.abs(timings['native_result'] - timings['compiled_result']))),
+        })
+    return pd.DataFrame(rows)
@@ -0,0 +1,184 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+from .machine_learning import (TARGET_MONTH_COLUMN, DATASET_CACHE_MAX_BYTES, features_and_label, _construct_dataset,
+                               _data_fingerprint, train_by_lightgbm, get_training_params, get_dataset_params)
+from .cache import stage_key, touch_cache_file, evict_cache_files
+from .feature_store import FeatureMatrix
+from .parallel import run_task_graph
+
+def target_month_order(target_month_nums):
+    """
+    予測対象月の通し番号 (target_month_num) を時系列順に並べる関数。
+    month_target は年をまたぐと同じ値になるため、fold の順序には通し番号を使う。
+    """
+    return sorted(int(month_num) for month_num in pd.unique(target_month_nums))
+
+def time_series_folds(train_df_up, validation_main_flag=1, fold_order=None, min_train_folds=1):
+    """
+    スライディングウィンドウの行から、予測対象月 (target_month_num) ごとに1つの fold を作成する関数（rolling origin）。
+
+    各 fold では、その予測対象月の main_flag == validation_main_flag の行を検証用とし、
+    時系列でそれより前の予測対象月の行だけを訓練用とする。
+
+    Parameters:
+    - train_df_up (pd.DataFrame): 分割前の訓練データ（split_train_validation_and_sort_test の入力）。
+    - validation_main_flag (int, optional): 検証用データの main_flag 条件。デフォルトは 1。
+    - fold_order (list, optional): target_month_num の時系列順。None の場合は target_month_order で決める。
+    - min_train_folds (int, optional): 訓練用に最低限必要な月数。デフォルトは 1。
+
+    Returns:
+    - list: target_month_num, month_target, train_idx, valid_idx を持つ辞書のリスト（行位置のインデックス）。
+    """
+    return time_series_folds_from_arrays(train_df_up[TARGET_MONTH_COLUMN].to_numpy(), train_df_up['main_flag'].to_numpy(),
+                                         validation_main_flag, fold_order, min_train_folds)
+
+def time_series_folds_from_arrays(target_month_nums, main_flags, validation_main_flag=1, fold_order=None,
+                                  min_train_folds=1):
+    """
+    time_series_folds と同じ fold を、行ごとの target_month_num と main_flag の配列から作成する関数。
+    """
+    target_month_nums = np.asarray(target_month_nums)
+    if fold_order is None:
+        fold_order = target_month_order(target_month_nums)
+    is_validation_flag = np.asarray(main_flags) == validation_main_flag
+
+    folds = []
+    for k in range(min_train_folds, len(fold_order)):
+        train_idx = np.flatnonzero(np.isin(target_month_nums, fold_order[:k]))
+        valid_idx = np.flatnonzero((target_month_nums == fold_order[k]) & is_validation_flag)
+        if len(valid_idx) == 0:
+            continue
+        folds.append({'target_month_num': int(fold_order[k]), 'month_target': (int(fold_order[k]) - 1) % 12 + 1,
+                      'train_idx': train_idx, 'valid_idx': valid_idx})
+    return folds
+
+def _run_fold(dataset_path, dataset_params, fold, params, num_boost_round, stopping_rounds):
+    # ワーカーで1つの fold を学習する（ビン分割済みの Dataset から行を取り出すため再度ビン分割しない）
+    start = time.perf_counter()
+    full_dataset = lgb.Dataset(dataset_path, params=dataset_params, free_raw_data=False).construct()
+    lgb_train = full_dataset.subset(fold['train_idx'])
+    lgb_eval = full_dataset.subset(fold['valid_idx'])
+    gbm = train_by_lightgbm(lgb_train, lgb_eval, num_boost_round, params, stopping_rounds=stopping_rounds)
+    return {
+        'target_month_num': fold['target_month_num'],
+        'month_target': fold['month_target'],
+        'n_train': len(fold['train_idx']),
+        'n_valid': len(fold['valid_idx']),
+        'valid_rmse': gbm.best_score['valid_1']['rmse'],
+        'best_iteration': gbm.best_iteration,
+        'wall_time_sec': time.perf_counter() - start,
+    }
+
+def _fold_key_arrays(data):
+    # fold の作成に使う target_month_num と main_flag の配列（特徴量行列の場合はメモリマップから1列ずつ取り出す）
+    if isinstance(data, FeatureMatrix):
+        target_month_nums = data.ids[:, data.manifest['id_columns'].index(TARGET_MONTH_COLUMN)]
+        main_flags = data.features[:, data.feature_columns.index('main_flag')]
+        return np.asarray(target_month_nums), np.asarray(main_flags)
+    return data[TARGET_MONTH_COLUMN].to_numpy(), data['main_flag'].to_numpy()
+
+def _cv_dataset_inputs(parts):
+    """
+    交差検証用の Dataset の入力（説明変数・目的変数・特徴量名）を作成する関数。
+    特徴量行列は行方向に並べたメモリマップのリストのまま渡すため、結合したコピーは作られない。
+    """
+    if all(isinstance(part, FeatureMatrix) for part in parts):
+        feature_columns = parts[0].feature_columns
+        if any(part.feature_columns != feature_columns for part in parts):
+            raise ValueError("特徴量行列のカラムが一致しません。")
+        return ([part.features for part in parts], np.concatenate([part.label for part in parts]),
+                feature_columns)
+    if any(isinstance(part, FeatureMatrix) for part in parts):
+        raise ValueError("データフレームと特徴量行列を混在させて交差検証することはできません。")
+    inputs = [features_and_label(part) for part in parts]
+    if len(inputs) == 1:
+        return inputs[0]
+    feature_columns = inputs[0][2]
+    if any(names != feature_columns for _, _, names in inputs):
+        raise ValueError("データフレームのカラムが一致しません。")
+    xs = [x for x, _, _ in inputs]
+    if all(isinstance(x, np.ndarray) for x in xs):
+        x = np.concatenate(xs)
+    else:
+        x = pd.concat([x if isinstance(x, pd.DataFrame) else pd.DataFrame(x, columns=feature_columns) for x in xs],
+                      ignore_index=True)
+    return x, pd.concat([y for _, y, _ in inputs], ignore_index=True), feature_columns
+
+def time_series_cross_validation(train_df_up, cache_dir, round=1000, profile='balanced', n_workers=1,
+                                 stopping_rounds=100, validation_main_flag=1, min_train_folds=1, data_keys=None,
+                                 max_cache_bytes=DATASET_CACHE_MAX_BYTES):
+    """
+    予測対象月ごとの rolling origin で交差検証を行う関数。
+
+    ビン分割は全行に対して一度だけ行ってバイナリ保存し、各 fold はその部分集合で学習する。
+    n_workers が 2 以上の場合、fold はプロセスプールで並列に実行し、各 fold のスレッド数は
+    CPU コア数 / n_workers に制限する。
+
+    Parameters:
+    - train_df_up (pd.DataFrame, FeatureMatrix or list): 分割前の訓練データ。訓練データと検証データのように
+      行方向に分かれている場合はリストで指定する（特徴量行列は結合せずにそのまま Dataset に渡す）。
+    - cache_dir (str): バイナリ Dataset の保存先。
+    - round (int, optional): 各 fold の最大学習回数。デフォルトは 1000。
+    - profile (str, optional): 学習プロファイル。デフォルトは 'balanced'。
+    - n_workers (int, optional): 並列に実行する fold 数。デフォルトは 1。
+    - stopping_rounds (int, optional): early stopping の回数。デフォルトは 100。
+    - validation_main_flag (int, optional): 検証用データの main_flag 条件。デフォルトは 1。
+    - min_train_folds (int, optional): 訓練用に最低限必要な月数。デフォルトは 1。
+    - data_keys (list, optional): train_df_up の各データの内容を表すキー（アップロードされたファイルのハッシュ値など）。
+      指定した場合は、データフレーム全体のハッシュ値を計算しない。
+    - max_cache_bytes (int, optional): cache_dir の最大合計サイズ（バイト）。None の場合は削除しない。
+
+    Returns:
+    - results_df (pd.DataFrame): fold ごとの RMSE・best_iteration・行数・実行時間。
+    - summary (dict): mean_rmse, std_rmse, num_iterations（各 fold の best_iteration の中央値）, wall_time_sec。
+    """
+    start = time.perf_counter()
+    n_workers = max(1, n_workers or 1)
+    params = get_training_params(profile, num_threads=max(1, (os.cpu_count() or 1) // n_workers))
+    dataset_params = get_dataset_params(params)
+
+    parts = list(train_df_up) if isinstance(train_df_up, (list, tuple)) else [train_df_up]
+
+    # 全行をまとめてビン分割し、バイナリで保存する
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    data_keys = list(data_keys) if data_keys is not None else [None] * len(parts)
+    key = stage_key('lgb_cv', None,
+                    {'params': repr(sorted(dataset_params.items())),
+                     'data': [_data_fingerprint(part, data_key) for part, data_key in zip(parts, data_keys)]})
+    dataset_path = os.path.join(cache_dir, f'{key}.bin')
+    if os.path.exists(dataset_path):
+        touch_cache_file(dataset_path)
+    else:
+        x, y, feature_name = _cv_dataset_inputs(parts)
+        _construct_dataset(x, y, dataset_path, dataset_params, feature_name=feature_name)
+        del x
+        # fold のワーカーはパスから読み込むため、保存したファイルは削除の対象にしない
+        if max_cache_bytes is not None:
+            evict_cache_files(cache_dir, max_cache_bytes, keep=(dataset_path,))
+
+    # fold は行位置で決まるため、各データの target_month_num と main_flag を行方向に並べる
+    key_arrays = [_fold_key_arrays(part) for part in parts]
+    folds = time_series_folds_from_arrays(np.concatenate([target_month_nums for target_month_nums, _ in key_arrays]),
+                                          np.concatenate([main_flags for _, main_flags in key_arrays]),
+                                          validation_main_flag, min_train_folds=min_train_folds)
+    tasks = {
+        f"fold_{fold['target_month_num']}": {
+            'func': _run_fold,
+            'args': (dataset_path, dataset_params, fold, params, round, stopping_rounds),
+        }
+        for fold in folds
+    }
+    results = run_task_graph(tasks, n_workers=n_workers)
+    results_df = pd.DataFrame([results[f"fold_{fold['target_month_num']}"] for fold in folds])
+
+    summary = {
+        'mean_rmse': float(results_df['valid_rmse'].mean()),
+        'std_rmse': float(results_df['valid_rmse'].std(ddof=0)),
+        'num_iterations': int(np.median(results_df['best_iteration'])),
+        'wall_time_sec': time.perf_counter() - start,
+    }
+    return results_df, summary
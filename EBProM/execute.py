@@ -1,79 +1,294 @@
 import os
+import time
 import pandas as pd
 from lightgbm import Booster
-import tempfile
 import streamlit as st
 from .utils import *  # 相対インポートで utils をインポート
 from .machine_learning import *
+from .artifacts import *
+from .cache import *
+from .incremental import *
+from .tuning import *
+from .cross_validation import *
+from .registry import *
+from .profiling import *
+from .jobs import *
+from .uploads import *
+from .feature_store import *
 
-# 前処理と特徴量生成を実行するメイン処理関数
-def execute_preprocessing(sales_df, item_df, category_df, test_df, save_dir):
-    try:
-        st.write("データの結合と前処理を実行中...")
-        joined_data = preprocess_data(sales_df, item_df, category_df)
-        st.success("データの結合と前処理が完了しました。")
+# パイプラインのステージを順に実行する関数（cache_dir を指定するとステージ単位でキャッシュする）
+def run_pipeline_stages(stages, cache_dir=None, max_cache_bytes=None, kept_outputs=None):
+    """
+    前段の出力を次段の入力として、ステージを順に実行する関数。
+
+    各ステージのキャッシュキーは前段のキー・パラメータ・直接受け取るデータフレームから決まるため、
+    入力やパラメータが変わっていない先頭部分のステージはキャッシュから読み込まれる。
+    キャッシュにヒットしたステージの出力は、後続のステージで再計算が必要になるまで読み込まない。
+    読み込むまでに他のセッションのキャッシュ削除で消えていた場合は、読み込める直前のステージから再計算する。
+
+    Parameters:
+    - stages (list of dict): name, running_message, done_message, func, params, frames を持つステージ定義のリスト。
+    - cache_dir (str, optional): キャッシュディレクトリ。None の場合はキャッシュしない。
+    - max_cache_bytes (int, optional): キャッシュの最大合計サイズ（バイト）。
+    - kept_outputs (dict, optional): キーにステージ名を入れておくと、そのステージの出力が値として格納される。
 
-        st.write("特徴量生成を実行中...")
-        joined_data = generate_features(joined_data)
-        st.success("特徴量生成が完了しました。")
+    Returns:
+    - 最後のステージの出力。
+    """
+    statuses = []
+    parent_key = None
+    value = None
+    pending = []  # キャッシュにあり、まだ読み込んでいないステージ（value はその直前のステージの出力）
 
-        st.write("カタログデータの生成中...")
-        catalog_df = complete_catalog(joined_data)
-        st.success("カタログデータの生成が完了しました。")
+    def load_pending():
+        # 最後のステージの出力を読み込む。他のセッションに削除されていた場合は、読み込める直前のステージから再計算する
+        # キャッシュの状況は、実際に読み込めたステージ（とそれより前のステージ）だけをヒットとする
+        nonlocal value
+        start = 0
+        for k in range(len(pending) - 1, -1, -1):
+            found, loaded = try_load_stage(cache_dir, pending[k][1])
+            if found:
+                value, start = loaded, k + 1
+                break
+        for _, _, status in pending[:start]:
+            status['キャッシュ'] = "ヒット"
+        for stage, key, status in pending[start:]:
+            st.write(f"{stage['name']} のキャッシュを読み込めなかったため再計算します。")
+            value = stage['func'](value)
+            save_stage(cache_dir, key, value, max_cache_bytes)
+            status['キャッシュ'] = "ミス"
+        pending.clear()
+        return value
 
-        st.write("欠損値を補完中...")
-        catalog_df_filled = fill_missing_values(catalog_df, test_df)
-        st.success("欠損値補完が完了しました。")
+    for stage in stages:
+        st.write(stage['running_message'])
+        key = stage_key(stage['name'], parent_key, stage.get('params'), stage.get('frames', ()))
+        status = {'ステージ': stage['name'], 'キャッシュ': None}
+        statuses.append(status)
 
-        st.write("追加の特徴量補完を実行中...")
-        catalog_filled_feats = fill_features(catalog_df_filled)
-        st.success("追加の特徴量補完が完了しました。")
+        if cache_dir is not None and has_stage(cache_dir, key):
+            pending.append((stage, key, status))
+            st.success(f"{stage['done_message']}（キャッシュあり）")
+        else:
+            if pending:
+                load_pending()
+            value = stage['func'](value)
+            if cache_dir is not None:
+                save_stage(cache_dir, key, value, max_cache_bytes)
+                status['キャッシュ'] = "ミス"
+            else:
+                status['キャッシュ'] = "無効"
+            st.success(stage['done_message'])
 
-        st.write("スライディングウィンドウを使用してデータセットを生成中...")
-        train_df, test_df = generate_sliding_window_datasets(catalog_filled_feats)
-        st.success("スライディングウィンドウを使用したデータセット生成が完了しました。")
+        if kept_outputs is not None and stage['name'] in kept_outputs:
+            kept_outputs[stage['name']] = load_pending() if pending else value
 
-        st.write("トレンド特徴量を生成中...")
-        train_df, test_df = generate_trend_features(train_df, test_df)
-        st.success("トレンド特徴量の生成が完了しました。")
+        parent_key = key
 
-        st.write("カレンダー情報を追加中...")
-        train_df, test_df = add_calendar_features(train_df, test_df, start_date='2018-01-01', end_date='2019-12-31', predict_year_month=(2019, 12))
-        st.success("カレンダー情報の追加が完了しました。")
+    if pending:
+        load_pending()
 
-        st.write("データの分割とソートを実行中...")
-        validation_df, train_df, test_df = split_train_validation_and_sort_test(train_df, test_df, validation_main_flag=1, validation_month_target=12)
-        st.success("データの分割とソートが完了しました。")
+    st.session_state["stage_cache_status"] = statuses
+    return value
+
+# ステージの出力（データフレームまたはそのタプル）の型を縮小する関数
+def downcast_stage_output(value):
+    if isinstance(value, tuple):
+        return tuple(downcast_dtypes(df) for df in value)
+    return downcast_dtypes(value)
+
+# 前処理と特徴量生成を実行するメイン処理関数
+def execute_preprocessing(sales_df, item_df, category_df, test_df, save_dir,
+                          artifact_format='parquet', compression=None, export_csv=False,
+                          window_size=12, n_steps=None, n_months=22,
+                          start_date='2018-01-01', end_date='2019-12-31', predict_year_month=None,
+                          cache_dir=None, max_cache_mb=2048, downcast=True, sales_chunksize=None,
+                          incremental_state_path=None, n_workers=1, write_feature_matrix=True, trace_memory=False,
+                          group_features=None):
+    """
+    前処理と特徴量生成を実行し、訓練・検証・テストデータを save_dir に保存する関数。
+
+    sales_chunksize を指定した場合、sales_df は売上データのファイル（パスまたはファイルオブジェクト）として扱い、
+    sales_chunksize 行ずつ読み込みながら月ごとの集計を行う。
+    n_months は売上データの月数で、n_steps を省略した場合は n_months - window_size + 1 とする。
+    incremental_state_path を指定すると、月次更新 (execute_incremental_update) 用の状態を保存する。
+    n_workers を 2 以上にすると、ステージ内の独立した処理をプロセスプールで並列に実行する（結果は逐次実行と同じ）。
+    predict_year_month を省略した場合は、売上データの最後の月の2か月後（2018年1月を1か月目とする）とする。
+    cache_dir を指定すると、カレンダー表も cache_dir に保存して再利用する。
+    write_feature_matrix が True の場合は、学習・予測でメモリマップとして開く float32 の特徴量行列
+    （save_dir/{train,validation,test}_df_matrix）も保存する。
+    trace_memory を True にすると、ステージごとのメモリ確保のピークも tracemalloc で計測する（処理は遅くなる）。
+    group_features はグループ平均特徴量の定義で、省略した場合は GROUP_AVERAGE_FEATURES とする（fill_features を参照）。
+    """
+    if n_steps is None:
+        n_steps = n_months - window_size + 1
+    if predict_year_month is None:
+        predict_month_num = n_months + 2
+        predict_year_month = (2018 + (predict_month_num - 1) // 12, (predict_month_num - 1) % 12 + 1)
+    raw_test_df = test_df
+    calendar_params = {'start_date': start_date, 'end_date': end_date, 'predict_year_month': tuple(predict_year_month)}
+    calendar_path = os.path.join(cache_dir, 'calendar.parquet') if cache_dir else None
+    split_params = {'validation_main_flag': 1, 'validation_month_target': 12}
+    if sales_chunksize is None:
+        ingestion_stages = [
+            {'name': 'preprocess_data',
+             'running_message': "データの結合と前処理を実行中...",
+             'done_message': "データの結合と前処理が完了しました。",
+             'func': lambda _: preprocess_data(sales_df, item_df, category_df),
+             'params': {'downcast': downcast},
+             'frames': [sales_df, item_df, category_df]},
+            {'name': 'generate_features',
+             'running_message': "特徴量生成を実行中...",
+             'done_message': "特徴量生成が完了しました。",
+             'func': lambda df: generate_features(df, n_months),
+             'params': {'n_months': n_months}},
+        ]
+    else:
+        # 売上データは分割して読み込み、前処理と特徴量生成を一度に行う
+        ingestion_stages = [
+            {'name': 'aggregate_sales_in_chunks',
+             'running_message': "売上データを分割して読み込み、集計中...",
+             'done_message': "売上データの集計が完了しました。",
+             'func': lambda _: aggregate_sales_in_chunks(read_sales_chunks(sales_df, sales_chunksize), item_df, category_df,
+                                                         n_months=n_months),
+             'params': {'downcast': downcast, 'n_months': n_months,
+                        'sales': source_fingerprint(sales_df) if cache_dir is not None else None},
+             'frames': [item_df, category_df]},
+        ]
+    stages = ingestion_stages + [
+        {'name': 'complete_catalog',
+         'running_message': "カタログデータの生成中...",
+         'done_message': "カタログデータの生成が完了しました。",
+         'func': complete_catalog},
+        {'name': 'fill_missing_values',
+         'running_message': "欠損値を補完中...",
+         'done_message': "欠損値補完が完了しました。",
+         'func': lambda df: fill_missing_values(df, raw_test_df, n_months),
+         'frames': [raw_test_df]},
+        {'name': 'fill_features',
+         'running_message': "追加の特徴量補完を実行中...",
+         'done_message': "追加の特徴量補完が完了しました。",
+         'func': lambda df: fill_features(df, group_features=group_features, n_months=n_months, n_workers=n_workers),
+         'params': {'group_features': group_features}},
+        {'name': 'generate_sliding_window_datasets',
+         'running_message': "スライディングウィンドウを使用してデータセットを生成中...",
+         'done_message': "スライディングウィンドウを使用したデータセット生成が完了しました。",
+         'func': lambda df: generate_sliding_window_datasets(df, window_size=window_size, n_steps=n_steps,
+                                                             n_months=n_months, n_workers=n_workers,
+                                                             group_features=group_features),
+         'params': {'window_size': window_size, 'n_steps': n_steps, 'group_features': group_features}},
+        {'name': 'generate_trend_features',
+         'running_message': "トレンド特徴量を生成中...",
+         'done_message': "トレンド特徴量の生成が完了しました。",
+         'func': lambda dfs: generate_trend_features(*dfs, window_size=window_size),
+         'params': {'window_size': window_size}},
+        {'name': 'add_calendar_features',
+         'running_message': "カレンダー情報を追加中...",
+         'done_message': "カレンダー情報の追加が完了しました。",
+         'func': lambda dfs: add_calendar_features(*dfs, **calendar_params, calendar_path=calendar_path),
+         'params': calendar_params},
+        {'name': 'split_train_validation_and_sort_test',
+         'running_message': "データの分割とソートを実行中...",
+         'done_message': "データの分割とソートが完了しました。",
+         'func': lambda dfs: split_train_validation_and_sort_test(*dfs, **split_params),
+         'params': split_params},
+    ]
+    if downcast:
+        # preprocess_data 以降のすべてのステージの出力を縮小した型で受け渡す
+        for stage in stages:
+            stage['func'] = (lambda func: lambda value: downcast_stage_output(func(value)))(stage['func'])
+    max_cache_bytes = max_cache_mb * 1024 * 1024 if max_cache_mb is not None else None
+
+    kept_outputs = {'fill_features': None} if incremental_state_path is not None else None
+
+    try:
+        # ステージごとの実行時間・メモリ使用量を計測し、save_dir の profile_log.jsonl に追記する
+        with profile_session(log_path=os.path.join(save_dir, 'profile_log.jsonl'),
+                             trace_memory=trace_memory) as profile_records:
+            validation_df, train_df, test_df = run_pipeline_stages(stages, cache_dir, max_cache_bytes, kept_outputs)
+        st.session_state["stage_profile"] = profile_table(profile_records)
+
+        if incremental_state_path is not None:
+            st.write("月次更新用の状態を保存中...")
+            save_incremental_state(build_incremental_state(kept_outputs['fill_features'], n_months, group_features),
+                                   incremental_state_path)
+            st.success(f"月次更新用の状態が {incremental_state_path} に保存されました。")
 
         # データの保存
         st.write("前処理が完了し、データを保存中...")
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-
-        train_df.to_csv(os.path.join(save_dir, 'train_df.csv'), index=False)
-        validation_df.to_csv(os.path.join(save_dir, 'validation_df.csv'), index=False)
-        test_df.to_csv(os.path.join(save_dir, 'test_df.csv'), index=False)
+        output_dfs = {'train': train_df, 'validation': validation_df, 'test': test_df}
+        for key, df in output_dfs.items():
+            st.session_state[f"{key}_path"] = save_artifact(df, save_dir, f'{key}_df', artifact_format, compression)
         st.success(f"前処理が完了し、データが {save_dir} に保存されました。")
 
-        st.session_state["train_path"] = os.path.join(save_dir, 'train_df.csv')
-        st.session_state["validation_path"] = os.path.join(save_dir, 'validation_df.csv')
-        st.session_state["test_path"] = os.path.join(save_dir, 'test_df.csv')
+        # 学習・予測でメモリマップとして開く float32 の特徴量行列
+        if write_feature_matrix:
+            st.write("特徴量行列を保存中...")
+            for key, df in output_dfs.items():
+                st.session_state[f"{key}_matrix_path"] = save_feature_matrix(
+                    df, save_dir, f'{key}_df', label_column=TARGET_COLUMN, exclude_columns=DROP_COLUMNS,
+                    id_columns=PREDICTION_ID_COLUMNS + [TARGET_MONTH_COLUMN])
+            st.success("特徴量行列の保存が完了しました。")
+
+        # ダウンロード用に CSV も出力する
+        export_paths = {}
+        if export_csv and artifact_format != 'csv':
+            st.write("CSV形式でもデータを出力中...")
+            for key, df in output_dfs.items():
+                export_paths[key] = save_artifact(df, save_dir, f'{key}_df', 'csv')
+            st.success("CSV形式での出力が完了しました。")
+        st.session_state["export_paths"] = export_paths
         st.session_state["preprocessing_done"] = True  
         
     except KeyError as e:
         st.error(f"KeyErrorが発生しました: {e}")
         st.error("データの列名を確認してください。")
 
-# モデルのトレーニングを実行する関数
-def execute_training(train_df, valid_df, model_save_dir, num_iterations):
-    with st.spinner("データセットをセットアップしています..."):
-        lgb_train, lgb_eval = set_data_set(train_df, valid_df)
-        st.success("データセットのセットアップが完了しました。")
+# 新しい1か月分の売上データで月次更新を実行する関数
+def execute_incremental_update(state_path, sales_df, item_df, category_df, test_df, save_dir,
+                               window_size=12, artifact_format='parquet', compression=None, downcast=True,
+                               cache_dir=None):
+    """
+    保存済みの状態に新しい月の売上データを追加し、その月で新たに作成できる行だけを save_dir に保存する関数。
+    cache_dir を指定すると、execute_preprocessing と同じく cache_dir に保存したカレンダー表を再利用する。
+    """
+    calendar_path = os.path.join(cache_dir, 'calendar.parquet') if cache_dir else None
+    try:
+        st.write("月次更新用の状態を読み込み中...")
+        state = load_incremental_state(state_path)
+        st.success(f"状態の読み込みが完了しました（現在の月数: {state['n_months']}）。")
 
-    with st.spinner("LightGBMでモデルをトレーニング中..."):
-        gbm = train_by_lightgbm(lgb_train, lgb_eval, num_iterations)
-        st.success("モデルのトレーニングが完了しました。")
+        st.write("新しい月の売上データを追加中...")
+        state, train_df, new_test_df = update_incremental_state(state, sales_df, item_df, category_df, test_df,
+                                                                window_size=window_size)
+        n_months = state['n_months']
+        st.success(f"新しい月の追加が完了しました（月数: {n_months}）。")
 
+        st.write("トレンド特徴量とカレンダー情報を追加中...")
+        train_df, new_test_df = generate_trend_features(train_df, new_test_df, window_size=window_size)
+        predict_month_num = n_months + 2
+        predict_year_month = (state['start_year'] + (predict_month_num - 1) // 12, (predict_month_num - 1) % 12 + 1)
+        train_df, new_test_df = add_calendar_features(train_df, new_test_df, predict_year_month=predict_year_month,
+                                                      calendar_path=calendar_path)
+        validation_df, train_df, new_test_df = split_train_validation_and_sort_test(train_df, new_test_df)
+        if downcast:
+            validation_df, train_df, new_test_df = downcast_stage_output((validation_df, train_df, new_test_df))
+        st.success("特徴量の追加が完了しました。")
+
+        st.write("追加分のデータと状態を保存中...")
+        output_dfs = {'train': train_df, 'validation': validation_df, 'test': new_test_df}
+        for key, df in output_dfs.items():
+            st.session_state[f"incremental_{key}_path"] = save_artifact(df, save_dir, f'{key}_df_month{n_months}',
+                                                                        artifact_format, compression)
+        save_incremental_state(state, state_path)
+        st.success(f"追加分のデータが {save_dir} に保存されました。")
+        st.session_state["incremental_done"] = True
+
+    except (KeyError, ValueError) as e:
+        st.error(f"月次更新でエラーが発生しました: {e}")
+
+# 学習済みモデルを保存する関数
+def save_trained_model(gbm, model_save_dir):
     # モデルの保存
     if not os.path.exists(model_save_dir):
         os.makedirs(model_save_dir)
@@ -82,26 +297,132 @@ def execute_training(train_df, valid_df, model_save_dir, num_iterations):
     st.session_state["model_path"] = model_path  # セッションステートに保存
     st.session_state["training_done"] = True  # トレーニング完了フラグ
     st.success(f"モデルが {model_save_dir} に 'lgbm_model.txt' として保存されました。")
+    return model_path
 
-# 推論を実行する関数
-def execute_prediction(model_file, test_df, prediction_save_dir):
-    st.write("モデルをロードしています...")
-    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-        tmp_file.write(model_file.read())
-        model_path = tmp_file.name
+# モデルのトレーニングを実行する関数
+def execute_training(train_df, valid_df, model_save_dir, num_iterations, dataset_cache_dir=None,
+                     profile=None, num_threads=None, max_bin=None, data_keys=None):
+    """
+    モデルを学習して保存する関数。profile を指定した場合は、実行時間・ピークメモリ・検証データの RMSE を
+    model_save_dir の training_log.csv に追記し、セッションステートの training_metrics に保存する。
+    data_keys はアップロードされたファイルのハッシュ値などで、Dataset のキャッシュのキーに使う（set_data_set を参照）。
+    """
+    overrides = {'max_bin': max_bin} if max_bin else {}
+    params = get_training_params(profile, num_threads, **overrides) if profile is not None else None
+    start = time.perf_counter()
+
+    with st.spinner("データセットをセットアップしています..."):
+        lgb_train, lgb_eval = set_data_set(train_df, valid_df, cache_dir=dataset_cache_dir,
+                                           params=get_dataset_params(params or {}), data_keys=data_keys)
+        st.success("データセットのセットアップが完了しました。")
+
+    with st.spinner("LightGBMでモデルをトレーニング中..."):
+        gbm = train_by_lightgbm(lgb_train, lgb_eval, num_iterations, params)
+        st.success("モデルのトレーニングが完了しました。")
+
+    save_trained_model(gbm, model_save_dir)
+
+    if profile is not None:
+        metrics = {
+            'profile': profile,
+            'num_threads': params.get('num_threads', 0),
+            'max_bin': params.get('max_bin'),
+            'num_iterations': num_iterations,
+            'wall_time_sec': time.perf_counter() - start,
+            'peak_rss_mb': get_peak_memory_mb(),
+            'valid_rmse': gbm.best_score['valid_1']['rmse'],
+            'best_iteration': gbm.best_iteration,
+        }
+        log_path = os.path.join(model_save_dir, 'training_log.csv')
+        pd.DataFrame([metrics]).to_csv(log_path, mode='a', index=False, header=not os.path.exists(log_path))
+        st.session_state["training_metrics"] = metrics
+        st.session_state["training_log_path"] = log_path
+
+# ハイパーパラメータ探索を実行し、最良のモデルを保存する関数
+def execute_hyperparameter_search(train_df, valid_df, model_save_dir, dataset_cache_dir=None, method='random',
+                                  n_trials=20, n_workers=1, max_rounds=1000, base_profile='balanced', data_keys=None):
+    if dataset_cache_dir is None:
+        dataset_cache_dir = os.path.join(model_save_dir, 'datasets')
+    log_path = os.path.join(model_save_dir, 'search_log.jsonl')
+
+    with st.spinner("ハイパーパラメータを探索しています..."):
+        best, results = hyperparameter_search(train_df, valid_df, dataset_cache_dir, method=method,
+                                              n_trials=n_trials, n_workers=n_workers, max_rounds=max_rounds,
+                                              base_profile=base_profile, log_path=log_path, data_keys=data_keys)
+        st.success(f"探索が完了しました。最良の RMSE: {best['valid_rmse']:.6f} ({best['trial_id']})")
+
+    trials_df = pd.DataFrame([{key: value for key, value in result.items() if key != 'model_str'} for result in results])
+    st.session_state["search_results"] = trials_df
+    st.session_state["search_log_path"] = log_path
+    return save_trained_model(Booster(model_str=best['model_str']), model_save_dir)
+
+# 時系列交差検証を実行する関数
+def execute_cross_validation(train_df, valid_df, model_save_dir, num_iterations, dataset_cache_dir=None,
+                             profile='balanced', n_workers=1, data_keys=None):
+    if dataset_cache_dir is None:
+        dataset_cache_dir = os.path.join(model_save_dir, 'datasets')
+
+    with st.spinner("時系列交差検証を実行しています..."):
+        # fold は target_month_num と main_flag だけで決まるため、訓練データと検証データを続けて1つのデータとして扱う
+        results_df, summary = time_series_cross_validation([train_df, valid_df], dataset_cache_dir, round=num_iterations,
+                                                           profile=profile, n_workers=n_workers, data_keys=data_keys)
+        st.success(f"交差検証が完了しました。平均 RMSE: {summary['mean_rmse']:.6f} / 推奨学習回数: {summary['num_iterations']}")
+
+    if not os.path.exists(model_save_dir):
+        os.makedirs(model_save_dir)
+    results_path = os.path.join(model_save_dir, 'cv_results.csv')
+    results_df.to_csv(results_path, index=False)
+    st.session_state["cv_results"] = results_df
+    st.session_state["cv_summary"] = summary
+    return results_df, summary
+
+# 全セッションで共有するモデルレジストリ
+@st.cache_resource
+def get_model_registry(max_models=8):
+    return ModelRegistry(max_models)
+
+# 全セッションで共有する、アップロードされたファイルの読み込み結果のキャッシュ
+@st.cache_resource
+def get_frame_cache(max_mb=2048):
+    return FrameCache(max_mb * 1024 * 1024)
 
-    gbm = Booster(model_file=model_path)
+# アップロードされたファイルをキャッシュ経由で読み込む関数
+# ファイルの内容のハッシュ値はアップロードごと（file_id ごと）に一度だけ計算する
+def uploaded_file_key(uploaded_file):
+    # アップロードされたファイルの内容のハッシュ値（同じアップロードは再計算しない）
+    upload_hashes = st.session_state.setdefault("upload_hashes", {})
+    file_id = getattr(uploaded_file, 'file_id', None)
+    content_hash = upload_hashes.get(file_id)
+    if content_hash is None:
+        content_hash = source_fingerprint(uploaded_file)
+        if file_id is not None:
+            upload_hashes[file_id] = content_hash
+    return content_hash
+
+def load_uploaded_file(uploaded_file, schema_name=None):
+    return load_uploaded_frame(get_frame_cache(), uploaded_file, schema_name, uploaded_file_key(uploaded_file))
+
+# 推論を実行する関数（テストデータはチャンクごとに予測して書き出す）
+def execute_prediction(model_file, test_source, prediction_save_dir, chunk_size=100_000, num_threads=0):
+    st.write("モデルをロードしています...")
+    model_bytes = model_file.getvalue() if hasattr(model_file, 'getvalue') else model_file.read()
+    registry = get_model_registry()
+    _, gbm = registry.get(model_bytes)
+    st.session_state["model_registry_metrics"] = registry.metrics()
     st.success("モデルのロードが完了しました。")
 
-    st.write("予測を実行中...")
-    predictions = gbm.predict(test_df)
-    st.success("予測が完了しました。")
+    # 特徴量行列のディレクトリはメモリマップで開く
+    if is_feature_matrix(test_source):
+        test_source = FeatureMatrix(test_source)
 
-    # 予測結果の保存
+    # 予測結果の保存先
     if not os.path.exists(prediction_save_dir):
         os.makedirs(prediction_save_dir)
     prediction_path = os.path.join(prediction_save_dir, 'predictions.csv')
-    pd.DataFrame(predictions, columns=["predictions"]).to_csv(prediction_path, index=False)
+
+    st.write("予測を実行中...")
+    n_rows = predict_in_chunks(gbm, test_source, prediction_path, chunk_size=chunk_size, num_threads=num_threads)
+    st.success(f"予測が完了しました。({n_rows} 行)")
 
     # 予測結果パスをセッションステートに保存し、予測完了フラグを設定
     st.session_state["prediction_path"] = prediction_path
@@ -109,3 +430,19 @@ def execute_prediction(model_file, test_df, prediction_save_dir):
     st.success(f"予測結果が {prediction_save_dir} に 'predictions.csv' として保存されました。")
 
 
+
+# 全セッションで共有するジョブキュー（同じ入力のジョブは複数の利用者で共有される）
+@st.cache_resource
+def get_job_manager(max_workers=2):
+    return JobManager(max_workers)
+
+# 関数をワーカープロセスで実行するジョブとして登録し、ジョブ ID を返す関数
+def submit_job(func, *args, **kwargs):
+    return get_job_manager().submit(func, args, kwargs)
+
+# ジョブの状態を取得し、完了していればワーカーで設定されたセッションステートを現在のセッションに反映する関数
+def apply_job_result(job_id):
+    status = get_job_manager().status(job_id)
+    if status['state'] == JOB_DONE:
+        st.session_state.update(status['session_state'])
+    return status
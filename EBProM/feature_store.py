@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from .cache import frame_fingerprint
+
+# 特徴量行列のディレクトリ名の末尾
+FEATURE_MATRIX_SUFFIX = '_matrix'
+FEATURE_MATRIX_VERSION = 1
+# float32 で整数を正確に表せる絶対値の上限（仮数部が 24 ビットのため）
+FLOAT32_EXACT_INT_LIMIT = 2 ** 24
+
+def feature_matrix_path(save_dir, name):
+    return os.path.join(save_dir, f'{name}{FEATURE_MATRIX_SUFFIX}')
+
+def is_feature_matrix(path):
+    return isinstance(path, str) and os.path.exists(os.path.join(path, 'manifest.json'))
+
+def _write_npy(path, df, columns, dtype, chunk_size):
+    # 行方向のチャンクごとに書き込み、データフレーム全体の変換コピーを作らない
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(df), len(columns)))
+    for start in range(0, len(df), chunk_size):
+        array[start:start + chunk_size] = df.iloc[start:start + chunk_size][columns].to_numpy(dtype=dtype)
+    array.flush()
+    del array
+
+def check_float32_exact(df, columns):
+    """
+    整数のカラム（product_id などの ID を含む）が float32 に変換しても値が変わらないことを確認する関数。
+    絶対値が FLOAT32_EXACT_INT_LIMIT を超える値があると、別の ID と同じ値になる可能性があるため ValueError を送出する。
+    """
+    too_large = [col for col in columns
+                 if pd.api.types.is_integer_dtype(df[col]) and len(df) > 0
+                 and max(abs(int(df[col].min())), abs(int(df[col].max()))) > FLOAT32_EXACT_INT_LIMIT]
+    if too_large:
+        raise ValueError(f"float32 で正確に表せない整数のカラムがあります（絶対値が {FLOAT32_EXACT_INT_LIMIT} を超える値）: "
+                         f"{too_large}")
+
+def save_feature_matrix(df, save_dir, name, label_column=None, exclude_columns=(), id_columns=(), chunk_size=100_000):
+    """
+    データフレームを、メモリマップで開ける float32 の特徴量行列（.npy）とカラムの一覧（manifest.json）として保存する関数。
+
+    save_dir/{name}_matrix に以下のファイルを作成する。
+    - features.npy: 特徴量（exclude_columns と label_column 以外の全カラム、データフレームの順）。行優先・連続した float32。
+    - label.npy: label_column の値（float32）。label_column がデータフレームにない場合は作成しない。
+    - ids.npy: id_columns の値（int64）。予測結果のキーに使う。
+    - manifest.json: カラム名・行数・元のデータフレームのハッシュ値。
+
+    一時ディレクトリに書き込んでから置き換えるため、読み込み中の他のセッションが書きかけのファイルを開くことはない。
+    特徴量に含める整数のカラムは、float32 で正確に表せない値があれば ValueError を送出する（check_float32_exact）。
+
+    Parameters:
+    - df (pd.DataFrame): 保存するデータフレーム（数値のカラムのみ）。
+    - save_dir (str): 保存先ディレクトリ。
+    - name (str): 名前（train_df など）。
+    - label_column (str, optional): 目的変数のカラム。
+    - exclude_columns (list, optional): 特徴量に含めないカラム。
+    - id_columns (list, optional): キーのカラム（特徴量にも含める）。
+    - chunk_size (int, optional): 一度に変換する行数。デフォルトは 100,000。
+
+    Returns:
+    - str: 保存したディレクトリのパス。
+    """
+    excluded = set(exclude_columns) | {label_column}
+    feature_columns = [col for col in df.columns if col not in excluded]
+    check_float32_exact(df, feature_columns)
+
+    path = feature_matrix_path(save_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    has_label = label_column is not None and label_column in df.columns
+    _write_npy(os.path.join(tmp_path, 'features.npy'), df, feature_columns, np.float32, chunk_size)
+    if has_label:
+        np.save(os.path.join(tmp_path, 'label.npy'), df[label_column].to_numpy(dtype=np.float32))
+    if id_columns:
+        np.save(os.path.join(tmp_path, 'ids.npy'), df[list(id_columns)].to_numpy(dtype=np.int64))
+
+    manifest = {
+        'version': FEATURE_MATRIX_VERSION,
+        'n_rows': len(df),
+        'feature_columns': feature_columns,
+        'label_column': label_column if has_label else None,
+        'id_columns': list(id_columns),
+        'fingerprint': frame_fingerprint(df),
+    }
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+class FeatureMatrix:
+    """
+    save_feature_matrix で保存した特徴量行列を読み取り専用のメモリマップで開いたもの。
+
+    データはアクセスした部分だけが OS のページキャッシュから読み込まれ、同じファイルを開いた
+    セッション・プロセスの間でメモリ上のページが共有される。pickle した場合はパスだけを渡し、
+    受け取ったプロセスで開き直す。
+
+    Attributes:
+    - features (np.memmap): (行数, 特徴量数) の float32 の行列。
+    - label (np.memmap or None): 目的変数。
+    - ids (np.memmap or None): (行数, キーのカラム数) の int64 の行列。
+    - manifest (dict): save_feature_matrix が保存したカラム名などの情報。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest['version'] != FEATURE_MATRIX_VERSION:
+            raise ValueError(f"特徴量行列のバージョンが異なります: {self.manifest['version']}")
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+        self.label = (np.load(os.path.join(path, 'label.npy'), mmap_mode='r')
+                      if self.manifest['label_column'] is not None else None)
+        self.ids = (np.load(os.path.join(path, 'ids.npy'), mmap_mode='r')
+                    if self.manifest['id_columns'] else None)
+
+    def __reduce__(self):
+        return (FeatureMatrix, (self.path,))
+
+    def __repr__(self):
+        # ジョブの重複判定などに使うため、内容のハッシュ値を含める
+        return f"FeatureMatrix({self.path!r}, fingerprint={self.manifest['fingerprint']!r})"
+
+    def __len__(self):
+        return self.manifest['n_rows']
+
+    @property
+    def feature_columns(self):
+        return self.manifest['feature_columns']
+
+    @property
+    def fingerprint(self):
+        return self.manifest['fingerprint']
+
+    def to_frame(self, start=0, stop=None):
+        """
+        start 行目から stop 行目までをデータフレームに変換する関数（画面表示・交差検証用）。
+        特徴量のカラムの後に、特徴量に含まれないキーのカラムと目的変数のカラムを付ける。
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        df = pd.DataFrame(self.features[start:stop], columns=self.feature_columns, copy=False)
+        for k, col in enumerate(self.manifest['id_columns']):
+            if col not in self.feature_columns:
+                df[col] = self.ids[start:stop, k]
+        if self.label is not None:
+            df[self.manifest['label_column']] = self.label[start:stop]
+        return df
@@ -0,0 +1,105 @@
+import os
+from datetime import date
+import numpy as np
+import pandas as pd
+import jpholiday
+
+# カレンダー特徴量のカラム
+CALENDAR_COLUMNS = ['day_each_month', 'holiday_each_month', 'day_holiday_month']
+
+# 作成済みのカレンダー表（(開始年, 終了年) をキーとする）
+_calendar_tables = {}
+
+def build_calendar_table(start_year, end_year):
+    """
+    (year, month) ごとの日数・休日数（土日と祝日）を計算する関数。
+    祝日は jpholiday.between で期間内の一覧を一度だけ取得し、日付ごとの判定はベクトル化して行う。
+
+    Parameters:
+    - start_year (int): 開始年。
+    - end_year (int): 終了年（この年の12月まで含む）。
+
+    Returns:
+    - pd.DataFrame: year, month, day_each_month, holiday_each_month, day_holiday_month を持つデータフレーム。
+    """
+    dates = pd.date_range(f'{start_year}-01-01', f'{end_year}-12-31', freq='D')
+    holidays = pd.to_datetime([holiday for holiday, _ in jpholiday.between(date(start_year, 1, 1), date(end_year, 12, 31))])
+    is_holiday = ((dates.dayofweek >= 5) | dates.isin(holidays)).astype(int)
+
+    all_date_df = pd.DataFrame({'year': dates.year, 'month': dates.month, 'is_holiday': is_holiday})
+    calendar_df = all_date_df.groupby(['year', 'month']).agg(
+        day_each_month=('is_holiday', 'size'),
+        holiday_each_month=('is_holiday', 'sum')
+    ).reset_index()
+    calendar_df['day_holiday_month'] = calendar_df['day_each_month'] * calendar_df['holiday_each_month']
+    return calendar_df.astype({col: 'int64' for col in CALENDAR_COLUMNS})
+
+def load_calendar_table(start_year, end_year, calendar_path=None):
+    """
+    カレンダー表を取得する関数。同じプロセスで作成済みの表、または calendar_path に保存済みの表が
+    期間を含んでいればそれを使い、含んでいなければ作成して保存する。
+
+    Parameters:
+    - start_year (int): 開始年。
+    - end_year (int): 終了年。
+    - calendar_path (str, optional): カレンダー表を保存する parquet ファイル。None の場合は保存しない。
+
+    Returns:
+    - pd.DataFrame: start_year から end_year までの build_calendar_table の出力。
+    """
+    for (cached_start, cached_end), calendar_df in _calendar_tables.items():
+        if cached_start <= start_year and end_year <= cached_end:
+            return calendar_df[calendar_df['year'].between(start_year, end_year)].reset_index(drop=True)
+
+    if calendar_path is not None and os.path.exists(calendar_path):
+        calendar_df = pd.read_parquet(calendar_path)
+        saved_start, saved_end = int(calendar_df['year'].min()), int(calendar_df['year'].max())
+        if saved_start <= start_year and end_year <= saved_end:
+            _calendar_tables[(saved_start, saved_end)] = calendar_df
+            return load_calendar_table(start_year, end_year)
+        # 保存済みの表が期間を含まない場合は、両方を含む期間で作り直す
+        start_year, end_year = min(start_year, saved_start), max(end_year, saved_end)
+
+    calendar_df = build_calendar_table(start_year, end_year)
+    _calendar_tables[(start_year, end_year)] = calendar_df
+    if calendar_path is not None:
+        calendar_dir = os.path.dirname(calendar_path)
+        if calendar_dir and not os.path.exists(calendar_dir):
+            os.makedirs(calendar_dir, exist_ok=True)
+        # 一時ファイルに書き込んでから置き換え、他のセッションが書きかけのファイルを読まないようにする
+        tmp_path = f"{calendar_path}.{os.getpid()}.tmp"
+        calendar_df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, calendar_path)
+    return calendar_df
+
+def target_month_year_months(target_month_nums, predict_month_num, predict_year_month):
+    """
+    予測対象月の通し番号 target_month_num を実際の (year, month) に対応させる関数。
+    通し番号が predict_month_num の月を predict_year_month とし、差の月数だけずらす。
+
+    Returns:
+    - pd.DataFrame: target_month_num, year, month を持つデータフレーム。
+    """
+    predict_year, predict_month = predict_year_month
+    target_month_nums = sorted(int(month_num) for month_num in pd.unique(np.asarray(target_month_nums)))
+    # 年 × 12 + (月 - 1) で表した月の通し番号
+    month_indices = [predict_year * 12 + predict_month - 1 + month_num - predict_month_num
+                     for month_num in target_month_nums]
+    return pd.DataFrame({
+        'target_month_num': target_month_nums,
+        'year': [month_index // 12 for month_index in month_indices],
+        'month': [month_index % 12 + 1 for month_index in month_indices],
+    })
+
+def calendar_features_by_target_month(month_year_df, calendar_df):
+    """
+    target_month_num ごとのカレンダー特徴量を (year, month) をキーとして結合する関数。
+
+    Returns:
+    - pd.DataFrame: target_month_num と CALENDAR_COLUMNS を持つデータフレーム。
+    """
+    merged = month_year_df.merge(calendar_df, on=['year', 'month'], how='left', validate='one_to_one')
+    missing = merged.loc[merged[CALENDAR_COLUMNS[0]].isna(), ['year', 'month']]
+    if not missing.empty:
+        raise ValueError(f"カレンダー表に含まれない月があります: {missing.to_dict('records')}")
+    return merged[['target_month_num'] + CALENDAR_COLUMNS]
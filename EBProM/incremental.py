@@ -0,0 +1,178 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+from .utils import (GROUP_AVERAGE_FEATURES, preprocess_data, insert_group_features,
+                    generate_sliding_window_datasets)
+
+ID_COLUMNS = ['product_id', 'store_id', 'category_id']
+
+def _month_columns(n_months):
+    price_columns = [f'product_price_{i}' for i in range(1, n_months + 1)]
+    num_columns = [f'product_num_{i}' for i in range(1, n_months + 1)]
+    return price_columns, num_columns
+
+def compute_group_sums(catalog_df, group_features, price_columns, num_columns, count_rows=True):
+    """
+    グループごとに、指定した月の販売個数・価格の合計と行数を計算する関数。
+    count_rows が False の場合、行数は 0 とする（既存の行に月を追加するとき用）。
+
+    Returns:
+    - dict: 接頭辞ごとに、グループ化キーをインデックスとし num_sum, price_sum, row_count を列に持つデータフレーム
+    """
+    row_sums = pd.DataFrame({
+        'num_sum': catalog_df[num_columns].to_numpy(dtype='float64').sum(axis=1),
+        'price_sum': catalog_df[price_columns].to_numpy(dtype='float64').sum(axis=1),
+        'row_count': 1 if count_rows else 0,
+    }, index=catalog_df.index)
+    group_sums = {}
+    for prefix, group_cols in group_features:
+        group_sums[prefix] = row_sums.groupby([catalog_df[col] for col in group_cols]).sum()
+    return group_sums
+
+def _add_group_sums(group_sums, delta_sums):
+    return {prefix: group_sums[prefix].add(delta_sums[prefix], fill_value=0) for prefix in group_sums}
+
+def group_averages_from_sums(group_sums, n_months):
+    """
+    グループごとの合計から、compute_group_averages と同じ形式のグループ平均を計算する関数。
+    欠損値補完後のカタログでは全ての行が全ての月を持つため、平均は 合計 / (行数 * 月数) となる。
+    """
+    group_averages = {}
+    for prefix, sums in group_sums.items():
+        denominator = sums['row_count'] * n_months
+        group_averages[prefix] = pd.DataFrame({
+            'ave_num': sums['num_sum'] / denominator,
+            'ave_price': sums['price_sum'] / denominator,
+        })
+    return group_averages
+
+def build_incremental_state(catalog_df, n_months=22, group_features=None, start_year=2018):
+    """
+    欠損値補完済みのカタログから、月次更新用の状態を作成する関数。
+
+    Parameters:
+    - catalog_df (pd.DataFrame): fill_missing_values または fill_features の出力。
+    - n_months (int, optional): カタログに含まれる月数。デフォルトは 22。
+    - group_features (list, optional): グループ平均特徴量の定義。デフォルトは GROUP_AVERAGE_FEATURES。
+    - start_year (int, optional): month_num が 1 となる年。デフォルトは 2018。
+
+    Returns:
+    - dict: 月次更新用の状態。
+    """
+    if group_features is None:
+        group_features = GROUP_AVERAGE_FEATURES
+    price_columns, num_columns = _month_columns(n_months)
+    catalog = catalog_df[ID_COLUMNS + price_columns + num_columns + ['main_flag']].reset_index(drop=True)
+    return {
+        'n_months': n_months,
+        'start_year': start_year,
+        'group_features': group_features,
+        'catalog': catalog,
+        'group_sums': compute_group_sums(catalog, group_features, price_columns, num_columns),
+    }
+
+def save_incremental_state(state, path):
+    state_dir = os.path.dirname(path)
+    if state_dir and not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=state_dir or '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_incremental_state(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def _extend_catalog(catalog, new_month_df, price_columns, num_columns):
+    """
+    新しい月に初めて現れた商品・店舗の組み合わせをカタログに追加する関数。
+
+    fill_missing_values と同様に、追加した行の過去の価格はその商品の月ごとの平均
+    (販売実績のない商品は 0)、過去の販売個数は 0 とする。
+    """
+    products = pd.concat([catalog[['product_id', 'category_id']], new_month_df[['product_id', 'category_id']]])
+    products = products.drop_duplicates().sort_values('product_id')
+    store_ids = np.union1d(catalog['store_id'].unique(), new_month_df['store_id'].unique())
+
+    grid = pd.DataFrame({'store_id': store_ids}).merge(products, how='cross')
+    existing = catalog[['product_id', 'store_id', 'category_id']].assign(_exists=True)
+    grid = grid.merge(existing, on=['product_id', 'store_id', 'category_id'], how='left')
+    new_rows = grid.loc[grid['_exists'].isna(), ['product_id', 'store_id', 'category_id']].reset_index(drop=True)
+    if new_rows.empty:
+        return catalog.copy(), new_rows
+
+    product_price_means = catalog.groupby('product_id')[price_columns].mean()
+    history_prices = product_price_means.reindex(pd.Index(new_rows['product_id'])).reset_index(drop=True)
+    new_rows[price_columns] = history_prices.fillna(0).clip(lower=0).astype(catalog[price_columns[0]].dtype)
+    new_rows[num_columns] = np.zeros((len(new_rows), len(num_columns)), dtype=catalog[num_columns[0]].dtype)
+    new_rows['main_flag'] = 0
+    new_rows = new_rows[catalog.columns].astype(catalog.dtypes.to_dict())
+    return pd.concat([catalog, new_rows], ignore_index=True), new_rows
+
+def update_incremental_state(state, sales_history_df, item_categories_df, category_names_df, test_df,
+                             window_size=12):
+    """
+    新しく届いた1か月分の売上データだけを使って状態を更新し、新しいスライディングウィンドウの行を作成する関数。
+
+    過去の月の集計や欠損値補完はやり直さず、グループ平均は合計と行数から差分で更新する。
+    そのため、出力する行のグループ平均はカタログ全体を作り直した場合と浮動小数点の誤差の範囲で一致する。
+
+    Parameters:
+    - state (dict): build_incremental_state または前回の update_incremental_state が返した状態。
+    - sales_history_df (pd.DataFrame): 新しい月の売上データ（sales_history.csv と同じ形式）。
+    - item_categories_df (pd.DataFrame): 商品カテゴリデータフレーム。
+    - category_names_df (pd.DataFrame): カテゴリ名データフレーム。
+    - test_df (pd.DataFrame): 予測対象の商品を含むテストデータ（test.csv と同じ形式）。
+    - window_size (int, optional): ウィンドウのサイズ（月数）。デフォルトは12。
+
+    Returns:
+    - state (dict): 更新後の状態。
+    - train_df (pd.DataFrame): 新しい月を予測対象とする訓練データの行。
+    - test_df (pd.DataFrame): 更新後のカタログから作成したテストデータ。
+    """
+    n_months = state['n_months'] + 1
+    price_columns, num_columns = _month_columns(n_months)
+    new_price_column, new_num_column = price_columns[-1], num_columns[-1]
+
+    # 1. 新しい月の売上データを集計
+    join_data_df = preprocess_data(sales_history_df, item_categories_df, category_names_df, state['start_year'])
+    months = join_data_df['month_num'].unique()
+    if len(months) != 1 or months[0] != n_months:
+        raise ValueError(f"売上データは month_num={n_months} の1か月分である必要があります: {sorted(months)}")
+    new_month_df = join_data_df.groupby(ID_COLUMNS).agg(
+        product_price=('product_price', 'mean'),
+        product_num=('product_num', 'sum'),
+    ).reset_index()
+
+    # 2. 初めて現れた商品・店舗の行を追加し、その行の過去の月をグループ合計に加える
+    catalog, new_rows = _extend_catalog(state['catalog'], new_month_df, price_columns[:-1], num_columns[:-1])
+    group_sums = state['group_sums']
+    if not new_rows.empty:
+        group_sums = _add_group_sums(group_sums, compute_group_sums(
+            new_rows, state['group_features'], price_columns[:-1], num_columns[:-1]))
+
+    # 3. 新しい月の列を追加し、fill_missing_values と同じ方法で欠損値を補完
+    new_month_values = catalog[ID_COLUMNS].merge(new_month_df, on=ID_COLUMNS, how='left')
+    new_prices = new_month_values.groupby('product_id')['product_price'].transform(lambda x: x.fillna(x.mean()))
+    catalog.insert(3 + n_months - 1, new_price_column, new_prices.fillna(0).clip(lower=0).to_numpy())
+    catalog.insert(len(catalog.columns) - 1, new_num_column, new_month_values['product_num'].fillna(0).clip(lower=0).to_numpy())
+    catalog['main_flag'] = 0
+    catalog.loc[catalog['product_id'].isin(test_df['商品ID']), 'main_flag'] = 1
+
+    # 4. 新しい月の分だけグループ合計を更新
+    group_sums = _add_group_sums(group_sums, compute_group_sums(
+        catalog, state['group_features'], [new_price_column], [new_num_column], count_rows=False))
+
+    state = dict(state, n_months=n_months, catalog=catalog, group_sums=group_sums)
+
+    # 5. 新しい月を予測対象とするステップだけをスライディングウィンドウで作成
+    catalog_feats = insert_group_features(catalog.copy(), group_averages_from_sums(group_sums, n_months))
+    n_steps = n_months - window_size + 1
+    train_df, new_test_df = generate_sliding_window_datasets(catalog_feats, window_size=window_size,
+                                                             n_steps=n_steps, n_months=n_months,
+                                                             first_step=n_steps - 1,
+                                                             group_features=state['group_features'])
+    return state, train_df, new_test_df
@@ -0,0 +1,241 @@
+import time
+import uuid
+import queue
+import pickle
+import hashlib
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+import pandas as pd
+import streamlit as st
+from .cache import frame_fingerprint, source_fingerprint
+
+# ジョブの状態
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# ワーカープロセスで進捗として送る Streamlit の表示関数
+PROGRESS_FUNCTIONS = ['write', 'success', 'info', 'warning', 'error']
+
+def input_fingerprint(value):
+    """
+    ジョブの入力からハッシュ値を計算する関数。データフレームは内容、ファイルオブジェクトはファイルの内容、
+    リスト・タプル・辞書は要素ごとに計算し、それ以外は repr を使う。
+    """
+    if isinstance(value, pd.DataFrame):
+        return frame_fingerprint(value)
+    if hasattr(value, 'read') and hasattr(value, 'seek'):
+        return source_fingerprint(value)
+    if isinstance(value, (list, tuple)):
+        return repr([input_fingerprint(item) for item in value])
+    if isinstance(value, dict):
+        return repr(sorted((str(key), input_fingerprint(item)) for key, item in value.items()))
+    return repr(value)
+
+def job_key(func, args=(), kwargs=None):
+    # 関数と入力が同じジョブは同じキーになる
+    hasher = hashlib.sha256()
+    hasher.update(f"{func.__module__}.{func.__qualname__}".encode())
+    hasher.update(input_fingerprint(list(args)).encode())
+    hasher.update(input_fingerprint(kwargs or {}).encode())
+    return hasher.hexdigest()
+
+def _progress_function(progress_queue, level):
+    def report(message, *args, **kwargs):
+        progress_queue.put({'type': 'progress', 'time': time.time(), 'level': level, 'message': str(message)})
+    return report
+
+def _picklable_items(state):
+    items = {}
+    for key, value in state.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        items[key] = value
+    return items
+
+def _run_job(func, args, kwargs, progress_queue):
+    # ワーカープロセスの中では、st.write などの出力を進捗としてキューに送る
+    for name in PROGRESS_FUNCTIONS:
+        setattr(st, name, _progress_function(progress_queue, name))
+    try:
+        result = func(*args, **kwargs)
+        progress_queue.put({'type': 'result', 'result': result,
+                            'session_state': _picklable_items(st.session_state.to_dict())})
+    except BaseException as e:
+        progress_queue.put({'type': 'error', 'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc()})
+
+class JobManager:
+    """
+    パイプラインの関数をワーカープロセスで実行するジョブキュー。
+
+    submit はジョブ ID をすぐに返し、ジョブは最大 max_workers 個まで同時に実行される。
+    ワーカーでの st.write / st.success などの出力は進捗として status から取得できる。
+    関数と入力（データフレーム・ファイルの内容を含む）が同じジョブが実行待ち・実行中であれば、
+    新しく実行せず同じジョブ ID を返す。終了したジョブは再実行の対象とし、結果を含めて一定時間・一定数だけ保持する。
+
+    Parameters:
+    - max_workers (int, optional): 同時に実行するジョブ数。デフォルトは1。
+    - mp_context (str, optional): multiprocessing の開始方法。Streamlit のサーバーはスレッドを使うため、
+      デフォルトは 'spawn'。
+    - max_finished_jobs (int, optional): 保持する終了したジョブの数。超えた場合は古いものから削除する。デフォルトは 100。
+    - finished_ttl_sec (float, optional): 終了したジョブを保持する秒数。None の場合は時間では削除しない。デフォルトは 3600。
+    """
+    def __init__(self, max_workers=1, mp_context='spawn', max_finished_jobs=100, finished_ttl_sec=3600):
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.finished_ttl_sec = finished_ttl_sec
+        self._context = multiprocessing.get_context(mp_context)
+        self._jobs = {}
+        self._job_ids_by_key = {}
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, func, args=(), kwargs=None, name=None):
+        """
+        ジョブを登録する関数。func はモジュールの最上位で定義された関数で、引数は pickle できる必要がある。
+
+        Returns:
+        - str: ジョブ ID。
+        """
+        key = job_key(func, args, kwargs)
+        with self._lock:
+            self._evict_finished_jobs()
+            job_id = self._job_ids_by_key.get(key)
+            if job_id is not None and self._jobs[job_id]['state'] in ACTIVE_STATES:
+                return job_id
+
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'name': name or func.__name__,
+                'key': key,
+                'func': func,
+                'args': tuple(args),
+                'kwargs': dict(kwargs or {}),
+                'state': JOB_QUEUED,
+                'progress': [],
+                'result': None,
+                'session_state': {},
+                'error': None,
+                'traceback': None,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'process': None,
+            }
+            self._job_ids_by_key[key] = job_id
+            self._pending.append(job_id)
+        self._start_pending_jobs()
+        return job_id
+
+    def _evict_finished_jobs(self):
+        # 終了したジョブのうち、保持期間を過ぎたものと max_finished_jobs を超えた古いものを削除する（ロックを取得して呼ぶ）
+        now = time.time()
+        # 結果を受け取ってからプロセスの終了を待つ間は finished_at が未設定のため対象にしない
+        finished = sorted((job for job in self._jobs.values()
+                           if job['state'] in FINISHED_STATES and job['finished_at'] is not None),
+                          key=lambda job: job['finished_at'])
+        n_excess = len(finished) - self.max_finished_jobs
+        for k, job in enumerate(finished):
+            expired = self.finished_ttl_sec is not None and now - job['finished_at'] > self.finished_ttl_sec
+            if k < n_excess or expired:
+                del self._jobs[job['job_id']]
+                if self._job_ids_by_key.get(job['key']) == job['job_id']:
+                    del self._job_ids_by_key[job['key']]
+
+    def _start_pending_jobs(self):
+        with self._lock:
+            n_running = sum(job['state'] == JOB_RUNNING for job in self._jobs.values())
+            while self._pending and n_running < self.max_workers:
+                job = self._jobs.get(self._pending.popleft())
+                if job is None or job['state'] != JOB_QUEUED:
+                    continue
+                progress_queue = self._context.Queue()
+                process = self._context.Process(target=_run_job,
+                                                args=(job['func'], job['args'], job['kwargs'], progress_queue),
+                                                name=f"job-{job['job_id']}")
+                process.start()
+                # 入力は実行を始めたら保持しない
+                job.update(state=JOB_RUNNING, started_at=time.time(), process=process, args=(), kwargs={})
+                threading.Thread(target=self._monitor, args=(job, progress_queue), daemon=True).start()
+                n_running += 1
+
+    def _monitor(self, job, progress_queue):
+        # ワーカーからのメッセージを受け取り、プロセスが終了したらジョブの状態を確定する
+        process = job['process']
+        finished = False
+        while not finished:
+            try:
+                message = progress_queue.get(timeout=0.2)
+            except queue.Empty:
+                finished = not process.is_alive()
+                continue
+            with self._lock:
+                if message['type'] == 'progress':
+                    job['progress'].append(message)
+                elif message['type'] == 'result':
+                    job.update(result=message['result'], session_state=message['session_state'])
+                    job['state'] = JOB_DONE if job['state'] == JOB_RUNNING else job['state']
+                else:
+                    job.update(error=message['error'], traceback=message['traceback'])
+                    job['state'] = JOB_FAILED if job['state'] == JOB_RUNNING else job['state']
+
+        process.join()
+        with self._lock:
+            if job['state'] == JOB_RUNNING:
+                job.update(state=JOB_FAILED, error=f"ワーカープロセスが終了コード {process.exitcode} で終了しました。")
+            job.update(finished_at=job['finished_at'] or time.time(), process=None)
+            self._evict_finished_jobs()
+        progress_queue.close()
+        self._start_pending_jobs()
+
+    def cancel(self, job_id):
+        """
+        実行待ちのジョブは取り消し、実行中のジョブはワーカープロセスを終了する関数。
+
+        Returns:
+        - bool: 取り消した場合は True、既に終了していた場合は False。
+        """
+        with self._lock:
+            job = self._jobs[job_id]
+            if job['state'] in FINISHED_STATES:
+                return False
+            process = job['process']
+            job.update(state=JOB_CANCELLED, finished_at=time.time(), args=(), kwargs={})
+        if process is not None:
+            process.terminate()
+        return True
+
+    def status(self, job_id):
+        """
+        ジョブの状態を返す関数。削除されたジョブ・存在しないジョブの場合は KeyError を送出する。
+
+        Returns:
+        - dict: job_id, name, state, progress（メッセージのリスト）, result, session_state
+          （ワーカーで設定されたセッションステート）, error, traceback, submitted_at, started_at, finished_at,
+          elapsed_sec, queue_position を持つ辞書。
+        """
+        with self._lock:
+            job = self._jobs[job_id]
+            status = {key: value for key, value in job.items() if key not in ('func', 'args', 'kwargs', 'process', 'key')}
+            status['progress'] = list(job['progress'])
+            end = job['finished_at'] or time.time()
+            status['elapsed_sec'] = end - job['started_at'] if job['started_at'] else 0.0
+            status['queue_position'] = list(self._pending).index(job_id) if job_id in self._pending else None
+        return status
+
+    def list_jobs(self):
+        # 登録順のジョブ一覧（進捗と結果を除く）
+        with self._lock:
+            job_ids = list(self._jobs)
+        return pd.DataFrame([{key: value for key, value in self.status(job_id).items()
+                              if key not in ('progress', 'result', 'session_state', 'traceback')}
+                             for job_id in job_ids])
@@ -1,29 +1,237 @@
+import os
+import time
+import numpy as np
 import pandas as pd
 import lightgbm as lgb
 from lightgbm import log_evaluation, early_stopping
+from .profiling import get_peak_memory_mb
+from .cache import stage_key, frame_fingerprint, touch_cache_file, evict_cache_files
+from .artifacts import iter_artifact_chunks
+from .feature_store import FeatureMatrix
 
-def set_data_set(train_df, validation_df):
-    # xとyに分割
-    train_x_df = train_df.drop(['product_num_11', 'product_num_12', 'product_price_11', 'product_price_12'], axis=1).copy()
-    train_y_df = pd.DataFrame(train_df['product_num_12'])
-    validation_x_df = validation_df.drop(['product_num_11', 'product_num_12', 'product_price_11', 'product_price_12'], axis=1).copy()
-    validation_y_df = pd.DataFrame(validation_df['product_num_12'])
+# 予測対象月の通し番号のカラム（カレンダー情報の結合と時系列の順序にだけ使い、説明変数には含めない）
+TARGET_MONTH_COLUMN = 'target_month_num'
 
-    # LightGBM用のデータセットに変換
-    lgb_train = lgb.Dataset(train_x_df, train_y_df)
-    lgb_eval = lgb.Dataset(validation_x_df, validation_y_df)
+# 説明変数から除くカラムと目的変数
+DROP_COLUMNS = ['product_num_11', 'product_num_12', 'product_price_11', 'product_price_12', TARGET_MONTH_COLUMN]
+TARGET_COLUMN = 'product_num_12'
 
+# バイナリ Dataset のキャッシュの最大合計サイズ（バイト）
+DATASET_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+def feature_array(data, feature_columns):
+    """
+    データフレームの説明変数のカラムを、LightGBM がデータフレームを変換するときと同じ型の1つの配列に書き込む関数。
+    data.drop で説明変数だけのデータフレームを作ってから変換する場合と異なり、コピーは配列の1回だけになる。
+    カテゴリ型など NumPy の数値型でないカラムがある場合は、LightGBM の変換に任せるためカラムを選んだデータフレームを返す。
+    """
+    dtypes = [data[col].dtype for col in feature_columns]
+    if not all(isinstance(dtype, np.dtype) and dtype.kind in 'biuf' for dtype in dtypes):
+        return data[feature_columns]
+    x = np.empty((len(data), len(feature_columns)), dtype=np.result_type(*dtypes, np.float32), order='F')
+    for k, col in enumerate(feature_columns):
+        x[:, k] = data[col].to_numpy()
+    return x
+
+def features_and_label(data):
+    """
+    データフレームまたは特徴量行列 (FeatureMatrix) から、説明変数・目的変数・特徴量名を取り出す関数。
+    特徴量行列の場合はメモリマップの配列をそのまま返すため、コピーは作られない。
+    """
+    if isinstance(data, FeatureMatrix):
+        return data.features, data.label, data.feature_columns
+    feature_columns = [col for col in data.columns if col not in DROP_COLUMNS]
+    return feature_array(data, feature_columns), data[TARGET_COLUMN], feature_columns
+
+def _construct_dataset(x_df, y, path, params, reference=None, feature_name='auto'):
+    # ビン分割まで済ませた Dataset を作成してバイナリで保存する（一時ファイルに書いてから置き換える）
+    dataset = lgb.Dataset(x_df, y, params=params, reference=reference, feature_name=feature_name,
+                          free_raw_data=True).construct()
+    tmp_path = f"{path}.{os.getpid()}.tmp.bin"
+    dataset.save_binary(tmp_path)
+    os.replace(tmp_path, path)
+    return dataset
+
+def _load_binary_dataset(path, params, reference=None):
+    # 保存済みの Dataset を読み込む。他のセッションに削除されていた場合は None を返し、作り直させる
+    if not os.path.exists(path):
+        return None
+    try:
+        dataset = lgb.Dataset(path, params=params, reference=reference, free_raw_data=True).construct()
+    except lgb.basic.LightGBMError:
+        if os.path.exists(path):
+            raise
+        return None
+    touch_cache_file(path)
+    return dataset
+
+def _data_fingerprint(data, data_key=None):
+    # 特徴量行列は保存時に計算した元のデータフレームのハッシュ値、data_key があればそれを使い、
+    # どちらもない場合だけデータフレーム全体のハッシュ値を計算する
+    if isinstance(data, FeatureMatrix):
+        return data.fingerprint
+    if data_key is not None:
+        return data_key
+    return frame_fingerprint(data)
+
+def dataset_cache_paths(train_df, validation_df, cache_dir, params=None, data_keys=None):
+    """
+    set_data_set がバイナリ Dataset を保存するパスを返す関数。
+    キーは訓練データ・検証データの内容と Dataset のパラメータから決まる。
+
+    Parameters:
+    - data_keys (tuple, optional): 訓練データと検証データの内容を表すキー（アップロードされたファイルのハッシュ値など）。
+      指定した場合は、データフレーム全体のハッシュ値を計算しない。
+
+    Returns:
+    - train_path (str): 訓練用 Dataset のパス。
+    - validation_path (str): 検証用 Dataset のパス。
+    """
+    train_data_key, validation_data_key = data_keys or (None, None)
+    params_key = repr(sorted((params or {}).items()))
+    train_key = stage_key('lgb_train', None, {'params': params_key, 'data': _data_fingerprint(train_df, train_data_key)})
+    validation_key = stage_key('lgb_eval', train_key, {'data': _data_fingerprint(validation_df, validation_data_key)})
+    return os.path.join(cache_dir, f'{train_key}.bin'), os.path.join(cache_dir, f'{validation_key}.bin')
+
+def set_data_set(train_df, validation_df, cache_dir=None, params=None, data_keys=None,
+                 max_cache_bytes=DATASET_CACHE_MAX_BYTES):
+    """
+    訓練データと検証データから LightGBM の Dataset を作成する関数。
+
+    cache_dir を指定すると、ビン分割済みの Dataset を訓練データの内容から求めたキーでバイナリ保存し、
+    同じデータで再度学習するときはヒストグラムの構築を省略して読み込む。
+    cache_dir の合計サイズが max_cache_bytes を超えた場合は、最も長く使われていないファイルから削除する。
+
+    train_df, validation_df には FeatureMatrix も指定でき、その場合はメモリマップの float32 の行列から
+    コピーせずに Dataset を作成する。
+
+    Parameters:
+    - train_df (pd.DataFrame or FeatureMatrix): 訓練データ。
+    - validation_df (pd.DataFrame or FeatureMatrix): 検証データ。
+    - cache_dir (str, optional): バイナリ Dataset の保存先。None の場合は保存しない。
+    - params (dict, optional): Dataset の構築に使うパラメータ（max_bin など）。学習時にも同じ値を渡すこと。
+    - data_keys (tuple, optional): 訓練データと検証データの内容を表すキー（dataset_cache_paths を参照）。
+    - max_cache_bytes (int, optional): cache_dir の最大合計サイズ（バイト）。None の場合は削除しない。
+      デフォルトは DATASET_CACHE_MAX_BYTES。
+
+    Returns:
+    - lgb_train (lgb.Dataset): 訓練用 Dataset。
+    - lgb_eval (lgb.Dataset): 訓練用 Dataset を reference とする検証用 Dataset。
+    """
+    if cache_dir is None:
+        # xとyに分割し、LightGBM用のデータセットに変換
+        train_x_df, train_y, train_features = features_and_label(train_df)
+        validation_x_df, validation_y, validation_features = features_and_label(validation_df)
+        lgb_train = lgb.Dataset(train_x_df, train_y, params=params, feature_name=train_features, free_raw_data=True)
+        lgb_eval = lgb.Dataset(validation_x_df, validation_y, params=params, reference=lgb_train,
+                               feature_name=validation_features, free_raw_data=True)
+        return lgb_train, lgb_eval
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    train_path, validation_path = dataset_cache_paths(train_df, validation_df, cache_dir, params, data_keys)
+
+    # 保存済みの Dataset を読み込めた場合は、説明変数の配列を作らない
+    lgb_train = _load_binary_dataset(train_path, params)
+    if lgb_train is not None:
+        print("ビン分割済みの訓練用 Dataset を読み込みます。")
+    else:
+        train_x_df, train_y, train_features = features_and_label(train_df)
+        lgb_train = _construct_dataset(train_x_df, train_y, train_path, params, feature_name=train_features)
+        del train_x_df
+
+    lgb_eval = _load_binary_dataset(validation_path, params, reference=lgb_train)
+    if lgb_eval is not None:
+        print("ビン分割済みの検証用 Dataset を読み込みます。")
+    else:
+        validation_x_df, validation_y, validation_features = features_and_label(validation_df)
+        lgb_eval = _construct_dataset(validation_x_df, validation_y, validation_path, params, reference=lgb_train,
+                                      feature_name=validation_features)
+
+    # 保存したファイルはハイパーパラメータ探索のワーカーがパスから読み込むため、削除の対象にしない
+    if max_cache_bytes is not None:
+        evict_cache_files(cache_dir, max_cache_bytes, keep=(train_path, validation_path))
     return lgb_train, lgb_eval
 
-def train_by_lightgbm(lgb_train, lgb_eval, round=1000):
+# 学習プロファイル（速度と精度のトレードオフ）。num_threads は実行時に指定する
+TRAINING_PROFILES = {
+    'fast': {
+        'learning_rate': 0.2,
+        'max_bin': 63,
+        'histogram_pool_size': 512,
+        'force_row_wise': True,
+        'bagging_fraction': 0.5,
+        'bagging_freq': 1,
+        'feature_fraction': 0.8,
+    },
+    'balanced': {
+        'learning_rate': 0.1,
+        'max_bin': 255,
+        'force_row_wise': True,
+        'bagging_fraction': 0.8,
+        'bagging_freq': 1,
+    },
+    'accurate': {
+        'learning_rate': 0.03,
+        'num_leaves': 63,
+        'max_bin': 511,
+        'force_col_wise': True,
+    },
+}
+
+# Dataset の構築時に決まり、学習時には変更できないパラメータ
+DATASET_PARAM_KEYS = ['max_bin', 'min_data_in_bin', 'bin_construct_sample_cnt', 'feature_pre_filter']
+
+def get_training_params(profile=None, num_threads=None, **overrides):
+    """
+    学習プロファイルから LightGBM のパラメータを作成する関数。
+
+    Parameters:
+    - profile (str, optional): TRAINING_PROFILES のキー。None の場合は LightGBM のデフォルト。
+    - num_threads (int, optional): 学習に使うスレッド数。None または 0 の場合は OpenMP のデフォルト（全コア）。
+    - overrides: プロファイルの値を上書きするパラメータ（max_bin など）。
+
+    Returns:
+    - dict: lgb.train に渡すパラメータ。
+    """
+    if profile is not None and profile not in TRAINING_PROFILES:
+        raise ValueError(f"未対応の学習プロファイルです: {profile}")
+    params = {'metric': 'rmse', 'verbosity': -1}
+    if profile is not None:
+        params.update(TRAINING_PROFILES[profile])
+    if num_threads:
+        params['num_threads'] = num_threads
+    params.update(overrides)
+    return params
+
+def get_dataset_params(params):
+    # set_data_set に渡す Dataset 用のパラメータを取り出す
+    return {key: params[key] for key in DATASET_PARAM_KEYS if key in params}
+
+def train_by_lightgbm(lgb_train, lgb_eval, round=1000, params=None, callbacks=None, stopping_rounds=500):
+    """
+    LightGBM でモデルを学習する関数。
+
+    Parameters:
+    - lgb_train, lgb_eval (lgb.Dataset): set_data_set が返した Dataset。
+    - round (int, optional): 最大の学習回数。デフォルトは 1000。
+    - params (dict, optional): 学習パラメータ。None の場合は {'metric': 'rmse'}。
+      max_bin などの Dataset 用パラメータは set_data_set にも同じ値を渡すこと。
+    - callbacks (list, optional): ログ出力・early stopping に加えて使うコールバック。
+    - stopping_rounds (int, optional): early stopping の判定に使う回数。デフォルトは 500。
+
+    Returns:
+    - lgb.Booster: 学習済みモデル。
+    """
     # ハイパーパラメータを設定
-    params = {'metric': 'rmse',
-            }
+    if params is None:
+        params = {'metric': 'rmse',
+                }
 
     callbacks = [
-        log_evaluation(period=500),  # 100イテレーションごとに結果を表示
-        early_stopping(stopping_rounds=500, verbose=True)
-        ]
+        log_evaluation(period=500),  # 500イテレーションごとに結果を表示
+        early_stopping(stopping_rounds=stopping_rounds, verbose=True)
+        ] + list(callbacks or [])
     # 学習
     gbm = lgb.train(params,
                     lgb_train,
@@ -34,3 +242,126 @@ def train_by_lightgbm(lgb_train, lgb_eval, round=1000):
     # モデルをファイルに保存
     # gbm.save_model('lightgbm_model_22_2.txt')
     return gbm
+
+def train_with_profile(train_df, validation_df, profile='balanced', round=1000, num_threads=None,
+                       cache_dir=None, **overrides):
+    """
+    学習プロファイルを指定して学習し、実行時間・ピークメモリ・検証データの RMSE を記録する関数。
+
+    Returns:
+    - gbm (lgb.Booster): 学習済みモデル。
+    - metrics (dict): profile, num_threads, wall_time_sec, peak_rss_mb, valid_rmse, best_iteration。
+      peak_rss_mb はプロセス起動からの最大常駐メモリ。
+    """
+    params = get_training_params(profile, num_threads, **overrides)
+    start = time.perf_counter()
+    lgb_train, lgb_eval = set_data_set(train_df, validation_df, cache_dir=cache_dir,
+                                       params=get_dataset_params(params))
+    gbm = train_by_lightgbm(lgb_train, lgb_eval, round, params)
+    metrics = {
+        'profile': profile,
+        'num_threads': params.get('num_threads', 0),
+        'wall_time_sec': time.perf_counter() - start,
+        'peak_rss_mb': get_peak_memory_mb(),
+        'valid_rmse': gbm.best_score['valid_1']['rmse'],
+        'best_iteration': gbm.best_iteration,
+    }
+    return gbm, metrics
+
+def compare_training_profiles(train_df, validation_df, profiles=None, round=1000, num_threads=None, cache_dir=None):
+    """
+    複数の学習プロファイルで学習し、実行時間・ピークメモリ・RMSE を一覧にする関数。
+
+    Returns:
+    - pd.DataFrame: プロファイルごとの metrics。
+    """
+    if profiles is None:
+        profiles = list(TRAINING_PROFILES)
+    rows = []
+    for profile in profiles:
+        _, metrics = train_with_profile(train_df, validation_df, profile, round, num_threads, cache_dir)
+        rows.append(metrics)
+    return pd.DataFrame(rows)
+
+# 予測結果に付けるキーのカラム
+PREDICTION_ID_COLUMNS = ['product_id', 'store_id']
+
+def predict_in_chunks(gbm, test_source, output_path, chunk_size=100_000, num_threads=0, id_columns=None):
+    """
+    テストデータを行方向のチャンクに分けて予測し、キーのカラムと予測値を CSV に追記していく関数。
+    チャンクごとに読み込み・予測・書き込みを行うため、行数が増えてもメモリ使用量は一定に保たれる。
+
+    Parameters:
+    - gbm (lgb.Booster): 学習済みモデル。
+    - test_source (pd.DataFrame, FeatureMatrix, str or file-like): テストデータ（データフレーム、特徴量行列、
+      または parquet / feather / csv）。特徴量行列の場合はメモリマップから行を切り出して予測する。
+    - output_path (str): 予測結果の保存先（CSV）。
+    - chunk_size (int, optional): 1チャンクの行数。デフォルトは 100,000。
+    - num_threads (int, optional): 予測に使うスレッド数。0 の場合は OpenMP のデフォルト。
+    - id_columns (list, optional): 予測結果に付けるキーのカラム。デフォルトは PREDICTION_ID_COLUMNS。
+
+    Returns:
+    - int: 予測した行数。
+    """
+    if id_columns is None:
+        id_columns = PREDICTION_ID_COLUMNS
+    # モデルの学習に使ったカラムを学習時の順番で使う
+    feature_names = gbm.feature_name()
+    columns = list(dict.fromkeys(id_columns + feature_names))
+
+    if isinstance(test_source, FeatureMatrix):
+        return _predict_feature_matrix(gbm, test_source, output_path, chunk_size, num_threads, id_columns)
+
+    n_rows = 0
+    for chunk in iter_artifact_chunks(test_source, columns=columns, chunk_size=chunk_size):
+        predictions = gbm.predict(chunk[feature_names], num_threads=num_threads)
+        result = chunk[id_columns].reset_index(drop=True)
+        result['predictions'] = predictions
+        result.to_csv(output_path, mode='w' if n_rows == 0 else 'a', header=n_rows == 0, index=False)
+        n_rows += len(chunk)
+    return n_rows
+
+def _predict_feature_matrix(gbm, matrix, output_path, chunk_size, num_threads, id_columns):
+    feature_names = gbm.feature_name()
+    missing = [col for col in feature_names if col not in matrix.feature_columns]
+    missing += [col for col in id_columns if col not in matrix.manifest['id_columns']]
+    if missing:
+        raise KeyError(f"特徴量行列に含まれないカラムがあります: {missing}")
+    # カラムの順番が学習時と同じ場合は、行の範囲を切り出すだけでコピーしない
+    positions = [matrix.feature_columns.index(col) for col in feature_names]
+    same_order = positions == list(range(len(matrix.feature_columns)))
+    id_positions = [matrix.manifest['id_columns'].index(col) for col in id_columns]
+
+    n_rows = len(matrix)
+    for start in range(0, n_rows, chunk_size):
+        x = matrix.features[start:start + chunk_size]
+        predictions = gbm.predict(x if same_order else x[:, positions], num_threads=num_threads)
+        result = pd.DataFrame(matrix.ids[start:start + chunk_size, id_positions], columns=id_columns)
+        result['predictions'] = predictions
+        result.to_csv(output_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    return n_rows
+
+# 検証データに対する RMSE を計算する関数（seed を固定し、同じデータからは同じモデルを学習する）
+def validation_rmse(train_df, validation_df, round=1000, seed=0):
+    params = get_training_params(seed=seed, deterministic=True, force_row_wise=True)
+    lgb_train, lgb_eval = set_data_set(train_df, validation_df)
+    gbm = train_by_lightgbm(lgb_train, lgb_eval, round, params)
+    return gbm.best_score['valid_1']['rmse']
+
+# 型の縮小によって検証データの精度が変わらないことを確認する関数
+def check_downcast_accuracy(original_frames, downcast_frames, round=1000, tolerance=0.01, seed=0):
+    """
+    元の型の前処理結果と型を縮小した前処理結果でそれぞれ学習し、検証データの RMSE の相対差が tolerance 以内かを確認する関数。
+
+    Parameters:
+    - original_frames (tuple): execute_preprocessing(downcast=False) で作成した (訓練データ, 検証データ)。
+    - downcast_frames (tuple): execute_preprocessing(downcast=True) で作成した (訓練データ, 検証データ)。
+
+    Returns:
+    - dict: rmse_original, rmse_downcast, relative_diff（RMSE の相対差）, is_within_tolerance を持つ辞書。
+    """
+    rmse_original = validation_rmse(*original_frames, round=round, seed=seed)
+    rmse_downcast = validation_rmse(*downcast_frames, round=round, seed=seed)
+    relative_diff = abs(rmse_downcast - rmse_original) / rmse_original
+    return {'rmse_original': rmse_original, 'rmse_downcast': rmse_downcast,
+            'relative_diff': relative_diff, 'is_within_tolerance': relative_diff <= tolerance}
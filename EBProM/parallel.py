@@ -0,0 +1,102 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import numpy as np
+
+def _task_args(task, results):
+    # 依存タスクの結果は args の後ろに依存順で渡す
+    return tuple(task.get('args', ())) + tuple(results[dep] for dep in task.get('deps', []))
+
+def _check_task_graph(tasks):
+    for name, task in tasks.items():
+        for dep in task.get('deps', []):
+            if dep not in tasks:
+                raise ValueError(f"タスク {name} の依存先 {dep} が存在しません。")
+
+def run_task_graph(tasks, n_workers=1, mp_context='spawn'):
+    """
+    依存関係を持つタスクを実行する関数。n_workers が 2 以上の場合はプロセスプールで並列に実行する。
+
+    Parameters:
+    - tasks (dict): タスク名をキーとし、func, args (省略可), kwargs (省略可), deps (省略可) を持つ辞書。
+      deps に指定したタスクの結果は、args の後ろに deps の順で func へ渡される。
+      並列実行する場合、func はモジュールの最上位で定義された関数である必要がある。
+    - n_workers (int, optional): ワーカープロセス数。1 以下の場合は同じプロセスで順に実行する。デフォルトは 1。
+    - mp_context (str, optional): multiprocessing の開始方法。Streamlit のサーバーのスレッドから呼ばれるため、
+      デフォルトは 'spawn'（JobManager と同じ）。
+
+    Returns:
+    - dict: タスク名をキーとする各タスクの結果。
+    """
+    _check_task_graph(tasks)
+    results = {}
+    remaining = dict(tasks)
+
+    if n_workers is None or n_workers <= 1:
+        while remaining:
+            ready = [name for name, task in remaining.items() if all(dep in results for dep in task.get('deps', []))]
+            if not ready:
+                raise ValueError(f"タスクの依存関係が循環しています: {sorted(remaining)}")
+            for name in ready:
+                task = remaining.pop(name)
+                results[name] = task['func'](*_task_args(task, results), **task.get('kwargs', {}))
+        return results
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(mp_context)) as executor:
+        running = {}
+        while remaining or running:
+            ready = [name for name, task in remaining.items() if all(dep in results for dep in task.get('deps', []))]
+            for name in ready:
+                task = remaining.pop(name)
+                future = executor.submit(task['func'], *_task_args(task, results), **task.get('kwargs', {}))
+                running[future] = name
+            if not running:
+                raise ValueError(f"タスクの依存関係が循環しています: {sorted(remaining)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+def to_shared_array(array):
+    """
+    NumPy 配列を共有メモリにコピーする関数。
+
+    Returns:
+    - shm (SharedMemory): 共有メモリ。使い終わったら close() と unlink() を呼ぶこと。
+    - descriptor (tuple): ワーカーで attach_shared_array に渡す (名前, 形状, 型) のタプル。
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def empty_shared_array(shape, dtype):
+    """
+    初期化していない共有メモリ上の配列を確保する関数。
+
+    Returns:
+    - shm (SharedMemory): 共有メモリ。使い終わったら close() と unlink() を呼ぶこと。
+    - descriptor (tuple): (名前, 形状, 型) のタプル。
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    return shm, (shm.name, tuple(shape), dtype.str)
+
+def attach_shared_array(descriptor):
+    """
+    ワーカーで共有メモリ上の配列を開く関数。
+
+    Returns:
+    - shm (SharedMemory): 共有メモリ。使い終わったら close() を呼ぶこと（unlink() は作成側が行う）。
+    - array (np.ndarray): 共有メモリ上の配列（コピーしない）。
+    """
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def release_shared_arrays(shms):
+    # 作成した共有メモリを解放する
+    for shm in shms:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import time
+import functools
+import contextvars
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+# 計測中のセッション（None の場合は計測しない）
+# Streamlit ではセッションごとに別のスレッドで実行されるため、コンテキストごとに持つ
+_session = contextvars.ContextVar('profile_session', default=None)
+
+# プロセスのピークメモリ使用量(MB)を取得する関数（取得できない環境では None）
+def get_peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位で返される
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def describe_shapes(value):
+    """
+    引数や戻り値に含まれるデータフレーム・配列の形状を返す関数（タプル・リストは要素ごと、辞書は値ごと）。
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)) or hasattr(value, 'shape'):
+        return list(value.shape)
+    if isinstance(value, (tuple, list)):
+        shapes = [describe_shapes(item) for item in value]
+        return shapes if any(shape is not None for shape in shapes) else None
+    if isinstance(value, dict):
+        shapes = {str(key): describe_shapes(item) for key, item in value.items()}
+        return {key: shape for key, shape in shapes.items() if shape is not None} or None
+    return None
+
+def profile_stage(func):
+    """
+    関数の実行時間（経過時間・CPU 時間）、メモリ（ピーク RSS の増加量・tracemalloc のピーク）、
+    入出力の形状を記録するデコレータ。profile_session の中で呼び出された場合だけ記録する。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _session.get()
+        if session is None:
+            return func(*args, **kwargs)
+
+        stack = session['stack']
+        if session['trace_memory']:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['traced_peak'] = max(stack[-1]['traced_peak'], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        frame = {'traced_start': current, 'traced_peak': current, 'order': session['n_started']}
+        session['n_started'] += 1
+        stack.append(frame)
+        rss_before = get_peak_memory_mb()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            wall_time, cpu_time = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            stack.pop()
+            if session['trace_memory']:
+                _, peak = tracemalloc.get_traced_memory()
+                frame['traced_peak'] = max(frame['traced_peak'], peak)
+                if stack:
+                    stack[-1]['traced_peak'] = max(stack[-1]['traced_peak'], frame['traced_peak'])
+        rss_after = get_peak_memory_mb()
+
+        session['records'].append({
+            'order': frame['order'],
+            'run_id': session['run_id'],
+            'stage': func.__name__,
+            'depth': len(stack),
+            'wall_time_sec': wall_time,
+            'cpu_time_sec': cpu_time,
+            'peak_rss_mb': rss_after,
+            'peak_rss_increase_mb': rss_after - rss_before if rss_before is not None else None,
+            'tracemalloc_peak_mb': ((frame['traced_peak'] - frame['traced_start']) / (1024 * 1024)
+                                    if session['trace_memory'] else None),
+            'input_shapes': describe_shapes(list(args) + list(kwargs.values())),
+            'output_shapes': describe_shapes(result),
+        })
+        return result
+    return wrapper
+
+@contextmanager
+def profile_session(log_path=None, trace_memory=False):
+    """
+    profile_stage を付けた関数の計測を有効にするコンテキストマネージャ。
+    セッションは現在のスレッド（コンテキスト）だけで有効になり、他のスレッドの計測とは混ざらない。
+
+    Parameters:
+    - log_path (str, optional): 計測結果を JSON Lines 形式で追記するファイル。None の場合は保存しない。
+    - trace_memory (bool, optional): tracemalloc でメモリ確保のピークを計測する。全てのメモリ確保が遅くなり、
+      tracemalloc はプロセス全体で共有されるため、単独で計測するときだけ指定する。デフォルトは False。
+
+    Yields:
+    - list: 計測結果（ステージごとの辞書）。終了時に実行順に並ぶ。
+    """
+    outer_session = _session.get()
+    if outer_session is not None:
+        # 既に計測中の場合は外側のセッションに記録する
+        yield outer_session['records']
+        return
+
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    records = []
+    token = _session.set({'run_id': datetime.now().strftime('%Y%m%d-%H%M%S-%f'), 'records': records, 'stack': [],
+                          'trace_memory': trace_memory, 'n_started': 0})
+    try:
+        yield records
+    finally:
+        _session.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+        # 内側の関数から先に終了するため、開始順に並べ替える
+        records.sort(key=lambda record: record.pop('order'))
+        if log_path is not None:
+            write_profile_log(records, log_path)
+
+def write_profile_log(records, log_path):
+    log_dir = os.path.dirname(log_path)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    with open(log_path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def profile_table(records):
+    """
+    計測結果を Streamlit で表示するためのデータフレームに変換する関数。
+    """
+    columns = ['stage', 'depth', 'wall_time_sec', 'cpu_time_sec', 'peak_rss_mb', 'peak_rss_increase_mb',
+               'tracemalloc_peak_mb', 'input_shapes', 'output_shapes']
+    table = pd.DataFrame(records, columns=columns)
+    table['input_shapes'] = table['input_shapes'].astype(str)
+    table['output_shapes'] = table['output_shapes'].astype(str)
+    return table
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from lightgbm import Booster
+
+def model_key(model_bytes):
+    # モデルの内容から求めたハッシュ値をキーとする
+    return hashlib.sha256(model_bytes).hexdigest()
+
+class ModelRegistry:
+    """
+    読み込み済みの LightGBM モデルをモデルの内容のハッシュ値をキーとしてメモリに保持するレジストリ。
+
+    同じモデルを再度要求された場合は解析済みの Booster を返し、max_models を超えた場合は
+    最も長く使われていないモデルから削除する。複数のスレッド（Streamlit のセッション）から共有できる。
+    """
+
+    def __init__(self, max_models=8):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_source):
+        """
+        モデルを取得する関数。未登録の場合はモデル文字列から Booster を作成して登録する。
+
+        Parameters:
+        - model_source (bytes or str): lgbm_model.txt の内容。
+
+        Returns:
+        - key (str): モデルのキー。
+        - booster (Booster): 解析済みのモデル。
+        """
+        model_bytes = model_source.encode('utf-8') if isinstance(model_source, str) else bytes(model_source)
+        key = model_key(model_bytes)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return key, self._models[key]
+
+            self.misses += 1
+            booster = Booster(model_str=model_bytes.decode('utf-8'))
+            self._models[key] = booster
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+                self.evictions += 1
+            return key, booster
+
+    def get_file(self, model_path):
+        # 保存済みのモデルファイルから取得する
+        with open(model_path, 'rb') as f:
+            return self.get(f.read())
+
+    def metrics(self):
+        """
+        ヒット数・ミス数・削除数・保持しているモデル数を返す関数。
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'models': len(self._models),
+            }
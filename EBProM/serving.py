@@ -0,0 +1,159 @@
+import time
+import threading
+from collections import deque
+import numpy as np
+import pandas as pd
+
+class LatencyStats:
+    """
+    リクエストのレイテンシとスループットを記録するクラス。
+    パーセンタイルは直近 window 件のレイテンシから計算する。
+    """
+
+    def __init__(self, window=10_000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_request(self, latency_sec, n_rows):
+        with self._lock:
+            self._latencies.append(latency_sec)
+            self.requests += 1
+            self.rows += n_rows
+
+    def record_batch(self):
+        with self._lock:
+            self.batches += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        """
+        p50/p99 レイテンシ（ミリ秒）、起動からの平均スループット、1バッチあたりの平均リクエスト数を返す関数。
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            elapsed = time.perf_counter() - self.started
+            requests, rows, batches, errors = self.requests, self.rows, self.batches, self.errors
+        return {
+            'requests': requests,
+            'rows': rows,
+            'batches': batches,
+            'errors': errors,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies, 99) * 1000) if len(latencies) else None,
+            'requests_per_sec': requests / elapsed if elapsed > 0 else 0.0,
+            'rows_per_sec': rows / elapsed if elapsed > 0 else 0.0,
+            'mean_batch_requests': requests / batches if batches else 0.0,
+        }
+
+class MicroBatcher:
+    """
+    同時に届いた予測リクエストをまとめて Booster.predict を1回で呼び出すクラス。
+
+    最初のリクエストが届いてから max_wait_ms 以内に届いたリクエストを、合計 max_batch_rows 行まで
+    1つのバッチにまとめる。predict はバッチ処理用のスレッドだけが呼び出す。
+    """
+
+    def __init__(self, booster, max_batch_rows=1024, max_wait_ms=5, num_threads=0, stats=None):
+        self.booster = booster
+        self.feature_names = booster.feature_name()
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_sec = max_wait_ms / 1000
+        self.num_threads = num_threads
+        self.stats = stats if stats is not None else LatencyStats()
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, features_df):
+        """
+        リクエスト1件分の行を予測する関数（ハンドラのスレッドから呼び出す）。
+
+        Parameters:
+        - features_df (pd.DataFrame): feature_names のカラムを含むデータフレーム。
+
+        Returns:
+        - np.ndarray: 予測値。
+        """
+        start = time.perf_counter()
+        request = {'x': features_df[self.feature_names].to_numpy(dtype=np.float64), 'done': threading.Event()}
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MicroBatcher は停止しています。")
+            self._pending.append(request)
+            self._condition.notify()
+        request['done'].wait()
+        if 'error' in request:
+            self.stats.record_error()
+            raise request['error']
+        self.stats.record_request(time.perf_counter() - start, len(request['x']))
+        return request['result']
+
+    def _next_batch(self):
+        # 最初のリクエストが届くまで待ち、その後 max_wait_sec の間だけ追加のリクエストを待つ
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if self._closed and not self._pending:
+                return None
+            deadline = time.perf_counter() + self.max_wait_sec
+            batch, n_rows = [], 0
+            while True:
+                while self._pending and n_rows + len(self._pending[0]['x']) <= self.max_batch_rows:
+                    request = self._pending.popleft()
+                    batch.append(request)
+                    n_rows += len(request['x'])
+                if not batch:
+                    # 1件で max_batch_rows を超えるリクエストはそのまま処理する
+                    batch.append(self._pending.popleft())
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or n_rows >= self.max_batch_rows or (self._pending and batch):
+                    break
+                self._condition.wait(remaining)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                predictions = self.booster.predict(np.concatenate([request['x'] for request in batch]),
+                                                   num_threads=self.num_threads)
+                offset = 0
+                for request in batch:
+                    request['result'] = predictions[offset:offset + len(request['x'])]
+                    offset += len(request['x'])
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            self.stats.record_batch()
+            for request in batch:
+                request['done'].set()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+def request_to_frame(payload):
+    """
+    JSON のリクエストをデータフレームに変換する関数。
+    {"rows": [{カラム: 値, ...}, ...]} または {"columns": [...], "data": [[...], ...]} の形式を受け付ける。
+    """
+    if 'rows' in payload:
+        return pd.DataFrame(payload['rows'])
+    if 'columns' in payload and 'data' in payload:
+        return pd.DataFrame(payload['data'], columns=payload['columns'])
+    raise ValueError("リクエストには rows、または columns と data が必要です。")
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+# 特徴量を計算する対象（product_num_* と product_price_*）
+TREND_KINDS = ['num', 'price']
+
+def default_trend_feature_spec(window_size=12):
+    """
+    generate_trend_features で使う特徴量の定義を作成する関数。
+    ウィンドウの最後の2か月は空白の月と予測対象の月のため、window_size - 2 か月目を最新の月とする。
+
+    Parameters:
+    - window_size (int, optional): スライディングウィンドウのサイズ（月数）。デフォルトは12。
+
+    Returns:
+    - list: 特徴量の定義のリスト（compute_trend_features に渡す）。
+    """
+    last = window_size - 2
+    return [
+        {'name': 'ave', 'op': 'mean', 'start': 1, 'end': last},
+        {'name': f'diff_{last}_{last - 1}', 'op': 'diff', 'month': last, 'other': last - 1},
+        {'name': f'diff_{last}_1', 'op': 'diff', 'month': last, 'other': 1},
+        {'name': f'diff_{last}_ave', 'op': 'diff_mean', 'month': last, 'start': 1, 'end': last},
+    ]
+
+def _window_values(matrix, spec):
+    # start から end までの月（1始まり、両端を含む）の列
+    return matrix[:, spec['start'] - 1:spec['end']]
+
+def _group_codes(df, keys, group_codes):
+    # グループ化キーの組み合わせごとに、グループ番号を一度だけ計算する
+    keys = tuple(keys)
+    if keys not in group_codes:
+        codes = df.groupby(list(keys), sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        group_codes[keys] = (codes, codes.max() + 1 if len(codes) else 0)
+    return group_codes[keys]
+
+def _group_aggregate(values, codes, n_groups, op):
+    # groupby().transform('sum' / 'mean') と同じく欠損値は除いて集計する（全て欠損のグループは合計 0、平均は欠損）
+    is_valid = ~np.isnan(values)
+    sums = np.bincount(codes, weights=np.where(is_valid, values, 0.0), minlength=n_groups)
+    if op == 'group_mean':
+        counts = np.bincount(codes, weights=is_valid, minlength=n_groups)
+        sums = np.divide(sums, counts, out=np.full(n_groups, np.nan), where=counts > 0)
+    return sums[codes]
+
+def _compute_feature(matrix, spec, df, group_codes):
+    op = spec['op']
+    if op == 'mean':
+        return _window_values(matrix, spec).mean(axis=1)
+    if op == 'sum':
+        return _window_values(matrix, spec).sum(axis=1)
+    if op == 'lag':
+        return matrix[:, spec['month'] - 1]
+    if op == 'diff':
+        return matrix[:, spec['month'] - 1] - matrix[:, spec['other'] - 1]
+    if op == 'diff_mean':
+        return matrix[:, spec['month'] - 1] - _window_values(matrix, spec).mean(axis=1)
+    if op == 'ratio':
+        numerator = matrix[:, spec['month'] - 1].astype(np.float64)
+        denominator = matrix[:, spec['other'] - 1].astype(np.float64)
+        return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+    if op in ('group_sum', 'group_mean'):
+        values = _window_values(matrix, spec).sum(axis=1) if 'start' in spec else matrix[:, spec['month'] - 1]
+        codes, n_groups = _group_codes(df, spec['keys'], group_codes)
+        return _group_aggregate(values.astype(np.float64), codes, n_groups, op)
+    raise ValueError(f"未対応の特徴量の種類です: {op}")
+
+def _max_month(spec):
+    # 定義の中で参照する最も新しい月
+    return max(max(feature_spec.get(key, 0) for key in ('month', 'other', 'end')) for feature_spec in spec)
+
+def compute_trend_features(df, spec):
+    """
+    特徴量の定義に従って、product_num / product_price の行列からトレンド特徴量を計算する関数。
+
+    定義は以下のキーを持つ辞書のリストで、特徴量名は '{name}_{num または price}' となる。
+    - op: 'mean' / 'sum'（start〜end 月の平均・合計）、'lag'（month 月の値）、
+      'diff'（month 月 - other 月）、'diff_mean'（month 月 - start〜end 月の平均）、
+      'ratio'（month 月 / other 月、0 除算は 0）、
+      'group_sum' / 'group_mean'（keys ごとの month 月、または start〜end 月の合計の集計）
+    - kinds (省略可): 計算する対象。デフォルトは ['num', 'price']。
+
+    各行列はデータフレームから一度だけ取り出し、グループ番号はグループ化キーの組み合わせごとに一度だけ計算する。
+
+    Parameters:
+    - df (pd.DataFrame): 定義で参照する月の product_num_* と product_price_* を持つデータフレーム。
+    - spec (list): 特徴量の定義のリスト。
+
+    Returns:
+    - pd.DataFrame: 特徴量のデータフレーム（インデックスは df と同じ）。
+    """
+    n_columns = _max_month(spec)
+    matrices = {kind: df[[f'product_{kind}_{i}' for i in range(1, n_columns + 1)]].to_numpy()
+                for kind in TREND_KINDS}
+    group_codes = {}
+    features = {}
+    for feature_spec in spec:
+        for kind in feature_spec.get('kinds', TREND_KINDS):
+            features[f"{feature_spec['name']}_{kind}"] = _compute_feature(matrices[kind], feature_spec, df, group_codes)
+    return pd.DataFrame(features, index=df.index)
+
+def group_aggregate_columns(df, group_cols, columns, agg_func='sum'):
+    """
+    グループごとの合計・平均を、元の行に対応させて計算する関数（groupby().transform と同じ結果）。
+    欠損値は除いて集計し、グループ番号は一度だけ計算して複数のカラムで共有する。
+
+    Returns:
+    - dict: カラム名をキーとする集計値の配列。
+    """
+    if agg_func not in ('sum', 'mean'):
+        raise ValueError(f"未対応の集計関数です: {agg_func}")
+    codes, n_groups = _group_codes(df, group_cols, {})
+    return {col: _group_aggregate(df[col].to_numpy(dtype=np.float64), codes, n_groups, f'group_{agg_func}')
+            for col in columns}
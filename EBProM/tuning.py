@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import numpy as np
+import lightgbm as lgb
+from lightgbm.callback import EarlyStopException
+from .machine_learning import (set_data_set, dataset_cache_paths, _data_fingerprint, train_by_lightgbm,
+                               get_training_params, get_dataset_params, DATASET_PARAM_KEYS)
+from .parallel import run_task_graph
+
+# 探索空間: パラメータ名 -> (分布, 下限, 上限)。分布は 'int', 'float', 'log'（対数一様）のいずれか
+DEFAULT_SEARCH_SPACE = {
+    'learning_rate': ('log', 0.01, 0.3),
+    'num_leaves': ('int', 15, 255),
+    'min_data_in_leaf': ('int', 5, 200),
+    'feature_fraction': ('float', 0.5, 1.0),
+    'bagging_fraction': ('float', 0.5, 1.0),
+    'lambda_l2': ('log', 1e-3, 10.0),
+}
+
+def sample_params(search_space, rng):
+    """
+    探索空間からパラメータを1組サンプリングする関数。
+
+    Parameters:
+    - search_space (dict): DEFAULT_SEARCH_SPACE と同じ形式の探索空間。
+    - rng (np.random.Generator): 乱数生成器。
+
+    Returns:
+    - dict: サンプリングしたパラメータ。
+    """
+    params = {}
+    for name, (kind, low, high) in search_space.items():
+        if kind == 'int':
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == 'float':
+            params[name] = float(rng.uniform(low, high))
+        elif kind == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            raise ValueError(f"未対応の分布です: {kind}")
+    if 'bagging_fraction' in params:
+        params['bagging_freq'] = 1
+    return params
+
+def _pruning_callback(threshold, warmup_rounds, pruned):
+    # warmup_rounds 以降に検証データの RMSE が threshold を上回った試行を打ち切る
+    def _callback(env):
+        if threshold is None or env.iteration + 1 < warmup_rounds:
+            return
+        for result in env.evaluation_result_list:
+            if result[0] == 'valid_1' and result[2] > threshold:
+                pruned.append(env.iteration + 1)
+                raise EarlyStopException(env.iteration, env.evaluation_result_list)
+    _callback.order = 40
+    return _callback
+
+def _run_trial(trial_id, train_path, validation_path, params, num_boost_round, stopping_rounds,
+               prune_threshold, warmup_rounds):
+    # ワーカーで1回の試行を実行する（Dataset はバイナリファイルから読み込むため再構築しない）
+    start = time.perf_counter()
+    dataset_params = get_dataset_params(params)
+    lgb_train = lgb.Dataset(train_path, params=dataset_params).construct()
+    lgb_eval = lgb.Dataset(validation_path, params=dataset_params, reference=lgb_train).construct()
+    pruned = []
+    gbm = train_by_lightgbm(lgb_train, lgb_eval, num_boost_round, params,
+                            callbacks=[_pruning_callback(prune_threshold, warmup_rounds, pruned)],
+                            stopping_rounds=stopping_rounds)
+    return {
+        'trial_id': trial_id,
+        'params': params,
+        'rounds': num_boost_round,
+        'best_iteration': gbm.best_iteration,
+        'valid_rmse': gbm.best_score['valid_1']['rmse'],
+        'pruned': bool(pruned),
+        'wall_time_sec': time.perf_counter() - start,
+        'model_str': gbm.model_to_string(),
+    }
+
+def _append_trial_log(log_path, records):
+    # 試行結果を JSON Lines 形式で追記する（モデル本体は含めない）
+    if log_path is None:
+        return
+    log_dir = os.path.dirname(log_path)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    with open(log_path, 'a', encoding='utf-8') as f:
+        for record in records:
+            record = {key: value for key, value in record.items() if key != 'model_str'}
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def _run_trials(trials, paths, num_boost_round, stopping_rounds, prune_threshold, warmup_rounds, n_workers):
+    tasks = {
+        trial_id: {
+            'func': _run_trial,
+            'args': (trial_id, paths[0], paths[1], params, num_boost_round, stopping_rounds,
+                     prune_threshold, warmup_rounds),
+        }
+        for trial_id, params in trials
+    }
+    results = run_task_graph(tasks, n_workers=n_workers)
+    return [results[trial_id] for trial_id, _ in trials]
+
+def _best_result(results):
+    completed = [result for result in results if not result['pruned']] or results
+    return min(completed, key=lambda result: result['valid_rmse'])
+
+def hyperparameter_search(train_df, validation_df, cache_dir, method='random', n_trials=20, n_workers=1,
+                          max_rounds=1000, min_rounds=50, eta=3, stopping_rounds=50, prune_margin=0.1,
+                          search_space=None, base_profile='balanced', log_path=None, seed=0, data_keys=None):
+    """
+    LightGBM のハイパーパラメータをランダムサーチまたは Successive Halving で探索する関数。
+
+    Dataset は set_data_set で一度だけ構築してバイナリ保存し、各試行はそれを読み込んで学習する。
+    n_workers が 2 以上の場合、試行はプロセスプールで並列に実行し、各試行のスレッド数は
+    CPU コア数 / n_workers に制限する。それまでの最良の RMSE を (1 + prune_margin) 倍しても
+    上回る試行は打ち切る。
+
+    Parameters:
+    - train_df, validation_df (pd.DataFrame): 訓練データと検証データ。
+    - cache_dir (str): バイナリ Dataset の保存先。
+    - method (str, optional): 'random' または 'halving'。デフォルトは 'random'。
+    - n_trials (int, optional): サンプリングするパラメータの組数。デフォルトは 20。
+    - n_workers (int, optional): 並列に実行する試行数。デフォルトは 1。
+    - max_rounds (int, optional): 1試行の最大学習回数。デフォルトは 1000。
+    - min_rounds (int, optional): Successive Halving の最初の学習回数。デフォルトは 50。
+    - eta (int, optional): Successive Halving で各段階に残す割合の逆数。デフォルトは 3。
+    - stopping_rounds (int, optional): 各試行の early stopping の回数。デフォルトは 50。
+    - prune_margin (float, optional): 打ち切りの基準に使う余裕。デフォルトは 0.1。
+    - search_space (dict, optional): 探索空間。デフォルトは DEFAULT_SEARCH_SPACE。
+    - base_profile (str, optional): 探索しないパラメータに使う学習プロファイル。デフォルトは 'balanced'。
+    - log_path (str, optional): 試行結果を追記する JSON Lines ファイル。None の場合は保存しない。
+    - seed (int, optional): 乱数シード。デフォルトは 0。
+    - data_keys (tuple, optional): 訓練データと検証データの内容を表すキー（dataset_cache_paths を参照）。
+
+    Returns:
+    - best (dict): 最良の試行（params, valid_rmse, best_iteration, model_str など）。
+    - results (list): 全試行の結果。
+    """
+    if method not in ('random', 'halving'):
+        raise ValueError(f"未対応の探索方法です: {method}")
+    if search_space is None:
+        search_space = DEFAULT_SEARCH_SPACE
+    fixed_keys = [key for key in search_space if key in DATASET_PARAM_KEYS]
+    if fixed_keys:
+        raise ValueError(f"Dataset の構築時に決まるパラメータは探索できません: {fixed_keys}")
+
+    n_workers = max(1, n_workers or 1)
+    # min_data_in_leaf を試行ごとに変えるため、Dataset の特徴量の事前除外は無効にする
+    base_params = get_training_params(base_profile, num_threads=max(1, (os.cpu_count() or 1) // n_workers),
+                                      feature_pre_filter=False)
+    dataset_params = get_dataset_params(base_params)
+
+    # Dataset は一度だけ構築し、各試行ではバイナリファイルを読み込む
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    # データの内容のハッシュ値は一度だけ計算し、Dataset の構築とパスの取得で共有する
+    if data_keys is None:
+        data_keys = (_data_fingerprint(train_df), _data_fingerprint(validation_df))
+    set_data_set(train_df, validation_df, cache_dir=cache_dir, params=dataset_params, data_keys=data_keys)
+    paths = dataset_cache_paths(train_df, validation_df, cache_dir, dataset_params, data_keys)
+
+    rng = np.random.default_rng(seed)
+    trials = [(f'trial_{i:03d}', dict(base_params, **sample_params(search_space, rng))) for i in range(n_trials)]
+    warmup_rounds = max(min_rounds, stopping_rounds)
+    results = []
+
+    if method == 'random':
+        # n_workers 件ずつ実行し、それまでの最良値を打ち切りの基準にする
+        for start in range(0, len(trials), n_workers):
+            threshold = _best_result(results)['valid_rmse'] * (1 + prune_margin) if results else None
+            batch = _run_trials(trials[start:start + n_workers], paths, max_rounds, stopping_rounds,
+                                threshold, warmup_rounds, n_workers)
+            for result in batch:
+                result['rung'] = 0
+            _append_trial_log(log_path, batch)
+            results.extend(batch)
+        return _best_result(results), results
+
+    # Successive Halving: 少ない学習回数で全候補を評価し、上位 1/eta だけを学習回数を増やして再評価する
+    rounds = min(min_rounds, max_rounds)
+    rung = 0
+    while True:
+        threshold = _best_result(results)['valid_rmse'] * (1 + prune_margin) if results else None
+        rung_results = _run_trials(trials, paths, rounds, stopping_rounds, threshold, warmup_rounds, n_workers)
+        for result in rung_results:
+            result['rung'] = rung
+        _append_trial_log(log_path, rung_results)
+        results.extend(rung_results)
+        if len(trials) == 1 or rounds >= max_rounds:
+            return _best_result(rung_results), results
+
+        ranked = sorted(rung_results, key=lambda result: (result['pruned'], result['valid_rmse']))
+        keep = {result['trial_id'] for result in ranked[:max(1, len(ranked) // eta)]}
+        trials = [(trial_id, params) for trial_id, params in trials if trial_id in keep]
+        rounds = min(rounds * eta, max_rounds)
+        rung += 1
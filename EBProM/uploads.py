@@ -0,0 +1,130 @@
+import threading
+import importlib.util
+from collections import OrderedDict
+import pandas as pd
+from .cache import source_fingerprint
+from .artifacts import load_artifact
+
+# アップロードされる元データの CSV のスキーマ（読み込むカラムと型）
+# 商品価格・売上個数は小数で記録されている場合もあるため float64 で読み込む
+RAW_CSV_SCHEMAS = {
+    'sales_history': {
+        'usecols': ['日付', '店舗ID', '商品ID', '商品価格', '売上個数'],
+        'dtype': {'日付': 'object', '店舗ID': 'int64', '商品ID': 'int64', '商品価格': 'float64', '売上個数': 'float64'},
+    },
+    'item_categories': {
+        'usecols': ['商品ID', '商品カテゴリID'],
+        'dtype': {'商品ID': 'int64', '商品カテゴリID': 'int64'},
+    },
+    'category_names': {
+        'usecols': ['商品カテゴリID', '商品カテゴリ名'],
+        'dtype': {'商品カテゴリID': 'int64', '商品カテゴリ名': 'object'},
+    },
+    # 先頭のインデックス列は使わない
+    'test': {
+        'usecols': ['商品ID', '店舗ID'],
+        'dtype': {'商品ID': 'int64', '店舗ID': 'int64'},
+    },
+}
+
+def csv_engine():
+    # pyarrow がインストールされていれば、マルチスレッドで読み込む pyarrow エンジンを使う
+    return 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+def read_raw_csv(source, schema_name):
+    """
+    RAW_CSV_SCHEMAS のスキーマに従って、必要なカラムだけを型を指定して読み込む関数。
+
+    Parameters:
+    - source (str or file-like): CSV ファイルのパス、またはファイルオブジェクト。
+    - schema_name (str): RAW_CSV_SCHEMAS のキー。
+
+    Returns:
+    - pd.DataFrame: 読み込んだデータフレーム（カラムは usecols の順）。
+    """
+    schema = RAW_CSV_SCHEMAS[schema_name]
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    df = pd.read_csv(source, usecols=schema['usecols'], dtype=schema['dtype'], engine=csv_engine())
+    return df[schema['usecols']]
+
+def frame_memory_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+class FrameCache:
+    """
+    読み込み済みのデータフレームを、ファイルの内容のハッシュ値と読み込み方法をキーとしてメモリに保持するキャッシュ。
+
+    合計サイズが max_bytes を超えた場合は、最も長く使われていないデータフレームから削除する。
+    複数のスレッド（Streamlit のセッション）から共有するため、返したデータフレームは変更しないこと。
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """
+        データフレームを取得する関数。キャッシュにない場合は loader() で読み込んで登録する。
+        読み込みはロックの外で行うため、他のセッションの取得を止めない。
+        """
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return self._frames[key]
+            self.misses += 1
+
+        df = loader()
+        size = frame_memory_bytes(df)
+        with self._lock:
+            if size > self.max_bytes:
+                # 上限より大きいデータフレームは保持しない
+                return df
+            self._frames[key] = df
+            self._sizes[key] = size
+            self._frames.move_to_end(key)
+            while sum(self._sizes.values()) > self.max_bytes:
+                evicted_key, _ = self._frames.popitem(last=False)
+                del self._sizes[evicted_key]
+                self.evictions += 1
+        return df
+
+    def metrics(self):
+        """
+        ヒット数・ミス数・削除数・保持しているデータフレーム数と合計サイズを返す関数。
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'frames': len(self._frames),
+                'memory_mb': sum(self._sizes.values()) / (1024 * 1024),
+            }
+
+def load_uploaded_frame(cache, uploaded_file, schema_name=None, content_hash=None):
+    """
+    アップロードされたファイルをキャッシュ経由で読み込む関数。
+
+    Parameters:
+    - cache (FrameCache): 使用するキャッシュ。
+    - uploaded_file (file-like): name 属性を持つファイルオブジェクト。
+    - schema_name (str, optional): RAW_CSV_SCHEMAS のキー。None の場合は load_artifact で拡張子から判定して読み込む。
+    - content_hash (str, optional): ファイルの内容のハッシュ値。None の場合はここで計算する。
+
+    Returns:
+    - pd.DataFrame: 読み込んだデータフレーム。
+    """
+    if content_hash is None:
+        content_hash = source_fingerprint(uploaded_file)
+    if schema_name is not None:
+        return cache.get((content_hash, schema_name), lambda: read_raw_csv(uploaded_file, schema_name))
+    return cache.get((content_hash, uploaded_file.name), lambda: load_artifact(uploaded_file))
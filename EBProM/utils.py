@@ -3,25 +3,41 @@ import numpy as np
 import matplotlib.pyplot as plt
 from tqdm.autonotebook import tqdm
 import calendar
-from datetime import date, timedelta, datetime
-import jpholiday
-# データ読み込み関数
-def load_data(data_dir):
+from datetime import date, datetime
+from .profiling import profile_stage, get_peak_memory_mb
+from .trend_features import default_trend_feature_spec, compute_trend_features, group_aggregate_columns
+from .holiday_calendar import load_calendar_table, target_month_year_months, calendar_features_by_target_month
+from .parallel import (run_task_graph, to_shared_array, empty_shared_array, attach_shared_array,
+                       release_shared_arrays)
+# データ読み込み関数（sales_chunksize を指定すると売上データは分割読み込み用のイテレータで返す）
+@profile_stage
+def load_data(data_dir, sales_chunksize=None):
     print("データを読み込んでいます...")
-    sales_history_df = pd.read_csv(data_dir + 'sales_history.csv')
+    if sales_chunksize is None:
+        sales_history_df = pd.read_csv(data_dir + 'sales_history.csv')
+    else:
+        sales_history_df = read_sales_chunks(data_dir + 'sales_history.csv', sales_chunksize)
     item_categories_df = pd.read_csv(data_dir + 'item_categories.csv')
     category_names_df = pd.read_csv(data_dir + 'category_names.csv')
     test_df = pd.read_csv(data_dir + 'test.csv', index_col=0)
     print("データの読み込みが完了しました。")
     return sales_history_df, item_categories_df, category_names_df, test_df
 
-# データ前処理関数
-def preprocess_data(sales_history_df, item_categories_df, category_names_df):
-    print("データの前処理を開始します...")
+# 売上データを chunksize 行ずつ読み込むイテレータを返す関数
+def read_sales_chunks(source, chunksize):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return pd.read_csv(source, chunksize=chunksize)
+
+# 売上データに商品カテゴリ情報を結合し、重複行を除く関数
+def join_sales_metadata(sales_history_df, item_categories_df, category_names_df):
     join_data_df = pd.merge(sales_history_df, item_categories_df, on='商品ID', how='left')
     join_data_df = pd.merge(join_data_df, category_names_df, on='商品カテゴリID', how='left')
     join_data_df = join_data_df.drop_duplicates()
+    return join_data_df
 
+# カラム名を変更し、日付を月番号 month_num (start_year の1月を1とする通し番号) に変換する関数
+def convert_sales_columns(join_data_df, start_year=2018):
     # カラム名変更
     join_data_df = join_data_df.rename(columns={'日付': 'date', '店舗ID': 'store_id', '商品ID': 'product_id',
                                                 '商品価格': 'product_price', '売上個数': 'product_num',
@@ -31,56 +47,219 @@ def preprocess_data(sales_history_df, item_categories_df, category_names_df):
     join_data_df['date'] = pd.to_datetime(join_data_df['date'])
     join_data_df['year'] = join_data_df['date'].dt.year
     join_data_df['month'] = join_data_df['date'].dt.month
-    join_data_df['month_num'] = join_data_df['month']
-    join_data_df.loc[join_data_df['year'] == 2019, 'month_num'] += 12
+    join_data_df['month_num'] = (join_data_df['year'] - start_year) * 12 + join_data_df['month']
     join_data_df = join_data_df.drop(['date', 'year', 'month'], axis=1)
+    return join_data_df
 
+# データ前処理関数
+@profile_stage
+def preprocess_data(sales_history_df, item_categories_df, category_names_df, start_year=2018):
+    print("データの前処理を開始します...")
+    join_data_df = join_sales_metadata(sales_history_df, item_categories_df, category_names_df)
+    join_data_df = convert_sales_columns(join_data_df, start_year)
     print("データの前処理が完了しました。")
     return join_data_df
 
+# カラムごとの縮小後の型。整数型は最小の幅で、値が収まらない場合は値域に合わせて広げる
+# （月次更新で month_num が増え続ける場合や、ID が int32 を超える場合も値が変わらないようにする）
+# ここにないカラムは float を float32 に、整数を値域に合わせた最小の整数型にする
+DTYPE_SCHEMA = {
+    'product_id': 'int32',
+    'store_id': 'int32',
+    'category_id': 'int32',
+    'month_num': 'int8',
+    'month_target': 'int8',
+    'target_month_num': 'int16',
+    'main_flag': 'int8',
+    'up_num_flag': 'int8',
+    'category_name': 'category',
+}
+
+def fit_integer_dtype(series, dtype):
+    """
+    整数型 dtype に series の値が収まればそのまま、収まらなければ値域に合わせて広げた型を返す関数。
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'iu' or series.empty:
+        return dtype
+    info = np.iinfo(dtype)
+    if series.min() >= info.min and series.max() <= info.max:
+        return dtype
+    return np.promote_types(dtype, pd.to_numeric(series, downcast='integer').dtype)
+
+# データフレームの数値型を縮小してメモリ使用量を削減する関数
+@profile_stage
+def downcast_dtypes(df, schema=None, verbose=True):
+    """
+    スキーマに従ってカラムの型を縮小する関数。スキーマの整数型は最小の幅として扱い、値が収まらない場合は広げる。
+
+    Parameters:
+    - df (pd.DataFrame): 対象のデータフレーム。
+    - schema (dict, optional): カラム名と型の対応。デフォルトは DTYPE_SCHEMA。
+    - verbose (bool, optional): 縮小前後のメモリ使用量を表示するかどうか。デフォルトは True。
+
+    Returns:
+    - pd.DataFrame: 型を縮小したデータフレーム。
+    """
+    if schema is None:
+        schema = DTYPE_SCHEMA
+    before_mb = df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+    dtypes = {}
+    for col in df.columns:
+        series = df[col]
+        if col in schema:
+            # 欠損値を含む列は整数型にできないため float32 にとどめる
+            if schema[col] == 'category':
+                dtypes[col] = schema[col]
+            elif series.isna().any():
+                dtypes[col] = 'float32'
+            else:
+                dtypes[col] = fit_integer_dtype(series, schema[col])
+        elif pd.api.types.is_float_dtype(series):
+            dtypes[col] = 'float32'
+        elif pd.api.types.is_integer_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            dtypes[col] = pd.to_numeric(series, downcast='integer').dtype
+    dtypes = {col: dtype for col, dtype in dtypes.items() if df[col].dtype != dtype}
+    if dtypes:
+        df = df.astype(dtypes)
+
+    if verbose:
+        after_mb = df.memory_usage(deep=True).sum() / (1024 * 1024)
+        print(f"メモリ使用量: {before_mb:.1f}MB -> {after_mb:.1f}MB")
+    return df
+
+# 商品・店舗・カテゴリ・月ごとの集計を、月を横に展開した n_months か月分の列に変換する関数
+def pivot_monthly_features(join_data_df4, n_months=22):
+    join_data_df5 = join_data_df4.unstack(level='month_num')
+    join_data_df5 = join_data_df5.reindex(
+        columns=pd.MultiIndex.from_product([['product_price', 'product_num'], range(1, n_months + 1)])
+    )
+    join_data_df5.columns = [f'{name}_{month}' for name, month in join_data_df5.columns]
+    return join_data_df5.reset_index()
+
 # 特徴量生成関数
-def generate_features(join_data_df):
+@profile_stage
+def generate_features(join_data_df, n_months=22):
     print("特徴量を生成しています...")
-    join_data_df.drop('category_name', axis=1, inplace=True, errors='ignore')
-    join_data_df4_1 = join_data_df.groupby(['product_id', 'store_id', 'category_id', 'month_num']).mean()
-    join_data_df4_2 = join_data_df.groupby(['product_id', 'store_id', 'category_id', 'month_num']).sum()
-    join_data_df4_2['product_price'] = join_data_df4_1['product_price']
-
-    join_data_df5 = join_data_df4_2.unstack(level=3)
-    join_data_df5.to_csv('./join_data_df5_main.csv')
-    join_data_df6 = pd.read_csv('./join_data_df5_main.csv', header=[0, 1, 2])
+    # 価格は月平均、販売個数は月合計を一度の groupby で集計
+    join_data_df4 = join_data_df.groupby(['product_id', 'store_id', 'category_id', 'month_num']).agg(
+        product_price=('product_price', 'mean'),
+        product_num=('product_num', 'sum'),
+    )
 
-    columns_1 = ['product_id', 'store_id', 'category_id']
-    columns_2 = ['product_price_' + str(i) for i in range(1, 23)]
-    columns_3 = ['product_num_' + str(i) for i in range(1, 23)]
-    join_data_df6.columns = columns_1 + columns_2 + columns_3
+    # 月を横に展開し、n_months か月分の列を持つ横長のデータフレームをメモリ上で作成
+    join_data_df6 = pivot_monthly_features(join_data_df4, n_months)
 
     print("特徴量の生成が完了しました。")
     return join_data_df6
 
-def complete_catalog(join_data_df):
-    product_id_pd = join_data_df[['product_id', 'category_id']].drop_duplicates().sort_values('product_id').copy()
-    join_data_df7 = pd.DataFrame()
-
-    for store_id in tqdm(sorted(join_data_df['store_id'].unique())):
-        store_data = join_data_df.loc[join_data_df['store_id'] == store_id]
-        merged_data = pd.merge(store_data, product_id_pd, on='product_id', how='right')
-        merged_data['category_id_x'] = merged_data['category_id_y']
-        merged_data.rename(columns={'category_id_x':'category_id'}, inplace=True)
-        merged_data.drop(['category_id_y'], axis=1, inplace=True, errors='ignore')
-        merged_data['store_id'] = store_id
-        join_data_df7 = pd.concat([join_data_df7, merged_data])
+# 売上データを分割して読み込みながら集計し、generate_features と同じ横長のデータフレームを作成する関数
+@profile_stage
+def aggregate_sales_in_chunks(sales_chunks, item_categories_df, category_names_df, drop_duplicates=True,
+                              n_months=22, start_year=2018):
+    """
+    売上データ全体をメモリに載せずに、preprocess_data と generate_features を通した結果と同じものを作成する関数。
+
+    各チャンクに商品カテゴリ情報を結合したうえで、(商品, 店舗, カテゴリ, 月) ごとの
+    価格の合計と件数、販売個数の合計を累積し、最後に価格の平均を求める。
+
+    Parameters:
+    - sales_chunks (iterable of pd.DataFrame): 売上データのチャンク（read_sales_chunks の戻り値など）。
+    - item_categories_df (pd.DataFrame): 商品カテゴリデータフレーム。
+    - category_names_df (pd.DataFrame): カテゴリ名データフレーム。
+    - drop_duplicates (bool, optional): チャンクをまたいだ重複行も除くかどうか。
+      True の場合、重複判定のため行ごとに 8 バイトのハッシュ値を保持する。デフォルトは True。
+    - n_months (int, optional): 横に展開する月数。デフォルトは 22。
+    - start_year (int, optional): month_num が 1 となる年。デフォルトは 2018。
+
+    Returns:
+    - pd.DataFrame: product_id, store_id, category_id と product_price_i, product_num_i を持つデータフレーム。
+    """
+    print("売上データを分割して集計しています...")
+    keys = ['product_id', 'store_id', 'category_id', 'month_num']
+    accumulator = None
+    seen_hashes = np.empty(0, dtype=np.uint64)
+
+    for chunk in tqdm(sales_chunks, desc="売上データ集計中"):
+        join_chunk = join_sales_metadata(chunk, item_categories_df, category_names_df)
+        if drop_duplicates:
+            # 以前のチャンクに含まれていた行を除く
+            row_hashes = pd.util.hash_pandas_object(join_chunk, index=False).to_numpy()
+            is_new = ~np.isin(row_hashes, seen_hashes)
+            join_chunk = join_chunk.loc[is_new]
+            seen_hashes = np.union1d(seen_hashes, row_hashes[is_new])
+        join_chunk = convert_sales_columns(join_chunk, start_year)
+
+        partial = join_chunk.groupby(keys).agg(
+            price_sum=('product_price', 'sum'),
+            price_count=('product_price', 'count'),
+            product_num=('product_num', 'sum'),
+        )
+        if accumulator is None:
+            accumulator = partial
+        else:
+            accumulator = pd.concat([accumulator, partial]).groupby(level=keys).sum()
+
+    join_data_df4 = pd.DataFrame({
+        'product_price': accumulator['price_sum'] / accumulator['price_count'],
+        'product_num': accumulator['product_num'],
+    })
+    join_data_df6 = pivot_monthly_features(join_data_df4, n_months)
+
+    print("売上データの集計が完了しました。")
+    return join_data_df6
+
+@profile_stage
+def complete_catalog(join_data_df, store_chunk_size=None):
+    """
+    全店舗 × 全商品の組み合わせを持つカタログデータを生成する関数。
+
+    Parameters:
+    - join_data_df (pd.DataFrame): generate_features で生成した集計データフレーム。
+    - store_chunk_size (int, optional): 一度に展開する店舗数。大規模なカタログでメモリを抑えたい場合に指定する。
+      デフォルトは None（全店舗を一度に展開）。
+
+    Returns:
+    - join_data_df7 (pd.DataFrame): 販売実績のない組み合わせを欠損値で補ったカタログデータフレーム。
+    """
+    product_id_pd = join_data_df[['product_id', 'category_id']].drop_duplicates().sort_values('product_id')
+    store_ids = np.sort(join_data_df['store_id'].unique())
+    # category_id は商品マスタ側の値を使う
+    value_df = join_data_df.drop('category_id', axis=1)
+
+    if store_chunk_size is None:
+        store_chunk_size = max(len(store_ids), 1)
+
+    catalog_chunks = []
+    for start in tqdm(range(0, len(store_ids), store_chunk_size)):
+        chunk_store_ids = store_ids[start:start + store_chunk_size]
+        # 店舗 × 商品の直積を作り、集計データを一度のマージで埋める
+        grid = pd.DataFrame({'store_id': chunk_store_ids}).merge(product_id_pd, how='cross')
+        chunk_values = value_df.loc[value_df['store_id'].isin(chunk_store_ids)]
+        catalog_chunks.append(grid.merge(chunk_values, on=['store_id', 'product_id'], how='left'))
+
+    join_data_df7 = pd.concat(catalog_chunks, ignore_index=True)[list(join_data_df.columns)]
+    # 従来通り、店舗ごとに 0 から始まるインデックスを振る
+    join_data_df7.index = join_data_df7.groupby('store_id').cumcount().to_numpy()
+
+    memory_mb = join_data_df7.memory_usage().sum() / (1024 * 1024)
+    peak_mb = get_peak_memory_mb()
+    # ru_maxrss はプロセス起動からの最大値で、この処理だけのピークではない
+    peak_text = f", プロセスのピーク RSS: {peak_mb:.1f}MB" if peak_mb is not None else ""
+    print(f"カタログデータ: {len(join_data_df7)}行, {memory_mb:.1f}MB{peak_text}")
     return join_data_df7
 
-def fill_missing_values(join_data_df, test_df): #適切に平均値で保管できていない可能性
+@profile_stage
+def fill_missing_values(join_data_df, test_df, n_months=22): #適切に平均値で保管できていない可能性
     print("欠損値を補完しています...")
 
-    # 'product_id'ごとに、product_price_1 から product_price_22 の欠損値をその商品の平均値で補完
-    price_columns = [f'product_price_{i}' for i in range(1, 23)]
+    # 'product_id'ごとに、product_price_1 から product_price_{n_months} の欠損値をその商品の平均値で補完
+    price_columns = [f'product_price_{i}' for i in range(1, n_months + 1)]
     join_data_df[price_columns] = join_data_df.groupby('product_id')[price_columns].transform(lambda x: x.fillna(x.mean()))
 
-    # product_price_1 から product_num_22 までの欠損値を0で補完
-    price_and_num_columns = [f'product_price_{i}' for i in range(1, 23)] + [f'product_num_{i}' for i in range(1, 23)]
+    # product_price_1 から product_num_{n_months} までの欠損値を0で補完
+    price_and_num_columns = price_columns + [f'product_num_{i}' for i in range(1, n_months + 1)]
     join_data_df[price_and_num_columns] = join_data_df[price_and_num_columns].fillna(0)
 
     # 各列の負の値を0にする
@@ -95,73 +274,264 @@ def fill_missing_values(join_data_df, test_df): #適切に平均値で保管で
     print("欠損値の補完が完了しました。")
     return join_data_df
 
+# グループ平均特徴量の定義: (特徴量名の接頭辞, グループ化キーのリスト)
+# 例えば ('store_category', ['store_id', 'category_id']) を追加すると
+# store_category_ave_num / store_category_ave_price が生成される
+GROUP_AVERAGE_FEATURES = [
+    ('product', ['product_id']),
+    ('category', ['category_id']),
+    ('store', ['store_id']),
+]
+
+# グループ平均の組み合わせ特徴量の定義: (特徴量名, 掛け合わせるグループ平均の接頭辞のリスト, 'num' または 'price')
+# 接頭辞のいずれかが group_features にない組み合わせは作成しない
+GROUP_COMBINATION_FEATURES = [
+    ('p_c_nun', ['product', 'category'], 'num'),
+    ('p_s_nun', ['product', 'store'], 'num'),
+    ('c_s_nun', ['category', 'store'], 'num'),
+    ('p_c_price', ['product', 'category'], 'price'),
+    ('p_s_price', ['product', 'store'], 'price'),
+    ('c_s_price', ['category', 'store'], 'price'),
+    ('p_c_s_nun', ['product', 'category', 'store'], 'num'),
+    ('p_c_s_price', ['product', 'category', 'store'], 'price'),
+]
+
+def available_combination_features(prefixes):
+    # 接頭辞がすべて揃っている組み合わせ特徴量の定義
+    return [(name, parts, value) for name, parts, value in GROUP_COMBINATION_FEATURES
+            if all(part in prefixes for part in parts)]
+
+def group_feature_columns(group_features=None):
+    """
+    fill_features が挿入するカラム名を挿入順に返す関数。
+
+    Parameters:
+    - group_features (list, optional): (接頭辞, グループ化キーのリスト) のリスト。デフォルトは GROUP_AVERAGE_FEATURES
+
+    Returns:
+    - list: グループ平均（{接頭辞}_ave_num, {接頭辞}_ave_price）と組み合わせ特徴量のカラム名
+    """
+    if group_features is None:
+        group_features = GROUP_AVERAGE_FEATURES
+    prefixes = [prefix for prefix, _ in group_features]
+    columns = [f'{prefix}_ave_{value}' for prefix in prefixes for value in ('num', 'price')]
+    return columns + [name for name, _, _ in available_combination_features(prefixes)]
+
+def _group_average_from_columns(columns, group_cols, num_columns, price_columns):
+    # 逐次実行・並列実行のどちらも、1次元配列の辞書から同じカラム構成のデータフレームを作って平均を取る
+    # （データフレームの作り方が異なると、集計の順序の違いで結果が数 ULP ずれるため）
+    frame = pd.DataFrame({col: columns[col] for col in list(group_cols) + num_columns + price_columns})
+    grouped = frame.groupby(list(group_cols))
+    return pd.DataFrame({
+        'ave_num': grouped[num_columns].mean().mean(axis=1),
+        'ave_price': grouped[price_columns].mean().mean(axis=1),
+    })
+
+def _group_average_task(column_descriptors, group_cols, num_columns, price_columns):
+    # ワーカーで共有メモリ上のカラムから1つのグループ化キーのグループ平均を計算する
+    shms, columns = [], {}
+    for col, descriptor in column_descriptors.items():
+        shm, columns[col] = attach_shared_array(descriptor)
+        shms.append(shm)
+    try:
+        return _group_average_from_columns(columns, group_cols, num_columns, price_columns)
+    finally:
+        # 共有メモリを閉じる前に配列への参照を外す
+        columns.clear()
+        for shm in shms:
+            shm.close()
+
+@profile_stage
+def compute_group_averages(df, group_features=None, n_months=22, n_workers=1):
+    """
+    グループごとに、月別の販売個数・価格の平均を取り、さらに月方向に平均した値を計算する関数。
+    逐次実行と並列実行は同じ関数で計算するため、結果はビット単位で一致する。
+
+    Parameters:
+    - df (pd.DataFrame): 欠損値補完済みのカタログデータフレーム
+    - group_features (list, optional): (接頭辞, グループ化キーのリスト) のリスト。デフォルトは GROUP_AVERAGE_FEATURES
+    - n_months (int, optional): 月数。デフォルトは 22
+    - n_workers (int, optional): 2 以上の場合、グループ化キーごとにプロセスプールで並列に計算する。デフォルトは 1
+
+    Returns:
+    - dict: 接頭辞ごとに、グループ化キーをインデックスとし ave_num, ave_price を列に持つデータフレーム
+    """
+    if group_features is None:
+        group_features = GROUP_AVERAGE_FEATURES
+    num_columns = [f'product_num_{i}' for i in range(1, n_months + 1)]
+    price_columns = [f'product_price_{i}' for i in range(1, n_months + 1)]
+    key_columns = list(dict.fromkeys(col for _, group_cols in group_features for col in group_cols))
+    used_columns = key_columns + num_columns + price_columns
+
+    if n_workers is None or n_workers <= 1:
+        columns = {col: df[col].to_numpy() for col in used_columns}
+        return {prefix: _group_average_from_columns(columns, group_cols, num_columns, price_columns)
+                for prefix, group_cols in group_features}
+
+    # 使うカラムを1列ずつ共有メモリに置き、ワーカーへは名前だけを渡す
+    shms = []
+    try:
+        descriptors = {}
+        for col in used_columns:
+            shm, descriptors[col] = to_shared_array(df[col].to_numpy())
+            shms.append(shm)
+
+        tasks = {}
+        for prefix, group_cols in group_features:
+            column_descriptors = {col: descriptors[col] for col in list(group_cols) + num_columns + price_columns}
+            tasks[prefix] = {'func': _group_average_task,
+                             'args': (column_descriptors, group_cols, num_columns, price_columns)}
+        results = run_task_graph(tasks, n_workers)
+    finally:
+        release_shared_arrays(shms)
+    return {prefix: results[prefix] for prefix, _ in group_features}
+
+def broadcast_group_values(df, group_values):
+    """
+    グループ化キーをインデックスに持つ値を、キーで df の各行へ割り当てる関数。
+
+    Parameters:
+    - df (pd.DataFrame): 対象のデータフレーム
+    - group_values (pd.DataFrame): グループ化キーをインデックスに持つデータフレーム
+
+    Returns:
+    - pd.DataFrame: df の各行に対応するグループの値（インデックスは 0 からの連番）
+    """
+    group_cols = list(group_values.index.names)
+    if len(group_cols) == 1:
+        keys = pd.Index(df[group_cols[0]], name=group_cols[0])
+    else:
+        keys = pd.MultiIndex.from_frame(df[group_cols])
+    return group_values.reindex(keys).reset_index(drop=True)
+
+def insert_group_features(join_data_df10, group_averages):
+    """
+    グループ平均とその組み合わせ特徴量を、product_id, store_id, category_id の直後に挿入する関数。
+    組み合わせ特徴量は GROUP_COMBINATION_FEATURES のうち、group_averages に全ての接頭辞があるものだけを作成する。
+
+    Parameters:
+    - join_data_df10 (pd.DataFrame): 対象のデータフレーム
+    - group_averages (dict): compute_group_averages の戻り値
+
+    Returns:
+    - pd.DataFrame: 特徴量を挿入したデータフレーム
+    """
+    # 特徴量生成1: 商品、カテゴリ、店舗ごとの平均値を、キーで各行に割り当てる
+    for k, (prefix, group_values) in enumerate(group_averages.items()):
+        values = broadcast_group_values(join_data_df10, group_values)
+        join_data_df10.insert(3 + 2 * k, f'{prefix}_ave_num', values['ave_num'].to_numpy())
+        join_data_df10.insert(4 + 2 * k, f'{prefix}_ave_price', values['ave_price'].to_numpy())
+
+    # 特徴量生成2: 商品、カテゴリ、店舗ごとの組み合わせを生成（GROUP_COMBINATION_FEATURES のうち、平均がある接頭辞の組み合わせだけ）
+    pos = 3 + 2 * len(group_averages)
+    for k, (name, parts, value) in enumerate(available_combination_features(group_averages)):
+        product = join_data_df10[f'{parts[0]}_ave_{value}']
+        for part in parts[1:]:
+            product = product * join_data_df10[f'{part}_ave_{value}']
+        join_data_df10.insert(pos + k, name, product)
+    return join_data_df10
+
 # 特徴量作成関数
-def fill_features(join_data_df10):
+@profile_stage
+def fill_features(join_data_df10, group_features=None, n_months=22, n_workers=1):
     print("追加の特徴量を生成しています...")
-    # 特徴量生成1: 商品、カテゴリ、店舗ごとの平均値を生成
-    target_columns = ['product_id', 'store_id', 'category_id'] + [f'product_num_{i}' for i in range(1, 23)] + [f'product_price_{i}' for i in range(1, 23)]
-    join_data_df10_feats = join_data_df10[target_columns]
-
-    # 1. 商品ごとの平均個数と平均価格
-    product_ave_num = join_data_df10_feats.groupby('product_id').mean().loc[:, 'product_num_1': 'product_num_22'].mean(axis=1)
-    product_ave_price = join_data_df10_feats.groupby('product_id').mean().loc[:, 'product_price_1': 'product_price_22'].mean(axis=1)
-
-    join_data_df10.insert(3, 'product_ave_num', 0)
-    join_data_df10.insert(4, 'product_ave_price', 0)
-    for product_id in tqdm(product_ave_num.index):
-        join_data_df10.loc[join_data_df10['product_id'] == product_id, 'product_ave_num'] = product_ave_num[product_id]
-        join_data_df10.loc[join_data_df10['product_id'] == product_id, 'product_ave_price'] = product_ave_price[product_id]
-
-    # 2. カテゴリごとの平均個数と平均価格
-    category_ave_num = join_data_df10.groupby('category_id').mean().loc[:, 'product_num_1': 'product_num_22'].mean(axis=1)
-    category_ave_price = join_data_df10.groupby('category_id').mean().loc[:, 'product_price_1': 'product_price_22'].mean(axis=1)
-
-    join_data_df10.insert(5, 'category_ave_num', 0)
-    join_data_df10.insert(6, 'category_ave_price', 0)
-    for category_id in tqdm(category_ave_num.index):
-        join_data_df10.loc[join_data_df10['category_id'] == category_id, 'category_ave_num'] = category_ave_num[category_id]
-        join_data_df10.loc[join_data_df10['category_id'] == category_id, 'category_ave_price'] = category_ave_price[category_id]
-
-    # 3. 店舗ごとの平均個数と平均価格
-    store_ave_num = join_data_df10.groupby('store_id').mean().loc[:, 'product_num_1': 'product_num_22'].mean(axis=1)
-    store_ave_price = join_data_df10.groupby('store_id').mean().loc[:, 'product_price_1': 'product_price_22'].mean(axis=1)
-
-    join_data_df10.insert(7, 'store_ave_num', 0)
-    join_data_df10.insert(8, 'store_ave_price', 0)
-    for store_id in tqdm(store_ave_num.index):
-        join_data_df10.loc[join_data_df10['store_id'] == store_id, 'store_ave_num'] = store_ave_num[store_id]
-        join_data_df10.loc[join_data_df10['store_id'] == store_id, 'store_ave_price'] = store_ave_price[store_id]
-
-    # 特徴量生成2: 商品、カテゴリ、店舗ごとの組み合わせを生成
-    join_data_df10.insert(9, 'p_c_nun', join_data_df10['product_ave_num'] * join_data_df10['category_ave_num'])
-    join_data_df10.insert(10, 'p_s_nun', join_data_df10['product_ave_num'] * join_data_df10['store_ave_num'])
-    join_data_df10.insert(11, 'c_s_nun', join_data_df10['category_ave_num'] * join_data_df10['store_ave_num'])
-    join_data_df10.insert(12, 'p_c_price', join_data_df10['product_ave_price'] * join_data_df10['category_ave_price'])
-    join_data_df10.insert(13, 'p_s_price', join_data_df10['product_ave_price'] * join_data_df10['store_ave_price'])
-    join_data_df10.insert(14, 'c_s_price', join_data_df10['category_ave_price'] * join_data_df10['store_ave_price'])
-
-    # さらに複合特徴量を生成
-    join_data_df10.insert(15, 'p_c_s_nun', join_data_df10['product_ave_num'] * join_data_df10['category_ave_num'] * join_data_df10['store_ave_num'])
-    join_data_df10.insert(16, 'p_c_s_price', join_data_df10['product_ave_price'] * join_data_df10['category_ave_price'] * join_data_df10['store_ave_price'])
-
+    # グループごとに平均を一度だけ計算し、各行に割り当てる
+    group_averages = compute_group_averages(join_data_df10, group_features, n_months, n_workers)
+    join_data_df10 = insert_group_features(join_data_df10, group_averages)
     print("追加の特徴量生成が完了しました。")
     return join_data_df10
 
 import pandas as pd
 from tqdm import tqdm
 
+def _sliding_window_step_task(out_descriptor, matrix_descriptors, window_size, first_step, step):
+    # ワーカーで1ステップ分のウィンドウを共有メモリ上の出力行列へ書き込む
+    shms, arrays = [], []
+    for descriptor in [out_descriptor] + list(matrix_descriptors):
+        shm, array = attach_shared_array(descriptor)
+        shms.append(shm)
+        arrays.append(array)
+    try:
+        out = arrays[0]
+        for k, matrix in enumerate(arrays[1:]):
+            out[step - first_step, :, k * window_size:(k + 1) * window_size] = matrix[:, step:step + window_size]
+    finally:
+        # 共有メモリを閉じる前に配列への参照を外す
+        out = None
+        arrays.clear()
+        for shm in shms:
+            shm.close()
+
+def stack_sliding_windows(matrices, window_size, n_steps, first_step=0, n_workers=1):
+    """
+    月方向に並んだ行列からスライディングウィンドウを切り出し、ステップ順に縦に積んだ行列を返す関数。
+    各ウィンドウはストライドを使ったビューとして取り出し、出力行列は一度だけ確保する。
+
+    Parameters:
+    - matrices (list of np.ndarray): (行数, 月数) の行列のリスト。出力では横に並べられる。
+    - window_size (int): ウィンドウのサイズ（月数）。
+    - n_steps (int): ウィンドウを適用するステップ数。
+    - first_step (int, optional): 最初に切り出すステップ。first_step から n_steps - 1 までのステップを返す。デフォルトは 0。
+    - n_workers (int, optional): 2 以上の場合、ステップごとにプロセスプールで並列に書き込む。デフォルトは 1。
+
+    Returns:
+    - np.ndarray: ((n_steps - first_step) * 行数, len(matrices) * window_size) の行列。
+    """
+    n_rows = matrices[0].shape[0]
+    n_out_steps = n_steps - first_step
+    dtype = np.result_type(*matrices)
+    shape = (n_out_steps, n_rows, len(matrices) * window_size)
+
+    if n_workers is not None and n_workers > 1:
+        # 入力と出力の行列を共有メモリに置き、各ワーカーが担当するステップの範囲だけを書き込む
+        shms = []
+        try:
+            out_shm, out_descriptor = empty_shared_array(shape, dtype)
+            shms.append(out_shm)
+            matrix_descriptors = []
+            for matrix in matrices:
+                shm, descriptor = to_shared_array(matrix.astype(dtype, copy=False))
+                shms.append(shm)
+                matrix_descriptors.append(descriptor)
+            tasks = {step: {'func': _sliding_window_step_task,
+                            'args': (out_descriptor, matrix_descriptors, window_size, first_step, step)}
+                     for step in range(first_step, n_steps)}
+            run_task_graph(tasks, n_workers)
+            stacked = np.ndarray(shape, dtype=dtype, buffer=out_shm.buf).copy()
+        finally:
+            release_shared_arrays(shms)
+        return stacked.reshape(n_out_steps * n_rows, len(matrices) * window_size)
+
+    stacked = np.empty(shape, dtype=dtype)
+    for k, matrix in enumerate(matrices):
+        # windows[r, i, :] == matrix[r, i:i + window_size]
+        windows = np.lib.stride_tricks.sliding_window_view(matrix, window_size, axis=1)[:, first_step:n_steps, :]
+        np.copyto(stacked[:, :, k * window_size:(k + 1) * window_size], windows.transpose(1, 0, 2))
+    return stacked.reshape(n_out_steps * n_rows, len(matrices) * window_size)
+
+@profile_stage
 def generate_sliding_window_datasets(df,
                                      columns_to_front=None,
                                      window_size=12,
-                                     n_steps=11):
+                                     n_steps=11,
+                                     n_months=None,
+                                     first_step=0,
+                                     n_workers=1,
+                                     group_features=None):
     """
     スライディングウィンドウを用いて訓練データフレームとテストデータフレームを生成する関数。
 
     Parameters:
     - df (pd.DataFrame): 元のデータフレーム。
-    - columns_to_front (list, optional): 先頭に配置するカラムのリスト。デフォルトは以下のリスト。
+    - columns_to_front (list, optional): 先頭に配置し、訓練データ・テストデータにそのまま含めるカラムのリスト。
+      デフォルトは main_flag と ID のカラム、group_features から fill_features が作成したカラム。
     - window_size (int, optional): ウィンドウのサイズ（月数）。デフォルトは12。
     - n_steps (int, optional): ウィンドウを適用するステップ数。デフォルトは11。
+    - n_months (int, optional): df に含まれる月数。テストデータは最後の window_size - 2 か月から作成する。
+      デフォルトは window_size + n_steps - 1。
+    - first_step (int, optional): 訓練データに含める最初のステップ。月次更新で新しいステップだけを作る場合に指定する。デフォルトは0。
+    - n_workers (int, optional): ウィンドウの切り出しに使うワーカープロセス数。デフォルトは1。
+    - group_features (list, optional): fill_features に渡したグループ平均特徴量の定義。デフォルトは GROUP_AVERAGE_FEATURES。
 
     Returns:
     - train_df (pd.DataFrame): スライディングウィンドウを適用した訓練データフレーム。
@@ -170,15 +540,7 @@ def generate_sliding_window_datasets(df,
 
     # デフォルトの columns_to_front を設定
     if columns_to_front is None:
-        columns_to_front = [
-            'main_flag', 'product_id', 'store_id', 'category_id',
-            'product_ave_num', 'product_ave_price',
-            'category_ave_num', 'category_ave_price',
-            'store_ave_num', 'store_ave_price',
-            'p_c_nun', 'p_s_nun', 'c_s_nun',
-            'p_c_price', 'p_s_price', 'c_s_price',
-            'p_c_s_nun', 'p_c_s_price'
-        ]
+        columns_to_front = ['main_flag', 'product_id', 'store_id', 'category_id'] + group_feature_columns(group_features)
 
     # 2. その他のカラムを取得（移動させたいカラムを除く）
     remaining_columns = [col for col in df.columns if col not in columns_to_front]
@@ -189,186 +551,142 @@ def generate_sliding_window_datasets(df,
     # データフレームを新しいカラム順に並べ替え
     df_reordered = df[new_column_order].copy()
 
+    if n_months is None:
+        n_months = window_size + n_steps - 1
+
     # テストデータの作成
     # main_flagが1の行を抽出
     tmp0_df = df_reordered.loc[df_reordered['main_flag'] == 1]
 
-    # test_dfの作成
-    tmp1_df = tmp0_df.loc[:, 'main_flag':'p_c_s_price'].copy()
-    tmp2_df = tmp0_df.loc[:, 'product_num_13':'product_num_22'].copy()
-    tmp2_df = tmp2_df.rename(columns=lambda x: x[:12] + str(int(x[12:])-12))
-    tmp3_df = tmp0_df.loc[:, 'product_price_13':'product_price_22'].copy()
-    tmp3_df = tmp3_df.rename(columns=lambda x: x[:14] + str(int(x[14:])-12))
+    # test_dfの作成 (最後の window_size - 2 か月を 1 か月目からの列名に付け替える)
+    test_months = range(n_months - window_size + 3, n_months + 1)
+    tmp1_df = tmp0_df[columns_to_front].copy()
+    tmp2_df = tmp0_df[[f'product_num_{m}' for m in test_months]].copy()
+    tmp2_df.columns = [f'product_num_{j}' for j in range(1, len(test_months) + 1)]
+    tmp3_df = tmp0_df[[f'product_price_{m}' for m in test_months]].copy()
+    tmp3_df.columns = [f'product_price_{j}' for j in range(1, len(test_months) + 1)]
     tmp4_df = pd.concat([tmp1_df, tmp2_df, tmp3_df], axis=1)
 
-    # month_target を追加
-    tmp4_df.insert(1, 'month_target', 12)
+    # 予測対象の月の通し番号 target_month_num と月 month_target を追加 (最後の月の2か月後を予測対象とする)
+    test_target_month_num = n_months + 2
+    tmp4_df.insert(1, 'month_target', (test_target_month_num - 1) % 12 + 1)
+    tmp4_df.insert(2, 'target_month_num', test_target_month_num)
 
     test_df = tmp4_df.copy()
 
     # 訓練データの作成
     # main_flagが1以外の全行を対象とする
-    catarog_copy2 = df_reordered.copy()
-
-    # 予測対象の月を示す変数　month_targetを計算する関数
-    def calc_month_target(n):
-        tmp = n % 12
-        return 12 if tmp == 0 else tmp
-
-    # 空のデータフレームを用意
-    train_df = pd.DataFrame()
-
-    # スライディングウィンドウの適用
-    for i in tqdm(range(n_steps), desc="スライディングウィンドウ適用中"):
-        # 基本カラムを抽出
-        tmp1_df = catarog_copy2.loc[:, 'main_flag':'p_c_s_price'].copy()
-
-        # product_numのシフト
-        product_num_cols = [f'product_num_{j}' for j in range(i+1, i+window_size+1)]
-        tmp_num = catarog_copy2[product_num_cols].copy()
-        tmp_num.columns = [f'product_num_{j-i}' for j in range(i+1, i+window_size+1)]
-
-        # product_priceのシフト
-        product_price_cols = [f'product_price_{j}' for j in range(i+1, i+window_size+1)]
-        tmp_price = catarog_copy2[product_price_cols].copy()
-        tmp_price.columns = [f'product_price_{j-i}' for j in range(i+1, i+window_size+1)]
-
-        # シフトしたデータを結合
-        tmp_combined = pd.concat([tmp1_df, tmp_num, tmp_price], axis=1)
-
-        # 'month_target' を追加
-        tmp_combined.insert(1, 'month_target', calc_month_target(i))
-
-        # 訓練データに追加
-        train_df = pd.concat([train_df, tmp_combined], ignore_index=True)
+    n_rows = len(df_reordered)
+    n_train_months = window_size + n_steps - 1
+
+    # 基本カラムをステップ数だけ繰り返して抽出（ステップ順に縦に積む）
+    steps = np.arange(first_step, n_steps)
+    base_df = df_reordered[columns_to_front]
+    train_base_df = base_df.iloc[np.tile(np.arange(n_rows), len(steps))].reset_index(drop=True)
+
+    # 予測対象の月を示す変数 month_target (ステップ0が12月、以降1月, 2月, ...)
+    # 目的変数 product_num_12 はステップ s で s + 12 か月目のため、その通し番号を target_month_num とする
+    # （年をまたいで同じ month_target になるステップを区別するため、カレンダー情報や時系列の順序はこちらを使う）
+    target_month_nums = steps + 12
+    train_base_df.insert(1, 'month_target', np.repeat((target_month_nums - 1) % 12 + 1, n_rows))
+    train_base_df.insert(2, 'target_month_num', np.repeat(target_month_nums, n_rows))
+
+    # product_num と product_price のウィンドウをビューとして取り出し、確保済みの行列へ一度に書き込む
+    num_matrix = df_reordered[[f'product_num_{j}' for j in range(1, n_train_months + 1)]].to_numpy()
+    price_matrix = df_reordered[[f'product_price_{j}' for j in range(1, n_train_months + 1)]].to_numpy()
+    window_matrix = stack_sliding_windows([num_matrix, price_matrix], window_size, n_steps, first_step, n_workers)
+    window_columns = ([f'product_num_{j}' for j in range(1, window_size + 1)] +
+                      [f'product_price_{j}' for j in range(1, window_size + 1)])
+    window_df = pd.DataFrame(window_matrix, columns=window_columns)
+
+    train_df = pd.concat([train_base_df, window_df], axis=1)
 
     return train_df, test_df
 
 
 import pandas as pd
 
-def generate_trend_features(train_df, test_df):
+def apply_trend_features(df, spec=None, window_size=12):
+    """
+    データフレームに、特徴量の定義に従ってトレンド特徴量を追加する関数。
+
+    Parameters:
+    - df (pd.DataFrame): 訓練データまたはテストデータのデータフレーム。
+    - spec (list, optional): 特徴量の定義（compute_trend_features を参照）。デフォルトは default_trend_feature_spec(window_size)。
+    - window_size (int, optional): ウィンドウのサイズ（月数）。デフォルトは12。
+
+    Returns:
+    - df_gen (pd.DataFrame): 新しい特徴量が追加されたデータフレーム。
+    """
+    if spec is None:
+        spec = default_trend_feature_spec(window_size)
+    features_df = compute_trend_features(df, spec)
+    # 同じ名前のカラムがある場合は置き換える
+    return pd.concat([df.drop(columns=[col for col in features_df.columns if col in df.columns]), features_df], axis=1)
+
+@profile_stage
+def generate_trend_features(train_df, test_df, spec=None, window_size=12):
     """
     訓練データとテストデータに対して、定義された特徴量操作を適用して新しい特徴量を生成する関数。
+    列ごとの NumPy の計算で済むため、データフレームをワーカーへ送る往復のコストを避けて同じプロセスで実行する。
 
     Parameters:
     - train_df (pd.DataFrame): 訓練データフレーム。
     - test_df (pd.DataFrame): テストデータフレーム。
+    - spec (list, optional): 特徴量の定義。デフォルトは default_trend_feature_spec(window_size)。
+    - window_size (int, optional): ウィンドウのサイズ（月数）。デフォルトは12。
 
     Returns:
     - train_df_gen (pd.DataFrame): 新しい特徴量が追加された訓練データフレーム。
     - test_df_gen (pd.DataFrame): 新しい特徴量が追加されたテストデータフレーム。
     """
-
-    # 特徴量名と対応する計算方法を定義
-    feature_operations = {
-        'ave_num': lambda df: df.loc[:, 'product_num_1':'product_num_10'].mean(axis=1),
-        'ave_price': lambda df: df.loc[:, 'product_price_1':'product_price_10'].mean(axis=1),
-        'diff_10_9_num': lambda df: df['product_num_10'] - df['product_num_9'],
-        'diff_10_9_price': lambda df: df['product_price_10'] - df['product_price_9'],
-        'diff_10_1_num': lambda df: df['product_num_10'] - df['product_num_1'],
-        'diff_10_1_price': lambda df: df['product_price_10'] - df['product_price_1'],
-        'diff_10_ave_num': lambda df: df['product_num_10'] - df['ave_num'],
-        'diff_10_ave_price': lambda df: df['product_price_10'] - df['ave_price']
-    }
-
-    # 特徴量生成関数
-    def apply_feature_operations(df, feature_ops):
-        for feature_name, operation in feature_ops.items():
-            df[feature_name] = operation(df)
-        return df
-
-    # 訓練データに特徴量を生成
-    train_df_copy = train_df.copy()
-    train_df_gen = apply_feature_operations(train_df_copy, feature_operations)
-
-    # テストデータに特徴量を生成
-    test_df_copy = test_df.copy()
-    test_df_gen = apply_feature_operations(test_df_copy, feature_operations)
-
-    return train_df_gen, test_df_gen
+    return (apply_trend_features(train_df, spec, window_size),
+            apply_trend_features(test_df, spec, window_size))
 
 import pandas as pd
-from datetime import datetime, timedelta
-import jpholiday
 
-def add_calendar_features(train_df, test_df, start_date='2018-01-01', end_date='2019-12-31', predict_year_month=(2019, 12)):
+@profile_stage
+def add_calendar_features(train_df, test_df, start_date='2018-01-01', end_date='2019-12-31', predict_year_month=(2019, 12),
+                          calendar_path=None):
     """
     訓練データとテストデータにカレンダー情報を追加する関数。
 
+    (year, month) ごとの日数・休日数は holiday_calendar のカレンダー表から取得し、
+    各行の予測対象月の通し番号 target_month_num を、テストデータの予測月 predict_year_month からの
+    差の月数で (year, month) に変換して結合する。
+    結合は1回のマージで済むため、データフレームをワーカーへ送る往復のコストを避けて同じプロセスで実行する。
+
     Parameters:
     - train_df (pd.DataFrame): 訓練データフレーム。
     - test_df (pd.DataFrame): テストデータフレーム。
-    - start_date (str, optional): カレンダー情報の開始日。デフォルトは '2018-01-01'。
-    - end_date (str, optional): カレンダー情報の終了日。デフォルトは '2019-12-31'。
+    - start_date (str, optional): カレンダー表の開始日（年のみ使用）。デフォルトは '2018-01-01'。
+    - end_date (str, optional): カレンダー表の終了日（年のみ使用）。デフォルトは '2019-12-31'。
+      予測対象月が範囲外の場合は、自動的に範囲を広げる。
     - predict_year_month (tuple, optional): テストデータ用の年と月。デフォルトは (2019, 12)。
+    - calendar_path (str, optional): カレンダー表を保存する parquet ファイル。None の場合は保存しない。
 
     Returns:
     - train_df_cal (pd.DataFrame): カレンダー情報が追加された訓練データフレーム。
     - test_df_cal (pd.DataFrame): カレンダー情報が追加されたテストデータフレーム。
     """
-
-    # 1. 休日判定関数の定義
-    def isHoliday(date):
-        if jpholiday.is_holiday(date):
-            return 1
-        elif date.weekday() >= 5:
-            return 1
-        else:
-            return 0
-
-    # 2. 日数と休日数の集計
-    start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-    end_datetime = datetime.strptime(end_date, '%Y-%m-%d')
-    delta = end_datetime - start_datetime
-    date_list = [start_datetime + timedelta(days=i) for i in range(delta.days + 1)]
-
-    # 日付データフレームの作成
-    all_date_df = pd.DataFrame({'datetime': date_list})
-    all_date_df['is_holiday'] = all_date_df['datetime'].apply(isHoliday).astype(int)
-    all_date_df['year'] = all_date_df['datetime'].dt.year
-    all_date_df['month'] = all_date_df['datetime'].dt.month
-
-    # (year, month)ごとに日数と休日数を集計
-    day_holiday_num_df = all_date_df.groupby(['year', 'month']).agg(
-        day_each_month=('datetime', 'count'),
-        holiday_each_month=('is_holiday', 'sum')
-    ).reset_index()
-
-    # day_holiday_monthを計算
-    day_holiday_num_df['day_holiday_month'] = day_holiday_num_df['day_each_month'] * day_holiday_num_df['holiday_each_month']
-    day_holiday_num_df.set_index(['year', 'month'], inplace=True)
-
-    # 2018年12月 〜　2019年10月
-    day_holiday_num_df_12_10 = day_holiday_num_df.loc[(2018, 12): (2019, 10)]
-    day_holiday_num_df_12_10 = day_holiday_num_df_12_10.reset_index().set_index('month')
-
-    # 2019年12月 (予測用)
-    day_holiday_num_df_12 = day_holiday_num_df.loc[(2019, 12)]
-    day_holiday_num_df_12 = pd.DataFrame(day_holiday_num_df_12)
-
-    # カレンダー情報のマッピング用 DataFrameを準備
-    calendar_train_df = day_holiday_num_df_12_10.reset_index().rename(columns={'month': 'month_target'})
-
-    # 3. 訓練データにカレンダー情報をマージ
-    train_df_cal = train_df.merge(
-        calendar_train_df[['month_target', 'day_each_month', 'holiday_each_month', 'day_holiday_month']],
-        on='month_target',
-        how='left'
-    )
-
-    # 4. テストデータにカレンダー情報を追加
-    test_df_cal = test_df.merge(
-        calendar_train_df[['month_target', 'day_each_month', 'holiday_each_month', 'day_holiday_month']],
-        on='month_target',
-        how='left'
-    )
-
-    # テストデータ用の2019年12月のカレンダー情報を追加
-    test_df_cal['day_each_month'] = day_holiday_num_df_12.loc['day_each_month', (2019, 12)]
-    test_df_cal['holiday_each_month'] = day_holiday_num_df_12.loc['holiday_each_month', (2019, 12)]
-    test_df_cal['day_holiday_month'] = day_holiday_num_df_12.loc['day_holiday_month', (2019, 12)]
-
+    # 1. target_month_num を (year, month) に変換（テストデータの予測対象月が predict_year_month）
+    predict_month_nums = pd.unique(test_df['target_month_num'])
+    if len(predict_month_nums) != 1:
+        raise ValueError(f"テストデータの予測対象月が1つではありません: {sorted(predict_month_nums)}")
+    train_month_year_df = target_month_year_months(train_df['target_month_num'], int(predict_month_nums[0]),
+                                                   predict_year_month)
+    test_month_year_df = target_month_year_months(predict_month_nums, int(predict_month_nums[0]), predict_year_month)
+
+    # 2. カレンダー表の取得（作成済みの場合は再計算しない）
+    start_year = min(datetime.strptime(start_date, '%Y-%m-%d').year, int(train_month_year_df['year'].min()))
+    end_year = max(datetime.strptime(end_date, '%Y-%m-%d').year, predict_year_month[0])
+    calendar_df = load_calendar_table(start_year, end_year, calendar_path)
+    calendar_train_df = calendar_features_by_target_month(train_month_year_df, calendar_df)
+    calendar_test_df = calendar_features_by_target_month(test_month_year_df, calendar_df)
+
+    # 3. 訓練データとテストデータにカレンダー情報をマージ
+    train_df_cal = train_df.merge(calendar_train_df, on='target_month_num', how='left')
+    test_df_cal = test_df.merge(calendar_test_df, on='target_month_num', how='left')
     return train_df_cal, test_df_cal
 
 import pandas as pd
@@ -388,10 +706,18 @@ def generate_grouped_features(df, group_cols, target_col, feature_suffixes, agg_
     Returns:
     - pd.DataFrame: 新しい特徴量が追加されたデータフレーム
     """
-    for suffix in feature_suffixes:
-        feature_name = f"{agg_func}_num_{suffix}"
-        product_num_col = f"{target_col}_{suffix}"
-        df[feature_name] = df.groupby(group_cols)[product_num_col].transform(agg_func)
+    # グループ番号は一度だけ計算し、全てのサフィックスで共有する
+    columns = [f"{target_col}_{suffix}" for suffix in feature_suffixes]
+    aggregated = group_aggregate_columns(df, group_cols, columns, agg_func)
+    for suffix, product_num_col in zip(feature_suffixes, columns):
+        dtype = df[product_num_col].dtype
+        if np.issubdtype(dtype, np.floating):
+            values = aggregated[product_num_col].astype(dtype)
+        elif agg_func == 'sum':
+            values = aggregated[product_num_col].astype(np.int64)
+        else:
+            values = aggregated[product_num_col]
+        df[f"{agg_func}_num_{suffix}"] = values
     return df
 
 # 差分特徴量生成用関数
@@ -413,6 +739,7 @@ def generate_difference_features(df, base_feature, comparison_features, new_feat
     return df
 
 # 特徴量生成のメイン関数
+@profile_stage
 def feature_engineering(train_df, test_df, group_cols, target_col, feature_suffixes, diff_features):
     """
     特徴量生成および差分計算を行うメイン関数
@@ -445,6 +772,7 @@ def feature_engineering(train_df, test_df, group_cols, target_col, feature_suffi
 import pandas as pd
 from tqdm import tqdm
 
+@profile_stage
 def create_sales_uptrend_flag(train_df, test_df, flag_num=15, test_product_ids=[2900075]):
     """
     訓練データとテストデータに対して、売上上昇傾向フラグを作成する関数。
@@ -507,6 +835,7 @@ def create_sales_uptrend_flag(train_df, test_df, flag_num=15, test_product_ids=[
 
 import pandas as pd
 
+@profile_stage
 def split_train_validation_and_sort_test(train_df_up,
                                          test_df_feats5,
                                          validation_main_flag=1,
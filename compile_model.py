@@ -0,0 +1,29 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from EBProM.compiled_model import compile_booster, save_compiled_model, benchmark_compiled_model
+from EBProM.artifacts import load_artifact
+
+# lgbm_model.txt を NumPy 配列に変換して保存し、必要に応じて Booster.predict と速度を比較するスクリプト
+def main():
+    parser = argparse.ArgumentParser(description="LightGBM モデルを NumPy の配列に変換する")
+    parser.add_argument('--model', default='Models/lgbm_model.txt', help="execute_training で保存したモデルファイル")
+    parser.add_argument('--output', default='Models/lgbm_model.npz', help="変換したモデルの保存先")
+    parser.add_argument('--benchmark-data', help="速度を比較する場合のテストデータ（execute_preprocessing の出力）")
+    parser.add_argument('--batch-sizes', default='1,10,100,1000,10000,100000,1000000',
+                        help="比較するバッチサイズ（カンマ区切り）")
+    args = parser.parse_args()
+
+    compiled = compile_booster(args.model)
+    save_compiled_model(compiled, args.output)
+    print(f"{len(compiled['roots'])} 本の木（{len(compiled['feature'])} ノード、最大の深さ {compiled['max_depth']}）"
+          f"を {args.output} に保存しました。")
+
+    if args.benchmark_data:
+        batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+        results = benchmark_compiled_model(args.model, load_artifact(args.benchmark_data), batch_sizes=batch_sizes)
+        print(results.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import sys
+import os
+import argparse
+from streamlit import config
+from streamlit.logger import set_log_level
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from EBProM.benchmark import (BENCHMARK_TIERS, run_benchmark, save_benchmark_result, load_benchmark_result,
+                              compare_benchmark_results)
+
+# 合成データで前処理・学習・予測の実行時間を計測し、ベースライン（JSON）の保存・比較を行うスクリプト
+def main():
+    parser = argparse.ArgumentParser(description="合成データによるベンチマーク")
+    parser.add_argument('--tier', choices=list(BENCHMARK_TIERS), default='small', help="データの規模")
+    parser.add_argument('--work-dir', default='benchmarks/work', help="合成データと出力の保存先")
+    parser.add_argument('--baseline-dir', default='benchmarks/baselines', help="ベースラインの保存先")
+    parser.add_argument('--save-baseline', action='store_true', help="結果を {tier}.json としてベースラインに保存する")
+    parser.add_argument('--compare', action='store_true', help="ベースラインと比較し、遅くなったステージがあれば終了コード 1 で終了する")
+    parser.add_argument('--threshold', type=float, default=0.2, help="遅くなったとみなす割合（0.2 なら 20%% 増）")
+    parser.add_argument('--min-seconds', type=float, default=0.05, help="遅くなったとみなす最小の差（秒）")
+    parser.add_argument('--repeat', type=int, default=1, help="繰り返し回数（ステージごとに最短の時間を使う）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--num-threads', type=int, default=None, help="学習・予測のスレッド数")
+    parser.add_argument('--output', help="結果の JSON を保存するファイル")
+    args = parser.parse_args()
+    # Streamlit の外で実行する際の警告を表示しない（設定の読み込み後にログレベルを変更する）
+    config.get_option('logger.level')
+    set_log_level('error')
+
+    result = run_benchmark(args.tier, args.work_dir, repeat=args.repeat, seed=args.seed, num_threads=args.num_threads)
+    for stage, seconds in result['stages'].items():
+        print(f"{stage:45s} {seconds:10.3f} 秒")
+    if args.output:
+        save_benchmark_result(result, args.output)
+
+    baseline_path = os.path.join(args.baseline_dir, f'{args.tier}.json')
+    exit_code = 0
+    if args.compare:
+        comparison = compare_benchmark_results(result, load_benchmark_result(baseline_path),
+                                               threshold=args.threshold, min_seconds=args.min_seconds)
+        print(comparison.to_string(index=False))
+        slowdowns = comparison.loc[comparison['slowdown'], 'stage'].tolist()
+        if slowdowns:
+            print(f"ベースラインより遅くなったステージ: {', '.join(slowdowns)}")
+            exit_code = 1
+        else:
+            print("ベースラインより遅くなったステージはありません。")
+    if args.save_baseline:
+        save_benchmark_result(result, baseline_path)
+        print(f"ベースラインを {baseline_path} に保存しました。")
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
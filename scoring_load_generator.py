@@ -0,0 +1,67 @@
+import sys
+import os
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import numpy as np
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from EBProM.artifacts import load_artifact
+
+# 予測 API に同時にリクエストを送り、レイテンシとスループットを計測するスクリプト
+def post_json(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+def run_client(url, columns, data, rows_per_request, n_requests, seed, latencies, errors):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_requests):
+        idx = rng.integers(0, len(data), rows_per_request)
+        start = time.perf_counter()
+        try:
+            post_json(f"{url}/predict", {'columns': columns, 'data': data[idx].tolist()})
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors.append(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="予測 API に負荷をかけてレイテンシとスループットを計測する")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--test-data', required=True, help="execute_preprocessing で保存したテストデータ")
+    parser.add_argument('--concurrency', type=int, default=16, help="同時に送信するクライアント数")
+    parser.add_argument('--requests', type=int, default=200, help="クライアントごとのリクエスト数")
+    parser.add_argument('--rows-per-request', type=int, default=1, help="1リクエストあたりの行数")
+    args = parser.parse_args()
+
+    columns = get_json(f"{args.url}/features")['features']
+    data = load_artifact(args.test_data, columns=columns)[columns].to_numpy(dtype=np.float64)
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=run_client,
+                                args=(args.url, columns, data, args.rows_per_request, args.requests, seed,
+                                      latencies, errors))
+               for seed in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    print(f"リクエスト数: {len(latencies)} (エラー {len(errors)}) / 経過時間: {elapsed:.2f} 秒")
+    if len(latencies):
+        print(f"クライアント側 p50: {np.percentile(latencies, 50) * 1000:.2f} ms / "
+              f"p99: {np.percentile(latencies, 99) * 1000:.2f} ms / "
+              f"スループット: {len(latencies) / elapsed:.1f} req/s")
+    print("サーバー側の計測値:", json.dumps(get_json(f"{args.url}/metrics"), ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import sys
+import os
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from EBProM.registry import ModelRegistry
+from EBProM.serving import MicroBatcher, request_to_frame
+from EBProM.machine_learning import PREDICTION_ID_COLUMNS
+
+# 予測 API のハンドラ
+# POST /predict : 前処理済みデータ（execute_preprocessing の出力と同じカラム）の行を受け取り、予測値を返す
+# GET /features : モデルが使う特徴量のカラム（学習時の順番）
+# GET /metrics  : p50/p99 レイテンシとスループット
+class ScoringHandler(BaseHTTPRequestHandler):
+    batcher = None
+    model_key = None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'model': self.model_key})
+        elif self.path == '/features':
+            self._send_json(200, {'features': self.batcher.feature_names})
+        elif self.path == '/metrics':
+            self._send_json(200, self.batcher.stats.snapshot())
+        else:
+            self._send_json(404, {'error': f'not found: {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': f'not found: {self.path}'})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            features_df = request_to_frame(payload)
+            missing = [col for col in self.batcher.feature_names if col not in features_df.columns]
+            if missing:
+                raise ValueError(f"特徴量のカラムが不足しています: {missing}")
+        except (ValueError, KeyError, TypeError) as e:
+            self.batcher.stats.record_error()
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            predictions = self.batcher.predict(features_df)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        body = {'predictions': predictions.tolist()}
+        for col in PREDICTION_ID_COLUMNS:
+            if col in features_df.columns:
+                body[col] = features_df[col].tolist()
+        self._send_json(200, body)
+
+    def log_message(self, format, *args):
+        # リクエストごとのログは出力しない（レイテンシは /metrics で確認する）
+        pass
+
+class ScoringServer(ThreadingHTTPServer):
+    # 同時接続が多い場合に接続が拒否されないよう、待ち行列を大きくする
+    request_queue_size = 128
+
+def main():
+    parser = argparse.ArgumentParser(description="LightGBM モデルの予測 API サーバー")
+    parser.add_argument('--model', default='Models/lgbm_model.txt', help="execute_training で保存したモデルファイル")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-rows', type=int, default=1024, help="1回の predict にまとめる最大行数")
+    parser.add_argument('--max-wait-ms', type=float, default=5, help="バッチをまとめるために待つ最大時間（ミリ秒）")
+    parser.add_argument('--num-threads', type=int, default=0, help="predict のスレッド数（0 で全コア）")
+    args = parser.parse_args()
+
+    model_key, booster = ModelRegistry().get_file(args.model)
+    ScoringHandler.model_key = model_key
+    ScoringHandler.batcher = MicroBatcher(booster, max_batch_rows=args.max_batch_rows,
+                                          max_wait_ms=args.max_wait_ms, num_threads=args.num_threads)
+
+    server = ScoringServer((args.host, args.port), ScoringHandler)
+    print(f"予測 API を http://{args.host}:{args.port} で起動しました（モデル: {model_key[:12]}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ScoringHandler.batcher.close()
+
+if __name__ == '__main__':
+    main()
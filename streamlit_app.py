@@ -3,7 +3,14 @@ import os
 import streamlit as st
 import pandas as pd
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from EBProM.execute import execute_preprocessing, execute_training, execute_prediction
+from EBProM.execute import (execute_preprocessing, execute_incremental_update, execute_training,
+                            execute_hyperparameter_search, execute_cross_validation, execute_prediction,
+                            get_job_manager, submit_job, apply_job_result, load_uploaded_file, uploaded_file_key,
+                            get_frame_cache)
+from EBProM.jobs import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from EBProM.feature_store import FeatureMatrix, is_feature_matrix
+from EBProM.machine_learning import TRAINING_PROFILES
+from EBProM.artifacts import artifact_format_from_name, ARTIFACT_EXTENSIONS, ARTIFACT_MIME_TYPES
 
 # 各タスクの完了フラグを初期化
 if "preprocessing_done" not in st.session_state:
@@ -13,10 +20,71 @@ if "training_done" not in st.session_state:
 if "prediction_done" not in st.session_state:
     st.session_state["prediction_done"] = False
 
+# 前処理済みデータとしてアップロードできるファイル形式
+ARTIFACT_UPLOAD_TYPES = [ext.lstrip('.') for ext in ARTIFACT_EXTENSIONS.values()]
+
 # データをロードするヘルパー関数
-def load_data(uploaded_file, description):
+# schema_name を指定した場合は元データの CSV として型を指定して読み込み、省略した場合は拡張子から
+# csv / parquet / feather を判定する。読み込み結果はファイルの内容ごとにキャッシュされ、再実行やセッション間で共有される
+def load_data(uploaded_file, description, schema_name=None):
     with st.spinner(f"{description}を読み込んでいます..."):
-        return pd.read_csv(uploaded_file)
+        return load_uploaded_file(uploaded_file, schema_name)
+
+# 保存済みファイルのダウンロードボタンを表示するヘルパー関数
+def artifact_download_button(path):
+    file_name = os.path.basename(path)
+    with open(path, "rb") as file:
+        st.download_button(label=f"Download {file_name}", data=file, file_name=file_name,
+                           mime=ARTIFACT_MIME_TYPES[artifact_format_from_name(file_name)])
+
+# 学習・予測に使うデータの先頭を表示するヘルパー関数（特徴量行列は先頭の行だけをメモリマップから読み込む）
+def data_preview(data, description, n_rows=100):
+    with st.expander(f"{description}のプレビュー（{len(data)} 行）"):
+        st.dataframe(data.to_frame(0, n_rows) if isinstance(data, FeatureMatrix) else data.head(n_rows))
+
+# バックグラウンドジョブの進捗を表示するヘルパー関数（1秒ごとに状態を取得し、この部分だけ再実行する）
+@st.fragment(run_every=1.0)
+def job_progress(job_state_key):
+    job_id = st.session_state.get(job_state_key)
+    if job_id is None:
+        return
+    try:
+        status = get_job_manager().status(job_id)
+    except KeyError:
+        # 保持期間を過ぎて削除されたジョブは表示しない
+        del st.session_state[job_state_key]
+        return
+
+    if status['state'] in (JOB_QUEUED, JOB_RUNNING):
+        if status['state'] == JOB_QUEUED:
+            st.info(f"ジョブ {job_id} は実行待ちです（{status['queue_position'] + 1} 番目）。")
+        else:
+            st.info(f"ジョブ {job_id} を実行中です（{status['elapsed_sec']:.0f} 秒経過）。")
+        for message in status['progress'][-5:]:
+            st.caption(message['message'])
+        if st.button("キャンセル", key=f"cancel_{job_id}"):
+            get_job_manager().cancel(job_id)
+            st.rerun()
+        return
+
+    if st.session_state.get(f"{job_state_key}_finished") != job_id:
+        # 完了したらページ全体を再実行し、結果（ダウンロードボタンなど）を表示する
+        apply_job_result(job_id)
+        st.session_state[f"{job_state_key}_finished"] = job_id
+        st.rerun()
+    # ジョブの中で処理したエラー（列名の誤りなど）は例外にならないため、進捗のエラー・警告を表示する
+    errors = [message for message in status['progress'] if message['level'] == 'error']
+    for message in status['progress']:
+        if message['level'] in ('error', 'warning'):
+            getattr(st, message['level'])(message['message'])
+    if status['state'] == JOB_DONE and errors:
+        st.error(f"ジョブ {job_id} はエラーで終了しました（{status['elapsed_sec']:.0f} 秒）。")
+    elif status['state'] == JOB_DONE:
+        st.success(f"ジョブ {job_id} が完了しました（{status['elapsed_sec']:.0f} 秒）。")
+    elif status['state'] == JOB_FAILED:
+        st.error(f"ジョブ {job_id} でエラーが発生しました: {status['error']}")
+    else:
+        st.warning(f"ジョブ {job_id} はキャンセルされました。")
 
 # Streamlitアプリケーション
 def main():
@@ -26,9 +94,11 @@ def main():
     save_dir = st.text_input("前処理データ保存ディレクトリ", value="Data/")
     model_save_dir = st.text_input("モデル保存ディレクトリ", value="Models/")
     prediction_save_dir = st.text_input("予測結果保存ディレクトリ", value="Predictions/")
+    cache_dir = st.text_input("キャッシュディレクトリ (前処理・学習用 Dataset、空欄でキャッシュ無効)", value="Cache/")
+    state_path = st.text_input("月次更新用の状態ファイル", value="State/incremental_state.pkl")
 
     # タスク選択
-    task_option = st.sidebar.radio("実行するタスクを選択してください", ("前処理", "機械学習", "予測"))
+    task_option = st.sidebar.radio("実行するタスクを選択してください", ("前処理", "月次更新", "機械学習", "予測"))
 
     if task_option == "前処理":
         sales_file = st.sidebar.file_uploader("売上データファイル (sales_history.csv)", type=["csv"], key="sales")
@@ -37,24 +107,77 @@ def main():
         test_file = st.sidebar.file_uploader("テストデータファイル (test.csv)", type=["csv"], key="test")
 
         if sales_file and item_file and category_file and test_file:
-            sales_df = load_data(sales_file, "売上データ")
-            item_df = load_data(item_file, "商品データ")
-            category_df = load_data(category_file, "カテゴリデータ")
-            test_df = load_data(test_file, "テストデータ")
+            # 大容量の売上データは全体を読み込まず、前処理の中で分割して集計する
+            stream_sales = st.checkbox("売上データを分割して読み込む（大容量データ向け）", value=False)
+            if stream_sales:
+                sales_chunksize = st.number_input("分割読み込みの行数", min_value=10000, value=1000000, step=100000)
+                sales_df = sales_file
+            else:
+                sales_chunksize = None
+                sales_df = load_data(sales_file, "売上データ", "sales_history")
+            item_df = load_data(item_file, "商品データ", "item_categories")
+            category_df = load_data(category_file, "カテゴリデータ", "category_names")
+            test_df = load_data(test_file, "テストデータ", "test")
+            metrics = get_frame_cache().metrics()
+            st.caption(f"読み込みキャッシュ: ヒット {metrics['hits']} / ミス {metrics['misses']} / "
+                       f"保持 {metrics['frames']} ファイル ({metrics['memory_mb']:.0f}MB)")
+
+            artifact_format = st.selectbox("前処理データの保存形式", list(ARTIFACT_EXTENSIONS.keys()), index=0)
+            export_csv = st.checkbox("ダウンロード用にCSVも出力する", value=False)
+            downcast = st.checkbox("データ型を縮小してメモリを節約する", value=True)
+            n_months = st.number_input("売上データの月数", min_value=13, value=22)
+            save_state = st.checkbox("月次更新用の状態を保存する", value=False)
+            n_workers = st.number_input("並列実行のワーカー数 (1で逐次実行)", min_value=1, max_value=os.cpu_count() or 1, value=1)
 
+            # 前処理はワーカープロセスで実行する（同じ入力の実行中・完了済みのジョブがあればそれを使う）
             if st.button("前処理と特徴量生成を実行"):
-                with st.spinner("前処理と特徴量生成を実行しています..."):
-                    execute_preprocessing(sales_df, item_df, category_df, test_df, save_dir)
-                st.success("前処理と特徴量生成が完了しました。")
+                st.session_state["preprocessing_job"] = submit_job(
+                    execute_preprocessing, sales_df, item_df, category_df, test_df, save_dir,
+                    artifact_format=artifact_format, export_csv=export_csv,
+                    cache_dir=cache_dir or None, downcast=downcast,
+                    sales_chunksize=sales_chunksize, n_months=n_months,
+                    incremental_state_path=state_path if save_state else None,
+                    n_workers=n_workers)
+        job_progress("preprocessing_job")
 
         # 前処理が完了した場合、ダウンロードボタンを表示
         if st.session_state["preprocessing_done"]:
-            with open(st.session_state["train_path"], "rb") as file:
-                st.download_button(label="Download train_df.csv", data=file, file_name="train_df.csv", mime="text/csv")
-            with open(st.session_state["validation_path"], "rb") as file:
-                st.download_button(label="Download validation_df.csv", data=file, file_name="validation_df.csv", mime="text/csv")
-            with open(st.session_state["test_path"], "rb") as file:
-                st.download_button(label="Download test_df.csv", data=file, file_name="test_df.csv", mime="text/csv")
+            if "stage_cache_status" in st.session_state:
+                st.write("ステージごとのキャッシュ状況")
+                st.dataframe(pd.DataFrame(st.session_state["stage_cache_status"]))
+            if "stage_profile" in st.session_state:
+                st.write("ステージごとの実行時間とメモリ使用量")
+                st.dataframe(st.session_state["stage_profile"])
+            for key in ["train", "validation", "test"]:
+                artifact_download_button(st.session_state[f"{key}_path"])
+            for path in st.session_state.get("export_paths", {}).values():
+                artifact_download_button(path)
+
+    elif task_option == "月次更新":
+        sales_file = st.sidebar.file_uploader("新しい月の売上データファイル (sales_history.csv)", type=["csv"], key="new_sales")
+        item_file = st.sidebar.file_uploader("商品データファイル (item_categories.csv)", type=["csv"], key="new_item")
+        category_file = st.sidebar.file_uploader("カテゴリデータファイル (category_names.csv)", type=["csv"], key="new_category")
+        test_file = st.sidebar.file_uploader("テストデータファイル (test.csv)", type=["csv"], key="new_test")
+
+        if not os.path.exists(state_path):
+            st.info("月次更新用の状態ファイルがありません。前処理タブで状態を保存してください。")
+        elif sales_file and item_file and category_file and test_file:
+            sales_df = load_data(sales_file, "売上データ", "sales_history")
+            item_df = load_data(item_file, "商品データ", "item_categories")
+            category_df = load_data(category_file, "カテゴリデータ", "category_names")
+            test_df = load_data(test_file, "テストデータ", "test")
+
+            # 月次更新もワーカープロセスで実行し、完了すると incremental_done などがセッションステートに反映される
+            if st.button("月次更新を実行"):
+                st.session_state["incremental_job"] = submit_job(
+                    execute_incremental_update, state_path, sales_df, item_df, category_df, test_df, save_dir,
+                    cache_dir=cache_dir or None)
+        job_progress("incremental_job")
+
+        # 月次更新が完了した場合、追加分のダウンロードボタンを表示
+        if st.session_state.get("incremental_done", False):
+            for key in ["train", "validation", "test"]:
+                artifact_download_button(st.session_state[f"incremental_{key}_path"])
 
     elif task_option == "機械学習":
         # トレーニングが完了している場合は、データの読み込みや訓練ボタンを表示せず、ダウンロードボタンのみ表示
@@ -62,43 +185,118 @@ def main():
             with open(st.session_state["model_path"], "rb") as file:
                 st.download_button(label="Download lgbm_model.txt", data=file, file_name="lgbm_model.txt", mime="text/plain")
         else:
-            # データが未読み込みの場合のみ、データを読み込む
-            train_file = st.sidebar.file_uploader("訓練データファイル (train_df.csv)", type=["csv"], key="train")
-            valid_file = st.sidebar.file_uploader("検証データファイル (validation_df.csv)", type=["csv"], key="valid")
+            data_source = st.sidebar.radio("訓練・検証データ", ("前処理の特徴量行列", "ファイルをアップロード"))
+            if data_source == "前処理の特徴量行列":
+                # メモリマップで開くだけなので、セッション間で同じページが共有され、再実行のたびに開き直しても読み込みは発生しない
+                train_matrix_path = st.sidebar.text_input(
+                    "訓練データの特徴量行列", value=st.session_state.get("train_matrix_path", os.path.join(save_dir, "train_df_matrix")))
+                valid_matrix_path = st.sidebar.text_input(
+                    "検証データの特徴量行列",
+                    value=st.session_state.get("validation_matrix_path", os.path.join(save_dir, "validation_df_matrix")))
+                if is_feature_matrix(train_matrix_path) and is_feature_matrix(valid_matrix_path):
+                    st.session_state["train_df"] = FeatureMatrix(train_matrix_path)
+                    st.session_state["valid_df"] = FeatureMatrix(valid_matrix_path)
+                    st.session_state["data_keys"] = None  # 特徴量行列は保存時のハッシュ値を使う
+                    st.session_state["data_loaded"] = True
+                else:
+                    st.info("特徴量行列がありません。前処理タブで前処理を実行してください。")
+            else:
+                # データが未読み込みの場合のみ、データを読み込む
+                train_file = st.sidebar.file_uploader("訓練データファイル (train_df)", type=ARTIFACT_UPLOAD_TYPES, key="train")
+                valid_file = st.sidebar.file_uploader("検証データファイル (validation_df)", type=ARTIFACT_UPLOAD_TYPES, key="valid")
 
-            # ファイルがアップロードされた場合にのみデータを読み込み、セッションステートに保存
-            if train_file is not None and valid_file is not None:
-                if "data_loaded" not in st.session_state:
-                    st.session_state["train_df"] = load_data(train_file, "訓練データ")
-                    st.session_state["valid_df"] = load_data(valid_file, "検証データ")
-                    st.session_state["data_loaded"] = True  # データ読み込み済みフラグ
+                # ファイルがアップロードされた場合にのみデータを読み込み、セッションステートに保存
+                if train_file is not None and valid_file is not None:
+                    if isinstance(st.session_state.get("train_df"), FeatureMatrix) or "data_loaded" not in st.session_state:
+                        st.session_state["train_df"] = load_data(train_file, "訓練データ")
+                        st.session_state["valid_df"] = load_data(valid_file, "検証データ")
+                        # Dataset のキャッシュのキーには、データフレームではなくアップロードされたファイルのハッシュ値を使う
+                        st.session_state["data_keys"] = (uploaded_file_key(train_file), uploaded_file_key(valid_file))
+                        st.session_state["data_loaded"] = True  # データ読み込み済みフラグ
 
             # データが読み込まれている場合のみトレーニング開始ボタンを表示
             if st.session_state.get("data_loaded", False):
+                data_preview(st.session_state["train_df"], "訓練データ")
+                data_preview(st.session_state["valid_df"], "検証データ")
                 num_iterations = st.number_input("学習回数を指定", min_value=1, value=1000)
+                profile = st.selectbox("学習プロファイル", list(TRAINING_PROFILES), index=1)
+                num_threads = st.number_input("スレッド数 (0 で全コア)", min_value=0, value=0)
+                max_bin = st.number_input("max_bin (0 でプロファイルの値)", min_value=0, value=0)
 
+                # 学習はワーカープロセスで実行し、完了すると training_done などがセッションステートに反映される
                 if st.button("モデルのトレーニングを開始"):
-                    with st.spinner("モデルのトレーニングを実行しています..."):
-                        execute_training(st.session_state["train_df"], st.session_state["valid_df"], model_save_dir, num_iterations)
-                        st.success("モデルのトレーニングが完了しました。")
-                        st.session_state["training_done"] = True  # トレーニング完了フラグを設定
+                    st.session_state["training_job"] = submit_job(
+                        execute_training, st.session_state["train_df"], st.session_state["valid_df"], model_save_dir,
+                        num_iterations, dataset_cache_dir=os.path.join(cache_dir, "datasets") if cache_dir else None,
+                        profile=profile, num_threads=num_threads, max_bin=max_bin,
+                        data_keys=st.session_state.get("data_keys"))
+                job_progress("training_job")
+
+                # 予測対象月ごとの時系列交差検証（学習回数の決定に使う）。学習と同じくワーカープロセスで実行する
+                if st.checkbox("時系列交差検証を行う"):
+                    cv_workers = st.number_input("並列に実行する fold 数", min_value=1, value=1)
+                    if st.button("時系列交差検証を開始"):
+                        st.session_state["cv_job"] = submit_job(
+                            execute_cross_validation, st.session_state["train_df"], st.session_state["valid_df"],
+                            model_save_dir, num_iterations,
+                            dataset_cache_dir=os.path.join(cache_dir, "datasets") if cache_dir else None,
+                            profile=profile, n_workers=cv_workers, data_keys=st.session_state.get("data_keys"))
+                    job_progress("cv_job")
+                    if "cv_results" in st.session_state:
+                        st.write(f"推奨学習回数: {st.session_state['cv_summary']['num_iterations']}")
+                        st.dataframe(st.session_state["cv_results"])
+
+                # ハイパーパラメータ探索（最良のモデルを lgbm_model.txt として保存）。ワーカープロセスで実行する
+                if st.checkbox("ハイパーパラメータ探索を行う"):
+                    search_method = st.selectbox("探索方法", ["random", "halving"])
+                    n_trials = st.number_input("試行数", min_value=1, value=20)
+                    search_workers = st.number_input("並列に実行する試行数", min_value=1, value=1)
+                    if st.button("ハイパーパラメータ探索を開始"):
+                        st.session_state["search_job"] = submit_job(
+                            execute_hyperparameter_search, st.session_state["train_df"], st.session_state["valid_df"],
+                            model_save_dir, dataset_cache_dir=os.path.join(cache_dir, "datasets") if cache_dir else None,
+                            method=search_method, n_trials=n_trials, n_workers=search_workers,
+                            max_rounds=num_iterations, base_profile=profile,
+                            data_keys=st.session_state.get("data_keys"))
+                    job_progress("search_job")
+                    if "search_results" in st.session_state:
+                        st.dataframe(st.session_state["search_results"])
 
                 # トレーニングが完了した場合、ダウンロードボタンを表示
                 if st.session_state.get("training_done", False):
+                    if "training_log_path" in st.session_state:
+                        st.write("学習プロファイルごとの実行時間・ピークメモリ・RMSE")
+                        st.dataframe(pd.read_csv(st.session_state["training_log_path"]))
                     with open(st.session_state["model_path"], "rb") as file:
                         st.download_button(label="Download lgbm_model.txt", data=file, file_name="lgbm_model.txt", mime="text/plain")
 
     elif task_option == "予測":
         model_file = st.sidebar.file_uploader("モデルファイル (lgbm_model.txt)", type=["txt"], key="model")
-        test_file = st.sidebar.file_uploader("テストデータファイル (test_df.csv)", type=["csv"], key="test")
+        test_source = st.sidebar.radio("テストデータ", ("前処理の特徴量行列", "ファイルをアップロード"))
+        if test_source == "前処理の特徴量行列":
+            # 特徴量行列はメモリマップで開き、予測時にチャンクごとに切り出す
+            test_file = st.sidebar.text_input(
+                "テストデータの特徴量行列", value=st.session_state.get("test_matrix_path", os.path.join(save_dir, "test_df_matrix")))
+            if is_feature_matrix(test_file):
+                data_preview(FeatureMatrix(test_file), "テストデータ")
+            else:
+                st.info("特徴量行列がありません。前処理タブで前処理を実行してください。")
+                test_file = None
+        else:
+            test_file = st.sidebar.file_uploader("テストデータファイル (test_df)", type=ARTIFACT_UPLOAD_TYPES, key="test")
 
         if model_file and test_file:
-            test_df = load_data(test_file, "テストデータ")
+            # テストデータは全体を読み込まず、予測時にチャンクごとに読み込む
+            chunk_size = st.number_input("予測のチャンクサイズ (行数)", min_value=1000, value=100000, step=10000)
+            num_threads = st.number_input("予測のスレッド数 (0 で全コア)", min_value=0, value=0)
 
             if st.button("予測を実行"):
                 with st.spinner("予測を実行しています..."):
-                    execute_prediction(model_file, test_df, prediction_save_dir)
+                    execute_prediction(model_file, test_file, prediction_save_dir, chunk_size=chunk_size, num_threads=num_threads)
                 st.success("予測が完了しました。")
+                metrics = st.session_state["model_registry_metrics"]
+                st.caption(f"モデルレジストリ: ヒット {metrics['hits']} / ミス {metrics['misses']} / "
+                           f"保持 {metrics['models']} モデル")
 
         # 予測が完了した場合、ダウンロードボタンを表示
         if st.session_state["prediction_done"]:
@@ -0,0 +1,52 @@
+import os
+import pandas as pd
+import EBProM.execute as execute
+from EBProM.cache import evict_cache_files
+
+def pipeline_stages():
+    return [
+        {'name': 'load', 'running_message': '', 'done_message': '',
+         'func': lambda _: pd.DataFrame({'value': range(5)})},
+        {'name': 'double', 'running_message': '', 'done_message': '',
+         'func': lambda df: df.assign(value=df['value'] * 2)},
+        {'name': 'total', 'running_message': '', 'done_message': '',
+         'func': lambda df: df.assign(total=df['value'].cumsum())},
+    ]
+
+def test_run_pipeline_stages_recomputes_entries_evicted_after_lookup(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    expected = execute.run_pipeline_stages(pipeline_stages(), cache_dir)
+    # 存在確認の後に他のセッションが削除した状態（has_stage は True を返すが、ファイルはない）
+    for name in os.listdir(cache_dir):
+        os.remove(os.path.join(cache_dir, name))
+    monkeypatch.setattr(execute, 'has_stage', lambda cache_dir, key: True)
+    kept_outputs = {'double': None}
+    result = execute.run_pipeline_stages(pipeline_stages(), cache_dir, kept_outputs=kept_outputs)
+    pd.testing.assert_frame_equal(result, expected)
+    pd.testing.assert_frame_equal(kept_outputs['double'], expected[['value']])
+    assert len(os.listdir(cache_dir)) == 3
+    # 読み込めなかったステージはヒットとして表示しない
+    assert [status['キャッシュ'] for status in execute.st.session_state['stage_cache_status']] == ['ミス'] * 3
+
+def test_run_pipeline_stages_reports_hits_only_for_loaded_stages(tmp_path):
+    cache_dir = str(tmp_path)
+    execute.run_pipeline_stages(pipeline_stages(), cache_dir)
+    # 最後のステージのエントリだけが壊れている場合、その直前のステージから再計算する
+    last_key = execute.stage_key('total', execute.stage_key('double', execute.stage_key('load')))
+    with open(os.path.join(cache_dir, f'{last_key}.pkl'), 'wb') as f:
+        f.write(b'broken')
+    execute.run_pipeline_stages(pipeline_stages(), cache_dir)
+    assert [status['キャッシュ'] for status in execute.st.session_state['stage_cache_status']] == ['ヒット', 'ヒット', 'ミス']
+
+def test_evict_cache_files_counts_every_file_under_cache_dir(tmp_path):
+    files = {'stage.pkl': 100, os.path.join('datasets', 'train.bin'): 100, 'calendar.parquet': 100,
+             os.path.join('datasets', 'new.bin'): 100, 'writing.tmp': 1000}
+    os.makedirs(tmp_path / 'datasets')
+    for mtime, (name, size) in enumerate(files.items()):
+        path = tmp_path / name
+        path.write_bytes(b'0' * size)
+        os.utime(path, (mtime, mtime))
+
+    evicted = evict_cache_files(str(tmp_path), 250)
+    assert evicted == ['stage.pkl', os.path.join('datasets', 'train.bin')]
+    assert sorted(os.listdir(tmp_path)) == ['calendar.parquet', 'datasets', 'writing.tmp']
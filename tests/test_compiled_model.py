@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import lightgbm as lgb
+from EBProM.compiled_model import compile_booster, predict_compiled
+
+def train_booster(params, x, y, categorical_feature='auto', num_boost_round=20):
+    dataset = lgb.Dataset(x, y, categorical_feature=categorical_feature)
+    return lgb.train(dict({'verbose': -1, 'min_data_in_leaf': 5}, **params), dataset, num_boost_round)
+
+@pytest.fixture(scope='module')
+def regression_data():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(2_000, 5))
+    y = 2 * x[:, 0] - x[:, 1] * x[:, 2] + rng.normal(scale=0.1, size=len(x))
+    # 欠損値の分岐も含める
+    x[rng.random(x.shape) < 0.05] = np.nan
+    return x, y
+
+@pytest.mark.parametrize('params', [{}, {'objective': 'huber'}, {'zero_as_missing': True}])
+def test_predict_compiled_matches_booster(regression_data, params):
+    x, y = regression_data
+    booster = train_booster(params, x, y)
+    np.testing.assert_allclose(predict_compiled(compile_booster(booster), x), booster.predict(x), rtol=0, atol=1e-9)
+
+def test_predict_compiled_matches_booster_with_exp_objective(regression_data):
+    x, y = regression_data
+    booster = train_booster({'objective': 'poisson'}, x, np.abs(y))
+    np.testing.assert_allclose(predict_compiled(compile_booster(booster), x), booster.predict(x), rtol=1e-9)
+
+def test_compile_booster_rejects_unsupported_models(regression_data):
+    x, y = regression_data
+    rng = np.random.default_rng(1)
+    x_cat = np.column_stack([rng.integers(0, 20, len(x)), x[:, 1]])
+    y_cat = np.where(np.isin(x_cat[:, 0], [1, 5, 9, 13]), 5.0, 0.0) + x[:, 1]
+    cases = {
+        '線形木': train_booster({'linear_tree': True}, np.nan_to_num(x), y),
+        '多クラス分類': train_booster({'objective': 'multiclass', 'num_class': 3}, x, np.arange(len(x)) % 3),
+        '目的関数 binary': train_booster({'objective': 'binary'}, x, (y > 0).astype(int)),
+        'reg_sqrt': train_booster({'reg_sqrt': True}, x, np.abs(y)),
+        'カテゴリ変数の分岐': train_booster({'cat_smooth': 1, 'min_data_per_group': 5}, x_cat, y_cat,
+                                      categorical_feature=[0]),
+    }
+    for reason, booster in cases.items():
+        with pytest.raises(ValueError, match=reason):
+            compile_booster(booster)
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+import streamlit as st
+from EBProM.utils import load_data
+from EBProM.artifacts import load_artifact
+from EBProM.execute import execute_preprocessing
+from EBProM.feature_store import FeatureMatrix, FLOAT32_EXACT_INT_LIMIT, save_feature_matrix
+from EBProM.cross_validation import time_series_cross_validation
+from test_regression import FIXTURE_DIR, N_MONTHS
+
+@pytest.fixture(scope='module')
+def preprocessed(tmp_path_factory):
+    save_dir = str(tmp_path_factory.mktemp('preprocessed'))
+    execute_preprocessing(*load_data(FIXTURE_DIR), save_dir, n_months=N_MONTHS)
+    return {key: (load_artifact(st.session_state[f'{key}_path']), FeatureMatrix(st.session_state[f'{key}_matrix_path']))
+            for key in ['train', 'validation']}
+
+def test_save_feature_matrix_rejects_ids_not_exact_in_float32(tmp_path):
+    df = pd.DataFrame({'product_id': [1, FLOAT32_EXACT_INT_LIMIT + 1], 'value': [0.5, 1.5]})
+    with pytest.raises(ValueError, match='product_id'):
+        save_feature_matrix(df, str(tmp_path), 'train_df')
+    assert list(tmp_path.iterdir()) == []
+    # キーとして別に保存し、特徴量に含めない場合は保存できる
+    matrix = FeatureMatrix(save_feature_matrix(df, str(tmp_path), 'train_df', exclude_columns=['product_id'],
+                                               id_columns=['product_id']))
+    assert matrix.ids[1, 0] == FLOAT32_EXACT_INT_LIMIT + 1
+
+def test_cross_validation_on_feature_matrices_matches_frames(preprocessed, tmp_path):
+    (train_df, train_matrix), (valid_df, valid_matrix) = preprocessed['train'], preprocessed['validation']
+    frame_results, _ = time_series_cross_validation([train_df, valid_df], str(tmp_path / 'frames'), round=20)
+    matrix_results, _ = time_series_cross_validation([train_matrix, valid_matrix], str(tmp_path / 'matrices'), round=20)
+    columns = ['target_month_num', 'n_train', 'n_valid', 'best_iteration', 'valid_rmse']
+    pd.testing.assert_frame_equal(matrix_results[columns], frame_results[columns])
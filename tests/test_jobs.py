@@ -0,0 +1,41 @@
+import time
+import pytest
+from EBProM.jobs import JobManager, JOB_DONE, FINISHED_STATES
+
+def add(a, b):
+    return a + b
+
+def wait_finished(manager, job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = manager.status(job_id)
+        if status['state'] in FINISHED_STATES and status['finished_at'] is not None:
+            return status
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+def test_submit_reruns_finished_jobs_and_evicts_old_ones():
+    manager = JobManager(max_workers=1, max_finished_jobs=1)
+    first_id = manager.submit(add, (1, 2))
+    # 実行待ち・実行中の同じジョブは共有する
+    assert manager.submit(add, (1, 2)) == first_id
+    assert wait_finished(manager, first_id)['result'] == 3
+
+    # 終了したジョブは再実行する
+    second_id = manager.submit(add, (1, 2))
+    assert second_id != first_id
+    assert wait_finished(manager, second_id)['state'] == JOB_DONE
+
+    # 終了したジョブは max_finished_jobs を超えた古いものから削除する
+    with pytest.raises(KeyError):
+        manager.status(first_id)
+    assert list(manager.list_jobs()['job_id']) == [second_id]
+
+def test_finished_jobs_expire_after_ttl():
+    manager = JobManager(max_workers=1, finished_ttl_sec=1)
+    job_id = manager.submit(add, (3, 4))
+    wait_finished(manager, job_id)
+    time.sleep(1.1)
+    manager.submit(add, (5, 6))
+    with pytest.raises(KeyError):
+        manager.status(job_id)
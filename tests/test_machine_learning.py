@@ -0,0 +1,66 @@
+import os
+import lightgbm as lgb
+import pytest
+import streamlit as st
+from EBProM import machine_learning
+from EBProM.utils import load_data
+from EBProM.artifacts import load_artifact
+from EBProM.execute import execute_preprocessing
+from EBProM.machine_learning import (DROP_COLUMNS, TARGET_COLUMN, set_data_set, dataset_cache_paths,
+                                     get_training_params, get_dataset_params, check_downcast_accuracy)
+from test_regression import FIXTURE_DIR, N_MONTHS
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    save_dir = str(tmp_path_factory.mktemp('preprocessed'))
+    execute_preprocessing(*load_data(FIXTURE_DIR), save_dir, n_months=N_MONTHS, write_feature_matrix=False)
+    return load_artifact(st.session_state['train_path']), load_artifact(st.session_state['validation_path'])
+
+def test_set_data_set_matches_dataset_from_dropped_frame(frames, tmp_path):
+    train_df, valid_df = frames
+    params = get_dataset_params(get_training_params('balanced'))
+    lgb_train, _ = set_data_set(train_df, valid_df, cache_dir=str(tmp_path / 'datasets'), params=params)
+    assert lgb_train.feature_name == [col for col in train_df.columns if col not in DROP_COLUMNS]
+
+    # 変更前と同じく説明変数のデータフレームから作成した Dataset と、ビン分割の結果が一致する
+    expected = lgb.Dataset(train_df.drop(columns=DROP_COLUMNS), train_df[TARGET_COLUMN], params=params).construct()
+    expected.save_binary(str(tmp_path / 'expected.bin'))
+    train_path, _ = dataset_cache_paths(train_df, valid_df, str(tmp_path / 'datasets'), params)
+    with open(train_path, 'rb') as f, open(tmp_path / 'expected.bin', 'rb') as g:
+        assert f.read() == g.read()
+
+def test_set_data_set_uses_data_keys_and_evicts_old_datasets(frames, tmp_path, monkeypatch):
+    train_df, valid_df = frames
+    cache_dir = str(tmp_path / 'datasets')
+    params = get_dataset_params(get_training_params('balanced'))
+
+    def fail(*frames):
+        raise AssertionError('data_keys を指定した場合はデータフレームのハッシュ値を計算しない')
+    monkeypatch.setattr(machine_learning, 'frame_fingerprint', fail)
+
+    set_data_set(train_df, valid_df, cache_dir=cache_dir, params=params, data_keys=('train-a', 'valid-a'))
+    old_paths = dataset_cache_paths(train_df, valid_df, cache_dir, params, ('train-a', 'valid-a'))
+    assert all(os.path.exists(path) for path in old_paths)
+
+    # 上限を超えた場合は古い Dataset を削除し、作成したばかりの Dataset は残す
+    size = sum(os.path.getsize(path) for path in old_paths)
+    set_data_set(train_df, valid_df, cache_dir=cache_dir, params=params, data_keys=('train-b', 'valid-b'),
+                 max_cache_bytes=size)
+    new_paths = dataset_cache_paths(train_df, valid_df, cache_dir, params, ('train-b', 'valid-b'))
+    assert all(os.path.exists(path) for path in new_paths)
+    assert not any(os.path.exists(path) for path in old_paths)
+
+    # 削除された Dataset は作り直す
+    set_data_set(train_df, valid_df, cache_dir=cache_dir, params=params, data_keys=('train-a', 'valid-a'),
+                 max_cache_bytes=None)
+    assert all(os.path.exists(path) for path in old_paths)
+
+def test_downcast_keeps_validation_accuracy(frames, tmp_path):
+    # frames は downcast=True（デフォルト）の前処理結果。元の型のまま前処理した結果と同じ seed で学習して比べる
+    execute_preprocessing(*load_data(FIXTURE_DIR), str(tmp_path), n_months=N_MONTHS, downcast=False,
+                          write_feature_matrix=False)
+    original_frames = load_artifact(st.session_state['train_path']), load_artifact(st.session_state['validation_path'])
+    assert (original_frames[0].dtypes != frames[0].dtypes).any()
+
+    result = check_downcast_accuracy(original_frames, frames, round=200, tolerance=0.01)
+    assert result['is_within_tolerance'], result
@@ -0,0 +1,37 @@
+import threading
+import tracemalloc
+from EBProM.profiling import profile_stage, profile_session
+
+@profile_stage
+def add_one(value):
+    return value + 1
+
+def test_profile_session_records_only_its_own_thread():
+    other_records = []
+
+    def run_other_session():
+        with profile_session() as records:
+            add_one(0)
+            add_one(1)
+        other_records.extend(records)
+
+    with profile_session() as records:
+        add_one(0)
+        thread = threading.Thread(target=run_other_session)
+        thread.start()
+        thread.join()
+        # セッションの外のスレッドで呼ばれた関数は記録しない
+        thread = threading.Thread(target=add_one, args=(2,))
+        thread.start()
+        thread.join()
+
+    assert [record['stage'] for record in records] == ['add_one']
+    assert [record['stage'] for record in other_records] == ['add_one', 'add_one']
+    assert records[0]['run_id'] != other_records[0]['run_id']
+
+def test_profile_session_does_not_trace_memory_by_default():
+    with profile_session() as records:
+        assert not tracemalloc.is_tracing()
+        add_one(0)
+    assert records[0]['tracemalloc_peak_mb'] is None
+    assert records[0]['peak_rss_mb'] is not None
@@ -0,0 +1,195 @@
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import streamlit as st
+from EBProM.utils import (load_data, read_sales_chunks, preprocess_data, generate_features, aggregate_sales_in_chunks,
+                          complete_catalog, fill_missing_values, fill_features, add_calendar_features,
+                          generate_sliding_window_datasets, downcast_dtypes, GROUP_AVERAGE_FEATURES)
+from EBProM.holiday_calendar import CALENDAR_COLUMNS, build_calendar_table
+from EBProM.artifacts import load_artifact
+from EBProM import execute
+from EBProM.execute import execute_preprocessing, execute_incremental_update
+from EBProM.cross_validation import time_series_folds
+
+# tests/fixtures の元データ（2018年1月〜2019年10月の22か月、4店舗 × 12商品）
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures') + os.sep
+N_MONTHS = 22
+
+@pytest.fixture(scope='module')
+def raw_data():
+    return load_data(FIXTURE_DIR)
+
+@pytest.fixture(scope='module')
+def catalog(raw_data):
+    # fill_features の入力（欠損値補完後のカタログ）
+    sales_df, item_df, category_df, test_df = raw_data
+    df = generate_features(preprocess_data(sales_df, item_df, category_df), N_MONTHS)
+    return fill_missing_values(complete_catalog(df), test_df, N_MONTHS)
+
+def reference_fill_features(join_data_df10, n_months=N_MONTHS):
+    # ベクトル化する前の fill_features（グループごとに .loc で代入する実装）
+    num_columns = [f'product_num_{i}' for i in range(1, n_months + 1)]
+    price_columns = [f'product_price_{i}' for i in range(1, n_months + 1)]
+    target_columns = ['product_id', 'store_id', 'category_id'] + num_columns + price_columns
+    join_data_df10_feats = join_data_df10[target_columns]
+
+    product_ave_num = join_data_df10_feats.groupby('product_id').mean().loc[:, num_columns[0]:num_columns[-1]].mean(axis=1)
+    product_ave_price = join_data_df10_feats.groupby('product_id').mean().loc[:, price_columns[0]:price_columns[-1]].mean(axis=1)
+    join_data_df10.insert(3, 'product_ave_num', 0.0)
+    join_data_df10.insert(4, 'product_ave_price', 0.0)
+    for product_id in product_ave_num.index:
+        join_data_df10.loc[join_data_df10['product_id'] == product_id, 'product_ave_num'] = product_ave_num[product_id]
+        join_data_df10.loc[join_data_df10['product_id'] == product_id, 'product_ave_price'] = product_ave_price[product_id]
+
+    category_ave_num = join_data_df10.groupby('category_id').mean().loc[:, num_columns[0]:num_columns[-1]].mean(axis=1)
+    category_ave_price = join_data_df10.groupby('category_id').mean().loc[:, price_columns[0]:price_columns[-1]].mean(axis=1)
+    join_data_df10.insert(5, 'category_ave_num', 0.0)
+    join_data_df10.insert(6, 'category_ave_price', 0.0)
+    for category_id in category_ave_num.index:
+        join_data_df10.loc[join_data_df10['category_id'] == category_id, 'category_ave_num'] = category_ave_num[category_id]
+        join_data_df10.loc[join_data_df10['category_id'] == category_id, 'category_ave_price'] = category_ave_price[category_id]
+
+    store_ave_num = join_data_df10.groupby('store_id').mean().loc[:, num_columns[0]:num_columns[-1]].mean(axis=1)
+    store_ave_price = join_data_df10.groupby('store_id').mean().loc[:, price_columns[0]:price_columns[-1]].mean(axis=1)
+    join_data_df10.insert(7, 'store_ave_num', 0.0)
+    join_data_df10.insert(8, 'store_ave_price', 0.0)
+    for store_id in store_ave_num.index:
+        join_data_df10.loc[join_data_df10['store_id'] == store_id, 'store_ave_num'] = store_ave_num[store_id]
+        join_data_df10.loc[join_data_df10['store_id'] == store_id, 'store_ave_price'] = store_ave_price[store_id]
+
+    join_data_df10.insert(9, 'p_c_nun', join_data_df10['product_ave_num'] * join_data_df10['category_ave_num'])
+    join_data_df10.insert(10, 'p_s_nun', join_data_df10['product_ave_num'] * join_data_df10['store_ave_num'])
+    join_data_df10.insert(11, 'c_s_nun', join_data_df10['category_ave_num'] * join_data_df10['store_ave_num'])
+    join_data_df10.insert(12, 'p_c_price', join_data_df10['product_ave_price'] * join_data_df10['category_ave_price'])
+    join_data_df10.insert(13, 'p_s_price', join_data_df10['product_ave_price'] * join_data_df10['store_ave_price'])
+    join_data_df10.insert(14, 'c_s_price', join_data_df10['category_ave_price'] * join_data_df10['store_ave_price'])
+    join_data_df10.insert(15, 'p_c_s_nun', join_data_df10['product_ave_num'] * join_data_df10['category_ave_num'] * join_data_df10['store_ave_num'])
+    join_data_df10.insert(16, 'p_c_s_price', join_data_df10['product_ave_price'] * join_data_df10['category_ave_price'] * join_data_df10['store_ave_price'])
+    return join_data_df10
+
+def test_fill_features_matches_loop_reference(catalog):
+    expected = reference_fill_features(catalog.copy(), N_MONTHS)
+    result = fill_features(catalog.copy(), n_months=N_MONTHS)
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
+
+@pytest.mark.parametrize('group_features, expected_columns, missing_columns', [
+    # キーを追加すると、そのグループ平均が訓練データ・テストデータまで残る
+    (GROUP_AVERAGE_FEATURES + [('store_category', ['store_id', 'category_id'])],
+     ['store_category_ave_num', 'store_category_ave_price', 'p_c_s_nun', 'p_c_s_price'], []),
+    # 一部のキーだけの場合は、揃っている接頭辞の組み合わせ特徴量だけを作る
+    ([('product', ['product_id']), ('store', ['store_id'])],
+     ['product_ave_num', 'store_ave_price', 'p_s_nun', 'p_s_price'],
+     ['category_ave_num', 'p_c_nun', 'c_s_price', 'p_c_s_nun']),
+])
+def test_group_features_flow_into_train_and_test(catalog, group_features, expected_columns, missing_columns):
+    catalog_feats = fill_features(catalog.copy(), group_features=group_features, n_months=N_MONTHS)
+    train_df, test_df = generate_sliding_window_datasets(catalog_feats, n_steps=N_MONTHS - 11, n_months=N_MONTHS,
+                                                         group_features=group_features)
+    for df in (train_df, test_df):
+        assert set(expected_columns) <= set(df.columns)
+        assert not set(missing_columns) & set(df.columns)
+    row = catalog_feats.iloc[0]
+    if 'store_category_ave_num' in expected_columns:
+        group = catalog_feats.loc[(catalog_feats['store_id'] == row['store_id']) &
+                                  (catalog_feats['category_id'] == row['category_id'])]
+        num_columns = [f'product_num_{i}' for i in range(1, N_MONTHS + 1)]
+        assert row['store_category_ave_num'] == pytest.approx(group[num_columns].to_numpy().mean())
+
+def test_aggregate_sales_in_chunks_matches_in_memory(raw_data):
+    sales_df, item_df, category_df, _ = raw_data
+    chunk_size = 50
+    # 1つ目のチャンクの行を2つ目のチャンクの先頭に重複させ、チャンクの境界をまたぐ重複行を作る
+    duplicated = pd.concat([sales_df.iloc[:chunk_size], sales_df.iloc[[3]], sales_df.iloc[chunk_size:]],
+                           ignore_index=True)
+    buffer = io.StringIO(duplicated.to_csv(index=False))
+
+    result = aggregate_sales_in_chunks(read_sales_chunks(buffer, chunk_size), item_df, category_df, n_months=N_MONTHS)
+    expected = generate_features(preprocess_data(duplicated, item_df, category_df), N_MONTHS)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True))
+
+def test_downcast_dtypes_widens_values_outside_schema_range():
+    df = pd.DataFrame({'month_num': [1, 130], 'product_id': [1, 2 ** 31 + 5], 'store_id': [1, 2]})
+    result = downcast_dtypes(df, verbose=False)
+    # スキーマの型は最小の幅で、値が収まらない列だけを広げる
+    assert result['month_num'].dtype == np.int16
+    assert result['product_id'].dtype == np.int64
+    assert result['store_id'].dtype == np.int32
+    pd.testing.assert_frame_equal(result.astype('int64'), df)
+
+def run_preprocessing(raw_data, save_dir, **kwargs):
+    # execute_preprocessing の出力（検証・訓練・テスト）を読み込んで返す
+    sales_df, item_df, category_df, test_df = raw_data
+    execute_preprocessing(sales_df, item_df, category_df, test_df, str(save_dir), n_months=N_MONTHS,
+                          end_date='2019-12-31', write_feature_matrix=False, **kwargs)
+    return {key: load_artifact(st.session_state[f'{key}_path']) for key in ['validation', 'train', 'test']}
+
+def test_execute_preprocessing_parallel_matches_serial(raw_data, tmp_path):
+    serial = run_preprocessing(raw_data, tmp_path / 'serial', n_workers=1)
+    parallel = run_preprocessing(raw_data, tmp_path / 'parallel', n_workers=3)
+    for key in serial:
+        pd.testing.assert_frame_equal(parallel[key], serial[key], check_exact=True)
+
+def test_incremental_update_matches_full_rebuild(raw_data, tmp_path, monkeypatch):
+    # 21か月分で前処理して状態を保存し、22か月目（2019年10月）を月次更新で追加した結果と、
+    # 22か月分をまとめて前処理した結果の同じ行を比べる（float32 の丸めを含めないよう、型は縮小しない）
+    sales_df, item_df, category_df, test_df = raw_data
+    is_last_month = pd.to_datetime(sales_df['日付']) >= '2019-10-01'
+    state_path = str(tmp_path / 'incremental_state.pkl')
+    execute_preprocessing(sales_df[~is_last_month], item_df, category_df, test_df, str(tmp_path / 'history'),
+                          n_months=N_MONTHS - 1, end_date='2019-12-31', write_feature_matrix=False,
+                          incremental_state_path=state_path, downcast=False)
+    # 月次更新は execute_preprocessing と同じく cache_dir に保存したカレンダー表を使う
+    calendar_paths = []
+    def add_calendar_features_spy(*args, calendar_path=None, **kwargs):
+        calendar_paths.append(calendar_path)
+        return add_calendar_features(*args, calendar_path=calendar_path, **kwargs)
+    monkeypatch.setattr(execute, 'add_calendar_features', add_calendar_features_spy)
+    execute_incremental_update(state_path, sales_df[is_last_month], item_df, category_df, test_df,
+                               str(tmp_path / 'incremental'), downcast=False, cache_dir=str(tmp_path / 'cache'))
+    monkeypatch.undo()
+    assert st.session_state['incremental_done']
+    assert calendar_paths == [os.path.join(str(tmp_path / 'cache'), 'calendar.parquet')]
+    incremental = {key: load_artifact(st.session_state[f'incremental_{key}_path']) for key in ['validation', 'train', 'test']}
+    full = run_preprocessing(raw_data, tmp_path / 'full', downcast=False)
+
+    def sort_rows(df):
+        return df.sort_values(['product_id', 'store_id']).reset_index(drop=True)
+
+    # 追加されるのは 22か月目を予測対象とする行（month_target=10 のため検証データには入らない）だけ
+    assert incremental['validation'].empty
+    new_rows = full['train'].loc[full['train']['target_month_num'] == N_MONTHS]
+    assert len(incremental['train']) == len(new_rows) > 0
+    for result, expected in [(incremental['train'], new_rows), (incremental['test'], full['test'])]:
+        result, expected = sort_rows(result), sort_rows(expected)
+        assert list(result.columns) == list(expected.columns)
+        np.testing.assert_allclose(result.to_numpy(dtype=np.float64), expected.to_numpy(dtype=np.float64),
+                                   rtol=0, atol=1e-4)
+
+def test_calendar_features_follow_absolute_target_month(tmp_path):
+    # 2年以上のステップを持つ訓練データでも、同じ month_target の行は年ごとのカレンダー情報になる
+    target_month_nums = np.arange(12, 37)
+    train_df = pd.DataFrame({'month_target': (target_month_nums - 1) % 12 + 1, 'target_month_num': target_month_nums})
+    test_df = pd.DataFrame({'month_target': [2], 'target_month_num': [38]})
+    calendar_path = str(tmp_path / 'calendar.parquet')
+    train_cal, test_cal = add_calendar_features(train_df, test_df, predict_year_month=(2021, 2),
+                                                calendar_path=calendar_path)
+
+    calendar_df = build_calendar_table(2018, 2021).set_index(['year', 'month'])
+    expected = calendar_df.loc[[(2018 + (m - 1) // 12, (m - 1) % 12 + 1) for m in target_month_nums], CALENDAR_COLUMNS]
+    np.testing.assert_array_equal(train_cal[CALENDAR_COLUMNS].to_numpy(), expected.to_numpy())
+    np.testing.assert_array_equal(test_cal[CALENDAR_COLUMNS].to_numpy(), calendar_df.loc[[(2021, 2)], CALENDAR_COLUMNS].to_numpy())
+    assert os.listdir(tmp_path) == ['calendar.parquet']
+
+def test_time_series_folds_order_by_absolute_target_month():
+    # month_target が同じでも年の異なる行は、それより後の fold の訓練データにだけ含まれる
+    target_month_nums = np.repeat(np.arange(12, 37), 4)
+    train_df_up = pd.DataFrame({'main_flag': np.tile([0, 1], len(target_month_nums) // 2),
+                                'month_target': (target_month_nums - 1) % 12 + 1,
+                                'target_month_num': target_month_nums})
+    folds = time_series_folds(train_df_up)
+    assert [fold['target_month_num'] for fold in folds] == list(range(13, 37))
+    for fold in folds:
+        assert (target_month_nums[fold['train_idx']] < fold['target_month_num']).all()
+        assert (target_month_nums[fold['valid_idx']] == fold['target_month_num']).all()
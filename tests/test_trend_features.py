@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+from EBProM.trend_features import group_aggregate_columns
+from EBProM.utils import generate_grouped_features
+
+@pytest.fixture
+def grouped_df():
+    return pd.DataFrame({
+        'store_id': [1, 1, 2, 2, 2, 3],
+        'category_id': [10, 10, 10, 20, 20, 30],
+        'product_num_1': [1, 4, 2, 3, 5, 7],
+        'product_num_2': np.array([1.5, np.nan, 2.0, 3.0, np.nan, np.nan], dtype=np.float32),
+        'product_num_3': [1.0, np.nan, 2.0, 3.0, 4.0, 5.0],
+    })
+
+@pytest.mark.parametrize('agg_func', ['sum', 'mean'])
+@pytest.mark.parametrize('group_cols', [['store_id'], ['store_id', 'category_id']])
+def test_group_aggregate_columns_matches_transform(grouped_df, group_cols, agg_func):
+    columns = ['product_num_1', 'product_num_2', 'product_num_3']
+    result = group_aggregate_columns(grouped_df, group_cols, columns, agg_func)
+    for col in columns:
+        expected = grouped_df.groupby(group_cols)[col].transform(agg_func).to_numpy(dtype=np.float64)
+        np.testing.assert_allclose(result[col], expected, rtol=1e-6)
+
+def test_group_aggregate_columns_skips_nan():
+    df = pd.DataFrame({'g': [0, 0, 1, 1], 'x': [1.0, np.nan, 2.0, 3.0]})
+    np.testing.assert_array_equal(group_aggregate_columns(df, ['g'], ['x'], 'sum')['x'], [1.0, 1.0, 5.0, 5.0])
+    np.testing.assert_array_equal(group_aggregate_columns(df, ['g'], ['x'], 'mean')['x'], [1.0, 1.0, 2.5, 2.5])
+
+@pytest.mark.parametrize('agg_func', ['sum', 'mean'])
+def test_generate_grouped_features_matches_transform(grouped_df, agg_func):
+    result = generate_grouped_features(grouped_df.copy(), ['store_id', 'category_id'], 'product_num', [1, 2, 3], agg_func)
+    for suffix in [1, 2, 3]:
+        expected = grouped_df.groupby(['store_id', 'category_id'])[f'product_num_{suffix}'].transform(agg_func)
+        pd.testing.assert_series_equal(result[f'{agg_func}_num_{suffix}'], expected, check_names=False)